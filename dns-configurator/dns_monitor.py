@@ -9,43 +9,105 @@ import os
 import sys
 import time
 import re
+import json
+import struct
+import functools
 import subprocess
 import logging
-from logging.handlers import RotatingFileHandler
+# asyncio、random、logging.handlers 在用到时才导入，缩短 launchd 每次启动的时间
+try:
+    # 进程内读取ARP表（router-monitor/net_tables.py，与本脚本放在同一目录）；不可用时使用 arp 命令
+    import net_tables
+except ImportError:
+    net_tables = None
+try:
+    # 非阻塞的 JSON lines 日志管道（router-monitor/monitor_logging.py，与本脚本放在同一目录）；不可用时以纯文本写入日志文件
+    import monitor_logging
+except ImportError:
+    monitor_logging = None
+try:
+    # 常驻预热进程（router-monitor/warm_helper.py，与本脚本放在同一目录）；不可用时不支持 warm 模式
+    import warm_helper
+except ImportError:
+    warm_helper = None
+try:
+    # 各阶段的次数和耗时指标（router-monitor/monitor_metrics.py，与本脚本放在同一目录）；不可用时不记录指标
+    import monitor_metrics
+except ImportError:
+    monitor_metrics = None
 
 # 配置
 SPECIFIC_NETWORK_IPS = ["<SPECIFIC_NETWORK_IP1>", "<SPECIFIC_NETWORK_IP2>", "<SPECIFIC_NETWORK_IP3>"]  # 特定网络的ARP IP地址（替换为实际IP）
 SPECIFIC_DNS = "<SPECIFIC_DNS>"             # 特定网络的DNS地址（替换为实际DNS）
+CANDIDATE_DNS = [SPECIFIC_DNS]              # 特定网络的候选DNS地址，测速后按快慢顺序设置（只有一个时不测速）
+DNS_SERVICES = ["Wi-Fi"]                    # 管理DNS的网络服务，None 表示所有已启用的服务
 LOG_DIR = "~/Library/LaunchAgents"          # 日志目录
 LOG_FILE = os.path.join(os.path.expanduser(LOG_DIR), "dns_monitor.log")  # 日志文件路径
 CHECK_INTERVAL = 5                          # 检查间隔（秒）
 MAX_RETRY_TIME = 750                        # 最大重试时间（12.5分钟）
+BENCHMARK_SITES = ["www.baidu.com", "www.taobao.com", "www.qq.com", "www.bilibili.com", "www.163.com", "www.douyin.com", "home.mi.com"]  # 测速用的域名
+BENCHMARK_ROUNDS = 3                        # 每个域名查询的轮数
+DNS_QUERY_TIMEOUT = 1.0                     # 单次查询超时（秒），超时计为丢包
+DNS_PORT = 53                               # DNS端口
+BENCHMARK_TTL = 3600                        # 测速结果的缓存时间（秒）
+BENCHMARK_FILE = os.path.join(os.path.expanduser(LOG_DIR), "dns_benchmark.json")  # 测速结果缓存文件
+MAX_LOSS_RATE = 0.2                         # 丢包率超过该值的DNS视为不可用
+MAX_DNS_SERVERS = 3                         # 最多设置的DNS数量
+METRICS_PORT = None                         # 指标HTTP端口（只监听127.0.0.1，预热模式下可用），None 表示不启动
+METRICS_TEXTFILE = None                     # 指标文件路径（如 node_exporter textfile collector 目录下的 dns_monitor.prom），None 表示不写入
 
 # 日志设置
 os.makedirs(os.path.expanduser(LOG_DIR), exist_ok=True)
 
-class CustomFormatter(logging.Formatter):
-    def format(self, record):
-        return f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n[{self.formatTime(record)}] {record.levelname}\n{record.getMessage()}"
-
 def initialize_logger():
-    """初始化日志系统"""
-    handler = RotatingFileHandler(
-        LOG_FILE,
-        maxBytes=1024*300,  # 300KB 约300条日志
-        backupCount=1,
-        encoding='utf-8'
-    )
-    handler.setFormatter(CustomFormatter())
-    
-    logger = logging.getLogger("DNSMonitor")
-    logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
+    """初始化日志系统，monitor_logging.py 不可用时以纯文本追加写入日志文件（不轮转）"""
+    if monitor_logging is not None:
+        logger = monitor_logging.setup_logger("DNSMonitor", LOG_FILE)
+    else:
+        logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format="[%(asctime)s] %(levelname)s %(message)s")
+        logger = logging.getLogger("DNSMonitor")
     
     logger.info("▶▶▶ DNS监控启动")
     return logger
 
+# 指标
+metrics = None
+
+def initialize_metrics():
+    """按 METRICS_PORT / METRICS_TEXTFILE 初始化指标，未配置或 monitor_metrics.py 不可用时不记录"""
+    global metrics
+    if monitor_metrics is not None and metrics is None:
+        try:
+            metrics = monitor_metrics.setup_metrics(METRICS_PORT, METRICS_TEXTFILE)
+        except OSError as e:
+            logger.error(f"指标初始化失败: {str(e)}")
+    return metrics
+
+def timed(stage):
+    """装饰器：记录函数作为一个阶段的次数和耗时"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if metrics is None:
+                return func(*args, **kwargs)
+            with metrics.stage("dns_monitor", stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count_metric(name, labels=None, help_text=None):
+    if metrics is not None:
+        metrics.inc(name, labels, help_text=help_text)
+
+def observe_reconnect(started_at, state):
+    """记录从检测到网络变化（或开始检查）到DNS配置完成的耗时"""
+    if metrics is not None:
+        metrics.observe("reconnect_seconds", time.time() - started_at, {"monitor": "dns_monitor", "state": state},
+                        "从检测到网络变化到动作完成的耗时（秒）")
+        metrics.flush()
+
 # 工具函数
+@timed("dns_flush")
 def flush_dns():
     """刷新DNS缓存"""
     try:
@@ -56,8 +118,21 @@ def flush_dns():
     except subprocess.CalledProcessError as e:
         logger.error(f"DNS刷新失败: {str(e)}")
 
+@timed("arp_check")
 def check_specific_network():
     """检查是否为特定网络IP"""
+    if net_tables is not None and net_tables.get_backend() is not None:
+        try:
+            arp_table = net_tables.read_arp_table()
+            for ip in SPECIFIC_NETWORK_IPS:
+                if ip in arp_table:
+                    logger.info(f"检测到特定网络: {ip}")
+                    return True
+            logger.info("未检测到特定网络")
+            return False
+        except OSError as e:
+            logger.info(f"进程内读取ARP表失败: {str(e)}，使用arp命令...")
+    
     try:
         arp_output = subprocess.check_output(["arp", "-a"], text=True, stderr=subprocess.DEVNULL)
         for ip in SPECIFIC_NETWORK_IPS:
@@ -70,27 +145,274 @@ def check_specific_network():
         logger.error(f"特定网络检查失败: {str(e)}")
         return False
 
-def configure_specific_dns(should_set):
-    """配置或清除特定网络DNS"""
+# DNS测速
+def build_dns_query(query_id, domain):
+    """构造查询 A 记录的 DNS 请求报文（RD=1）"""
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    qname = b"".join(bytes([len(label)]) + label.encode("ascii") for label in domain.strip(".").split(".")) + b"\0"
+    return header + qname + struct.pack("!HH", 1, 1)
+
+class DnsQueryProtocol:
+    """
+    一个DNS一个UDP套接字，按报文ID把应答分发给等待中的查询
+    实现 asyncio 数据报协议的接口，不继承 asyncio.DatagramProtocol，以免导入本模块时就导入 asyncio
+    """
+    def __init__(self):
+        self.pending = {}
+
+    def connection_made(self, transport):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        query_id, flags = struct.unpack_from("!HH", data)
+        future = self.pending.pop(query_id, None)
+        if future is not None and not future.done():
+            future.set_result(flags & 0xF)
+
+    def error_received(self, exc):
+        # ICMP 端口不可达等错误：让所有等待中的查询失败
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+async def _timed_query(transport, protocol, domain, timeout):
+    """发送一次查询，返回耗时（毫秒）；超时、出错或应答为 SERVFAIL/REFUSED 时返回 None"""
+    import random
+    import asyncio
+    loop = asyncio.get_running_loop()
+    query_id = random.randrange(0x10000)
+    while query_id in protocol.pending:
+        query_id = random.randrange(0x10000)
+    future = loop.create_future()
+    protocol.pending[query_id] = future
+    start = time.perf_counter()
     try:
-        if should_set:
-            logger.info(f"设置特定网络DNS: {SPECIFIC_DNS}")
-            subprocess.run([
-                "networksetup", "-setdnsservers", "Wi-Fi", SPECIFIC_DNS
-            ], check=True)
-        else:
-            logger.info("清除DNS配置")
-            subprocess.run([
-                "networksetup", "-setdnsservers", "Wi-Fi", "Empty"
-            ], check=False)
-            subprocess.run([
-                "networksetup", "-setdnsservers", "Wi-Fi", ""
-            ], check=False)
-        flush_dns()
-        return True
-    except subprocess.CalledProcessError as e:
+        transport.sendto(build_dns_query(query_id, domain))
+        rcode = await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        protocol.pending.pop(query_id, None)
+    # NOERROR 和 NXDOMAIN 都说明DNS正常应答
+    if rcode not in (0, 3):
+        return None
+    return (time.perf_counter() - start) * 1000
+
+async def _benchmark_resolver(resolver, sites, rounds, timeout, port):
+    """对一个DNS测速：每轮并发查询所有域名，返回每次查询的耗时列表（丢包为 None）"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(DnsQueryProtocol, remote_addr=(resolver, port))
+    except OSError:
+        return [None] * (len(sites) * rounds)
+    try:
+        latencies = []
+        for _ in range(rounds):
+            latencies += await asyncio.gather(*(_timed_query(transport, protocol, site, timeout) for site in sites))
+        return latencies
+    finally:
+        transport.close()
+
+def percentile(values, pct):
+    """最近秩百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, -(-len(ordered) * pct // 100) - 1)
+    return ordered[int(index)]
+
+def summarize_latencies(latencies):
+    """汇总为 {"p50": 毫秒, "p95": 毫秒, "loss": 丢包率, "samples": 查询次数}"""
+    answered = [latency for latency in latencies if latency is not None]
+    p50, p95 = percentile(answered, 50), percentile(answered, 95)
+    return {
+        "p50": round(p50, 2) if p50 is not None else None,
+        "p95": round(p95, 2) if p95 is not None else None,
+        "loss": round(1 - len(answered) / len(latencies), 3) if latencies else 1.0,
+        "samples": len(latencies),
+    }
+
+@timed("benchmark")
+def benchmark_resolvers(resolvers, sites=BENCHMARK_SITES, rounds=BENCHMARK_ROUNDS, timeout=DNS_QUERY_TIMEOUT, port=DNS_PORT):
+    """
+    并发测试所有候选DNS（不调用 dig，直接发送 UDP 查询）
+
+    Returns:
+        {DNS地址: summarize_latencies() 的结果}
+    """
+    import asyncio
+    async def run():
+        results = await asyncio.gather(*(_benchmark_resolver(resolver, sites, rounds, timeout, port) for resolver in resolvers))
+        return {resolver: summarize_latencies(latencies) for resolver, latencies in zip(resolvers, results)}
+    return asyncio.run(run())
+
+def rank_resolvers(results, max_loss=MAX_LOSS_RATE, limit=MAX_DNS_SERVERS):
+    """按 p50、p95 从快到慢排列丢包率不超过 max_loss 的DNS，最多返回 limit 个"""
+    healthy = [resolver for resolver, stats in results.items()
+               if stats["p50"] is not None and stats["loss"] <= max_loss]
+    healthy.sort(key=lambda resolver: (results[resolver]["p50"], results[resolver]["p95"]))
+    return healthy[:limit]
+
+def load_benchmark(resolvers, ttl=BENCHMARK_TTL):
+    """读取未过期且候选列表相同的测速结果，没有时返回 None"""
+    try:
+        with open(BENCHMARK_FILE, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["resolvers"] != list(resolvers) or time.time() - cached["measured_at"] > ttl:
+            return None
+        return cached["results"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_benchmark(resolvers, results):
+    """保存测速结果（先写临时文件再替换）"""
+    tmp_path = BENCHMARK_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"measured_at": time.time(), "resolvers": list(resolvers), "results": results}, f, ensure_ascii=False)
+        os.replace(tmp_path, BENCHMARK_FILE)
+    except OSError as e:
+        logger.warning(f"保存DNS测速结果失败: {str(e)}")
+
+def get_benchmark(resolvers=None, force=False):
+    """返回候选DNS的测速结果，缓存未过期时直接使用缓存"""
+    resolvers = list(resolvers or CANDIDATE_DNS)
+    results = None if force else load_benchmark(resolvers)
+    if results is None:
+        logger.info(f"开始DNS测速: {', '.join(resolvers)}")
+        results = benchmark_resolvers(resolvers)
+        save_benchmark(resolvers, results)
+        for resolver, stats in results.items():
+            logger.info(f"DNS测速 {resolver}: p50={stats['p50']}ms p95={stats['p95']}ms 丢包率={stats['loss']:.0%}")
+    return results
+
+def select_dns_servers(resolvers=None, benchmark=True):
+    """
+    按测速结果选出要设置的DNS（从快到慢）
+    只有一个候选时不测速；没有可用的DNS时按配置顺序使用全部候选
+    benchmark 为 False 时（演习）只使用未过期的缓存结果，不发送查询、不写入缓存文件；没有缓存时按配置顺序
+    """
+    resolvers = list(resolvers or CANDIDATE_DNS)
+    if len(resolvers) <= 1:
+        return resolvers
+    if benchmark:
+        results = get_benchmark(resolvers)
+    else:
+        results = load_benchmark(resolvers)
+        if results is None:
+            logger.info("没有未过期的DNS测速结果，演习中不测速，按配置顺序显示")
+            return resolvers[:MAX_DNS_SERVERS]
+    ranked = rank_resolvers(results)
+    if not ranked:
+        logger.warning("测速中没有可用的DNS，按配置顺序设置")
+        return resolvers[:MAX_DNS_SERVERS]
+    return ranked
+
+# DNS配置
+class NetworksetupBackend:
+    """通过 networksetup 读写各网络服务的DNS；空列表表示未手动设置（使用DHCP下发的DNS）"""
+    def services(self):
+        """已启用的网络服务（networksetup 用 * 标记已停用的服务）"""
+        output = subprocess.check_output(["networksetup", "-listallnetworkservices"], text=True)
+        return [line for line in output.splitlines()[1:] if line and not line.startswith("*")]
+
+    def get_servers(self, service):
+        output = subprocess.check_output(["networksetup", "-getdnsservers", service], text=True)
+        # 未设置时输出 "There aren't any DNS Servers set on Wi-Fi."
+        return [line.strip() for line in output.splitlines() if re.fullmatch(r"[0-9A-Fa-f.:]+", line.strip())]
+
+    def set_servers(self, service, servers):
+        subprocess.run(["networksetup", "-setdnsservers", service, *(servers or ["Empty"])], check=True)
+
+class MemoryBackend:
+    """保存在内存中的DNS配置，用于测试和演示；changes 记录每次写入"""
+    def __init__(self, config=None):
+        self.config = {service: list(servers) for service, servers in (config or {"Wi-Fi": []}).items()}
+        self.changes = []
+
+    def services(self):
+        return list(self.config)
+
+    def get_servers(self, service):
+        return list(self.config.get(service, []))
+
+    def set_servers(self, service, servers):
+        self.config[service] = list(servers)
+        self.changes.append((service, list(servers)))
+
+def desired_dns_state(should_set, backend, benchmark=True):
+    """
+    期望的DNS配置 {网络服务: [DNS地址]}，特定网络时为测速排序后的DNS，否则为空（清除）
+    benchmark 见 select_dns_servers
+    """
+    services = DNS_SERVICES if DNS_SERVICES is not None else backend.services()
+    servers = select_dns_servers(benchmark=benchmark) if should_set else []
+    return {service: list(servers) for service in services}
+
+def diff_dns_state(desired, backend):
+    """与当前配置比较，返回需要修改的 [(网络服务, 当前DNS, 期望DNS)]；DNS顺序不同也算修改"""
+    changes = []
+    for service, servers in desired.items():
+        current = backend.get_servers(service)
+        if current != servers:
+            changes.append((service, current, servers))
+    return changes
+
+def format_dns_diff(changes):
+    """把差异格式化为可读的文本"""
+    if not changes:
+        return "DNS配置无需修改"
+    return "\n".join(f"{service}: {', '.join(current) or 'Empty'} → {', '.join(servers) or 'Empty'}"
+                     for service, current, servers in changes)
+
+def reconcile_dns(desired, backend=None, dry_run=False):
+    """
+    把DNS配置调整为期望状态：先读取并比较全部网络服务，再一次性只写入有差异的服务
+
+    Args:
+        desired: {网络服务: [DNS地址]}
+        backend: DNS配置的读写方式，默认 NetworksetupBackend
+        dry_run: 为 True 时只计算差异，不写入
+
+    Returns:
+        差异列表 [(网络服务, 当前DNS, 期望DNS)]
+    """
+    backend = backend or NetworksetupBackend()
+    changes = diff_dns_state(desired, backend)
+    logger.info(("DNS配置差异（演习）:\n" if dry_run else "DNS配置差异:\n") + format_dns_diff(changes))
+    if not dry_run:
+        for service, _, servers in changes:
+            backend.set_servers(service, servers)
+    return changes
+
+@timed("dns_config")
+def configure_specific_dns(should_set, flush=True, backend=None, dry_run=False):
+    """
+    配置或清除特定网络DNS，配置已经符合期望时不做任何修改
+    只有实际修改了配置才刷新DNS缓存；flush 为 False 时不刷新（由调用方统一刷新）
+
+    Returns:
+        是否修改了DNS配置（dry_run 时为是否需要修改）
+    """
+    backend = backend or NetworksetupBackend()
+    try:
+        logger.info("设置特定网络DNS" if should_set else "清除DNS配置")
+        changes = reconcile_dns(desired_dns_state(should_set, backend, benchmark=not dry_run), backend, dry_run)
+    except (OSError, subprocess.CalledProcessError) as e:
         logger.error(f"特定网络DNS配置失败: {str(e)}")
         return False
+    if not dry_run:
+        count_metric("dns_reconcile_total", {"result": "changed" if changes else "unchanged"}, "DNS配置检查次数（按是否修改）")
+    if changes and flush and not dry_run:
+        flush_dns()
+    return bool(changes)
 
 def handle_specific_network_found():
     """处理检测到特定网络的情况"""
@@ -104,24 +426,46 @@ def handle_normal_network():
     configure_specific_dns(False)
     return True
 
-def dns_monitor():
-    """主DNS监控函数"""
-    global logger
-    logger = initialize_logger()
+def check_dns(event_time=None):
+    """
+    检查一次网络并配置DNS
+    event_time 为事件发生的时间（预热模式由 warm_helper 传入），用于记录检测到动作完成的耗时
+    """
     start_time = time.time()
-    
     try:
         while (time.time() - start_time) < MAX_RETRY_TIME:
             if check_specific_network():
                 handle_specific_network_found()
+                observe_reconnect(event_time or start_time, "SPECIFIC")
                 break
             else:
                 handle_normal_network()
+                observe_reconnect(event_time or start_time, "NORMAL")
                 break
         else:
             logger.warning("超时：未检测到有效网络信息")
     except Exception as e:
         logger.error(f"监控异常: {str(e)}")
+
+def dns_monitor():
+    """主DNS监控函数"""
+    global logger
+    logger = initialize_logger()
+    initialize_metrics()
+    try:
+        check_dns()
+    finally:
+        logger.info("◀◀◀ DNS监控结束")
+
+def dns_warm():
+    """预热模式：常驻运行，warm_helper.py 通过 Unix 套接字交来的每个事件执行一次 check_dns()"""
+    global logger
+    logger = initialize_logger()
+    initialize_metrics()
+    try:
+        warm_helper.serve(warm_helper.socket_path(__file__), check_dns, logger)
+    except KeyboardInterrupt:
+        pass
     finally:
         logger.info("◀◀◀ DNS监控结束")
 
@@ -138,9 +482,38 @@ def debug_dns():
     is_specific = check_specific_network()
     print(f"是否为特定网络: {is_specific}")
 
+def diff_dns():
+    """演习模式：检查网络并打印需要做的DNS修改，不写入配置、不刷新缓存，也不测速（只使用已缓存的测速结果）"""
+    global logger
+    logger = initialize_logger()
+    backend = NetworksetupBackend()
+    changes = diff_dns_state(desired_dns_state(check_specific_network(), backend, benchmark=False), backend)
+    print(format_dns_diff(changes))
+
+def bench_dns():
+    """测速模式：重新测试所有候选DNS并打印排序结果"""
+    global logger
+    logger = initialize_logger()
+    results = get_benchmark(force=True)
+    ranked = rank_resolvers(results)
+    print("=== DNS测速结果 ===")
+    for resolver in ranked + [r for r in results if r not in ranked]:
+        stats = results[resolver]
+        mark = f"#{ranked.index(resolver) + 1}" if resolver in ranked else "不可用"
+        print(f"{resolver}: p50={stats['p50']}ms p95={stats['p95']}ms 丢包率={stats['loss']:.0%} ({stats['samples']}次) {mark}")
+
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "debug":
         debug_dns()
+    elif len(sys.argv) > 1 and sys.argv[1] == "diff":
+        diff_dns()
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench_dns()
+    elif len(sys.argv) > 1 and sys.argv[1] == "warm":
+        if warm_helper is None:
+            print("预热模式需要与本脚本放在同一目录的 warm_helper.py")
+            sys.exit(1)
+        dns_warm()
     else:
         dns_monitor()
     sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dns_monitor 的单元测试（只使用标准库 unittest）
+测速部分使用本机回环地址上的模拟DNS服务器，不访问外部网络
+
+用法:
+    python3 -m unittest test_dns_monitor
+    python3 -m pytest test_dns_monitor.py
+"""
+
+import os
+import socket
+import struct
+import logging
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import dns_monitor
+
+RCODE_NXDOMAIN = 3
+RCODE_SERVFAIL = 2
+
+
+class StubDnsServer:
+    """
+    只回显报文ID的UDP DNS服务器：按 delay 秒延迟应答，rcode 为应答码，drop 为 True 时不应答
+    """
+    def __init__(self, host, port=0, delay=0.0, rcode=0, drop=False):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.05)
+        self.port = self.sock.getsockname()[1]
+        self.delay, self.rcode, self.drop = delay, rcode, drop
+        self.queries = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.queries += 1
+            if self.drop or len(data) < 12:
+                continue
+            reply = data[:2] + struct.pack("!H", 0x8180 | self.rcode) + data[4:]
+            timer = threading.Timer(self.delay, self.reply, (reply, addr))
+            timer.daemon = True
+            timer.start()
+
+    def reply(self, data, addr):
+        try:
+            self.sock.sendto(data, addr)
+        except OSError:
+            pass
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+class BenchmarkTest(unittest.TestCase):
+    """benchmark_resolvers 对模拟DNS服务器测速，rank_resolvers 排序"""
+
+    def setUp(self):
+        dns_monitor.logger = logging.getLogger("test_dns_monitor")
+        # 所有候选使用同一端口，因此每个模拟服务器占用一个 127.0.0.x 地址
+        self.servers = []
+        first = self.start("127.0.0.1", 0)
+        self.port = first.port
+        try:
+            self.start("127.0.0.2", self.port, delay=0.08)
+            self.start("127.0.0.3", self.port, delay=0.02, rcode=RCODE_NXDOMAIN)
+            self.start("127.0.0.4", self.port, drop=True)
+            self.start("127.0.0.5", self.port, rcode=RCODE_SERVFAIL)
+        except OSError as e:
+            self.tearDown()
+            self.skipTest(f"无法绑定回环地址: {e}")
+
+    def start(self, host, port, **kwargs):
+        server = StubDnsServer(host, port, **kwargs)
+        self.servers.append(server)
+        return server
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
+
+    def test_ranks_by_latency_and_drops_unhealthy(self):
+        resolvers = ["127.0.0.2", "127.0.0.4", "127.0.0.1", "127.0.0.5", "127.0.0.3"]
+        results = dns_monitor.benchmark_resolvers(resolvers, sites=["a.test", "b.test"], rounds=2, timeout=0.3, port=self.port)
+        self.assertEqual(set(results), set(resolvers))
+        for server in self.servers:
+            self.assertEqual(server.queries, 4)
+        self.assertEqual(results["127.0.0.1"]["loss"], 0)
+        self.assertEqual(results["127.0.0.3"]["loss"], 0)
+        self.assertEqual(results["127.0.0.4"], {"p50": None, "p95": None, "loss": 1.0, "samples": 4})
+        self.assertEqual(results["127.0.0.5"]["loss"], 1.0)
+        self.assertGreaterEqual(results["127.0.0.2"]["p50"], 80)
+        self.assertEqual(dns_monitor.rank_resolvers(results), ["127.0.0.1", "127.0.0.3", "127.0.0.2"])
+        self.assertEqual(dns_monitor.rank_resolvers(results, limit=1), ["127.0.0.1"])
+
+
+class ReconcileTest(unittest.TestCase):
+    """通过 MemoryBackend 检查差异计算、演习、幂等和只在修改时刷新缓存"""
+
+    SERVERS = ["10.0.0.53", "10.0.0.54"]
+
+    def setUp(self):
+        dns_monitor.logger = logging.getLogger("test_dns_monitor")
+        self.flush = mock.patch.object(dns_monitor, "flush_dns").start()
+        mock.patch.object(dns_monitor, "select_dns_servers", return_value=list(self.SERVERS)).start()
+        mock.patch.object(dns_monitor, "DNS_SERVICES", ["Wi-Fi", "Ethernet"]).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_diff_only_reports_mismatched_services(self):
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": self.SERVERS, "Ethernet": self.SERVERS[::-1]})
+        desired = dns_monitor.desired_dns_state(True, backend)
+        self.assertEqual(dns_monitor.diff_dns_state(desired, backend), [("Ethernet", self.SERVERS[::-1], self.SERVERS)])
+
+    def test_dry_run_does_not_write(self):
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": [], "Ethernet": []})
+        self.assertTrue(dns_monitor.configure_specific_dns(True, backend=backend, dry_run=True))
+        self.assertEqual(backend.changes, [])
+        self.flush.assert_not_called()
+
+    def test_second_run_changes_nothing(self):
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": [], "Ethernet": self.SERVERS})
+        self.assertTrue(dns_monitor.configure_specific_dns(True, backend=backend))
+        self.assertEqual(backend.changes, [("Wi-Fi", self.SERVERS)])
+        self.assertEqual(self.flush.call_count, 1)
+        self.assertFalse(dns_monitor.configure_specific_dns(True, backend=backend))
+        self.assertEqual(len(backend.changes), 1)
+        self.assertEqual(self.flush.call_count, 1)
+
+    def test_clear_and_flush_option(self):
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": self.SERVERS, "Ethernet": []})
+        self.assertTrue(dns_monitor.configure_specific_dns(False, flush=False, backend=backend))
+        self.assertEqual(backend.config, {"Wi-Fi": [], "Ethernet": []})
+        self.flush.assert_not_called()
+
+    def test_all_services_when_not_configured(self):
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": [], "USB LAN": []})
+        with mock.patch.object(dns_monitor, "DNS_SERVICES", None):
+            changes = dns_monitor.reconcile_dns(dns_monitor.desired_dns_state(True, backend), backend)
+        self.assertEqual([service for service, _, _ in changes], ["Wi-Fi", "USB LAN"])
+        self.assertEqual(backend.config, {"Wi-Fi": self.SERVERS, "USB LAN": self.SERVERS})
+
+
+class DryRunBenchmarkTest(unittest.TestCase):
+    """演习不测速、不写入测速缓存，只使用未过期的缓存排序"""
+
+    CANDIDATES = ["10.0.0.53", "10.0.0.54"]
+
+    def setUp(self):
+        dns_monitor.logger = logging.getLogger("test_dns_monitor")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = os.path.join(self.tmp.name, "dns_benchmark.json")
+        self.benchmark = mock.patch.object(dns_monitor, "benchmark_resolvers").start()
+        self.flush = mock.patch.object(dns_monitor, "flush_dns").start()
+        mock.patch.object(dns_monitor, "BENCHMARK_FILE", self.cache).start()
+        mock.patch.object(dns_monitor, "CANDIDATE_DNS", list(self.CANDIDATES)).start()
+        mock.patch.object(dns_monitor, "DNS_SERVICES", ["Wi-Fi"]).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_dry_run_without_cache_uses_configured_order(self):
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": []})
+        self.assertTrue(dns_monitor.configure_specific_dns(True, backend=backend, dry_run=True))
+        self.benchmark.assert_not_called()
+        self.assertFalse(os.path.exists(self.cache))
+        self.assertEqual(backend.changes, [])
+        desired = dns_monitor.desired_dns_state(True, backend, benchmark=False)
+        self.assertEqual(desired, {"Wi-Fi": self.CANDIDATES})
+
+    def test_dry_run_uses_cached_ranking(self):
+        results = {
+            "10.0.0.53": {"p50": 30.0, "p95": 40.0, "loss": 0.0, "samples": 21},
+            "10.0.0.54": {"p50": 10.0, "p95": 20.0, "loss": 0.0, "samples": 21},
+        }
+        dns_monitor.save_benchmark(self.CANDIDATES, results)
+        with open(self.cache, "rb") as f:
+            saved = f.read()
+        backend = dns_monitor.MemoryBackend({"Wi-Fi": self.CANDIDATES})
+        desired = dns_monitor.desired_dns_state(True, backend, benchmark=False)
+        self.assertEqual(desired, {"Wi-Fi": self.CANDIDATES[::-1]})
+        self.assertTrue(dns_monitor.configure_specific_dns(True, backend=backend, dry_run=True))
+        self.benchmark.assert_not_called()
+        with open(self.cache, "rb") as f:
+            self.assertEqual(f.read(), saved)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fix_photo_time 基准测试
+生成合成媒体库（覆盖 parse_filename_datetime 的 8 种文件名格式，JPEG/PNG/HEIC/MP4，
+元数据时间和文件时间一致/不一致混合），分别计时 扫描、判断、更新、移动 四个阶段，
+以 JSON 输出吞吐量、单文件延迟 p50/p99 和峰值内存；
+另外对比逐个判断与列式批量判断（classify_columns）只根据已读取时间重新判断的吞吐量，
+并统计 FileRecordStore 每个文件占用的内存和写入映射文件的耗时
+
+用法:
+    python3 bench_fix_photo_time.py --files 2000 --output bench.json
+    python3 bench_fix_photo_time.py --files 2000 --end-to-end --workers 8
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import struct
+import argparse
+import datetime
+import tempfile
+import contextlib
+import resource
+from pathlib import Path
+
+import piexif
+from PIL import Image
+
+import fix_photo_time
+
+# 文件名模板：(格式ID, 模板)，n 为序号，保证文件名唯一
+FILENAME_TEMPLATES = [
+    ("date_space_time", lambda dt, n: f"{dt:%Y-%m-%d %H%M%S}_{n}"),
+    ("date_underscore_time", lambda dt, n: f"{dt:%Y%m%d_%H%M%S}{n % 1000:03d}_iOS_{n}"),
+    ("img_underscore", lambda dt, n: f"IMG_{dt:%Y%m%d_%H%M%S}_{n}"),
+    ("screenshot_dashed", lambda dt, n: f"Screenshot_{dt:%Y-%m-%d-%H-%M-%S}_{n}"),
+    ("screenshot_compact", lambda dt, n: f"Screenshot_{dt:%Y%m%d-%H%M%S}_{n}"),
+    ("short_date", lambda dt, n: f"{dt:%y-%m-%d}-{n:08x}"),
+    ("qq_image", lambda dt, n: f"QQ图片{dt:%Y%m%d%H%M%S}_{n}"),
+    ("img_compact", lambda dt, n: f"IMG{dt:%Y%m%d%H%M%S}_{n}"),
+    ("unparsable", lambda dt, n: f"IMB_{n:06d}"),
+]
+
+# 元数据时间/文件时间与文件名时间的关系：(场景, 权重)
+SCENARIOS = [
+    ("match", 5),            # 元数据和文件时间都与文件名一致（应跳过）
+    ("metadata_mismatch", 2),
+    ("mtime_mismatch", 2),
+    ("no_metadata", 1),
+]
+
+FILE_TYPES = [".jpg", ".png", ".heic", ".mp4"]
+# 重新判断阶段把读取到的时间重复的次数
+RECLASSIFY_REPEAT = 100
+
+def _box(box_type, payload):
+    return struct.pack(">I", 8 + len(payload)) + box_type + payload
+
+def quicktime_bytes(creation_datetime, mdat_size):
+    """生成只含 moov/meta/keys/ilst 和填充 mdat 的最小 MP4，CreationDate 为 None 时不写 Keys"""
+    moov_children = _box(b"mvhd", b"\x00" * 100)
+    if creation_datetime is not None:
+        key = fix_photo_time.QUICKTIME_CREATIONDATE_KEY
+        keys = _box(b"keys", b"\x00\x00\x00\x00" + struct.pack(">I", 1) + struct.pack(">I", 8 + len(key)) + b"mdta" + key)
+        value = creation_datetime.strftime("%Y-%m-%dT%H:%M:%S+0800").encode("ascii")
+        ilst = _box(b"ilst", _box(struct.pack(">I", 1), _box(b"data", b"\x00\x00\x00\x01\x00\x00\x00\x00" + value)))
+        moov_children += _box(b"meta", _box(b"hdlr", b"\x00" * 8 + b"mdta" + b"\x00" * 12) + keys + ilst)
+    return _box(b"ftyp", b"mp42\x00\x00\x00\x00") + _box(b"mdat", b"\x00" * mdat_size) + _box(b"moov", moov_children)
+
+def exif_bytes(metadata_datetime):
+    time_str = metadata_datetime.strftime("%Y:%m:%d %H:%M:%S")
+    return piexif.dump({
+        "0th": {piexif.ImageIFD.DateTime: time_str},
+        "Exif": {
+            piexif.ExifIFD.DateTimeOriginal: time_str,
+            piexif.ExifIFD.DateTimeDigitized: time_str,
+        },
+    })
+
+def generate_corpus(root, count, seed=0, image_size=(256, 192), subdirs=8):
+    """
+    在 root 下生成 count 个合成媒体文件，返回语料统计
+    HEIC 需要 pillow_heif，不可用时该类型改为 JPEG
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        heic_available = True
+    except ImportError:
+        heic_available = False
+
+    base_image = Image.new("RGB", image_size, (120, 140, 160))
+    jpeg_buffer = io.BytesIO()
+    base_image.save(jpeg_buffer, format="JPEG", quality=90)
+    base_jpeg = jpeg_buffer.getvalue()
+    png_buffer = io.BytesIO()
+    base_image.save(png_buffer, format="PNG")
+    base_png = png_buffer.getvalue()
+
+    stats = {"files": 0, "formats": {}, "types": {}, "scenarios": {}, "heic_available": heic_available}
+    scenario_names = [name for name, _ in SCENARIOS]
+    scenario_weights = [weight for _, weight in SCENARIOS]
+    start = datetime.datetime(2012, 1, 1)
+
+    for n in range(count):
+        pattern_id, template = FILENAME_TEMPLATES[n % len(FILENAME_TEMPLATES)]
+        file_ext = FILE_TYPES[(n // len(FILENAME_TEMPLATES)) % len(FILE_TYPES)]
+        if file_ext == ".heic" and not heic_available:
+            file_ext = ".jpg"
+        scenario = rng.choices(scenario_names, scenario_weights)[0]
+
+        name_datetime = start + datetime.timedelta(seconds=rng.randrange(10 * 365 * 86400))
+        name = template(name_datetime, n) + file_ext
+        # 以 parse_filename_datetime 的结果为准（如 YY-MM-DD 只精确到天）
+        target = fix_photo_time.parse_filename_datetime(name, name) or name_datetime
+        metadata_datetime = target
+        mtime_datetime = target
+        if scenario == "metadata_mismatch":
+            metadata_datetime = target - datetime.timedelta(days=rng.randint(1, 400))
+        elif scenario == "mtime_mismatch":
+            mtime_datetime = target + datetime.timedelta(hours=rng.randint(1, 5000))
+        elif scenario == "no_metadata":
+            metadata_datetime = None
+
+        directory = root / f"dir{n % subdirs:02d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        file_path = directory / name
+        if file_ext == ".jpg":
+            if metadata_datetime is None:
+                file_path.write_bytes(base_jpeg)
+            else:
+                output = io.BytesIO()
+                piexif.insert(exif_bytes(metadata_datetime), base_jpeg, output)
+                file_path.write_bytes(output.getvalue())
+        elif file_ext == ".png":
+            file_path.write_bytes(base_png)
+        elif file_ext == ".heic":
+            if metadata_datetime is None:
+                base_image.save(file_path, format="HEIF")
+            else:
+                base_image.save(file_path, format="HEIF", exif=exif_bytes(metadata_datetime))
+        else:
+            file_path.write_bytes(quicktime_bytes(metadata_datetime, rng.randrange(4096, 65536)))
+        timestamp = mtime_datetime.timestamp()
+        os.utime(file_path, (timestamp, timestamp))
+
+        stats["files"] += 1
+        for key, value in (("formats", pattern_id), ("types", file_ext), ("scenarios", scenario)):
+            stats[key][value] = stats[key].get(value, 0) + 1
+    return stats
+
+@contextlib.contextmanager
+def silence_output():
+    """在文件描述符层面屏蔽 stdout/stderr（包括进程池子进程和 tqdm 的输出）"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        with contextlib.redirect_stdout(open(os.devnull, "w")) as quiet:
+            try:
+                yield
+            finally:
+                quiet.close()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），macOS 的 ru_maxrss 单位为字节，Linux 为 KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def phase_result(latencies, seconds):
+    """汇总一个阶段的吞吐量和延迟（毫秒）"""
+    latencies = sorted(latencies)
+    return {
+        "files": len(latencies),
+        "seconds": round(seconds, 4),
+        "files_per_sec": round(len(latencies) / seconds, 1) if seconds > 0 else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_reclassify(times, expected, repeat=RECLASSIFY_REPEAT):
+    """
+    只根据已读取的时间重新判断（不访问文件）：逐个 decide_outcome 与 classify_columns 整批判断对比
+    时间列重复 repeat 次以模拟大量已记录的文件；没有安装 numpy 时跳过
+    """
+    import importlib.util
+    if importlib.util.find_spec("numpy") is None:
+        return {"skipped": "numpy 未安装"}
+    rows = times * repeat
+    phase_start = time.perf_counter()
+    scalar = [fix_photo_time.decide_outcome(*row)[0] for row in rows]
+    scalar_seconds = time.perf_counter() - phase_start
+
+    columns = fix_photo_time.time_columns(rows)
+    phase_start = time.perf_counter()
+    _, _, codes = fix_photo_time.classify_columns(*columns)
+    columnar_seconds = time.perf_counter() - phase_start
+    vectorized = [fix_photo_time.OUTCOME_CODES[code] for code in codes]
+    return {
+        "files": len(rows),
+        "scalar_seconds": round(scalar_seconds, 4),
+        "columnar_seconds": round(columnar_seconds, 4),
+        "scalar_files_per_sec": round(len(rows) / scalar_seconds, 1) if scalar_seconds > 0 else None,
+        "columnar_files_per_sec": round(len(rows) / columnar_seconds, 1) if columnar_seconds > 0 else None,
+        "identical": vectorized == scalar and scalar[:len(expected)] == expected,
+    }
+
+def run_record_store(times, repeat=RECLASSIFY_REPEAT):
+    """
+    把读取到的时间重复 repeat 次写入 FileRecordStore，统计每个文件占用的字节数、
+    写入映射文件的耗时和大小，以及映射后重新判断的结果是否与逐个判断一致（需要 numpy）
+    """
+    store = fix_photo_time.FileRecordStore()
+    phase_start = time.perf_counter()
+    for _ in range(repeat):
+        for file_path, target, metadata, mtime in times:
+            st = os.stat(file_path)
+            store.append(file_path, st.st_size, st.st_mtime_ns, target, metadata, mtime)
+    append_seconds = time.perf_counter() - phase_start
+    result = {
+        "files": len(store),
+        "append_seconds": round(append_seconds, 4),
+        "bytes_per_file": round(store.nbytes() / len(store), 1) if len(store) else None,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "records.bin")
+        phase_start = time.perf_counter()
+        store.spill(path)
+        result["spill_seconds"] = round(time.perf_counter() - phase_start, 4)
+        result["spill_mb"] = round(os.path.getsize(path) / 1024 / 1024, 2)
+        import importlib.util
+        if importlib.util.find_spec("numpy") is not None:
+            store.reclassify()
+            expected = [fix_photo_time.decide_outcome(*row)[0] for row in times] * repeat
+            result["reclassify_identical"] = [store.get(index)[6] for index in range(len(store))] == expected
+        store.close()
+    return result
+
+def run_phases(root):
+    """依次计时 扫描 → 判断 → 更新 → 移动，返回各阶段结果和判断结果统计"""
+    root = Path(root)
+    results = {}
+    outcomes = {}
+
+    # 扫描：逐个取出 DirEntry 计时
+    latencies = []
+    entries = []
+    walker = fix_photo_time.walk_media_files(root)
+    phase_start = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        try:
+            entry = next(walker)
+        except StopIteration:
+            break
+        latencies.append(time.perf_counter() - t0)
+        entries.append(Path(entry.path))
+    results["scan"] = phase_result(latencies, time.perf_counter() - phase_start)
+
+    # 判断：解析文件名、读取元数据时间、比较
+    latencies = []
+    decisions = []
+    phase_start = time.perf_counter()
+    times = []
+    for file_path in entries:
+        t0 = time.perf_counter()
+        # 与 classify_file 相同，另外保留读取到的时间供重新判断阶段使用
+        file_times = fix_photo_time.read_file_times(file_path)
+        outcome, target_datetime = fix_photo_time.decide_outcome(file_path, *file_times)
+        latencies.append(time.perf_counter() - t0)
+        decisions.append((file_path, outcome, target_datetime))
+        times.append((file_path, *file_times))
+    results["classify"] = phase_result(latencies, time.perf_counter() - phase_start)
+    results["reclassify"] = run_reclassify(times, [outcome for _, outcome, _ in decisions])
+    results["record_store"] = run_record_store(times)
+
+    # 更新：只对需要更新的文件写入元数据和文件时间
+    latencies = []
+    final = []
+    phase_start = time.perf_counter()
+    for file_path, outcome, target_datetime in decisions:
+        if outcome == fix_photo_time.OUTCOME_EXIF:
+            t0 = time.perf_counter()
+            outcome = fix_photo_time.apply_update(file_path, target_datetime, dry_run=False)
+            latencies.append(time.perf_counter() - t0)
+        final.append((file_path, outcome))
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    results["update"] = phase_result(latencies, time.perf_counter() - phase_start)
+
+    # 移动：按结果移动到分类文件夹
+    targets = {
+        fix_photo_time.OUTCOME_EXIF: root / fix_photo_time.EXIF_DIR_NAME,
+        fix_photo_time.OUTCOME_FILETIME: root / fix_photo_time.FILETIME_DIR_NAME,
+        fix_photo_time.OUTCOME_UNPROCESSED: root / fix_photo_time.UNPROCESSED_DIR_NAME,
+    }
+    for target_dir in targets.values():
+        target_dir.mkdir(exist_ok=True)
+    # 移动按批执行，每批的耗时平均分摊到该批的文件上
+    latencies = []
+    phase_start = time.perf_counter()
+    mover = fix_photo_time.MoveBatch(root, dry_run=False)
+    t0 = time.perf_counter()
+    for file_path, outcome in final:
+        if outcome in targets:
+            done = mover.add(file_path, targets[outcome])
+            if done:
+                latencies.extend([(time.perf_counter() - t0) / len(done)] * len(done))
+                t0 = time.perf_counter()
+    done = mover.close()
+    if done:
+        latencies.extend([(time.perf_counter() - t0) / len(done)] * len(done))
+    results["move"] = phase_result(latencies, time.perf_counter() - phase_start)
+    return results, outcomes
+
+def run_end_to_end(root, workers, pipeline=False):
+    """完整运行 process_photos（实际修改模式，不使用增量索引），只统计总耗时"""
+    file_count = sum(1 for _ in fix_photo_time.walk_media_files(root))
+    phase_start = time.perf_counter()
+    fix_photo_time.process_photos(str(root), dry_run=False, workers=workers, use_cache=False, pipeline=pipeline)
+    seconds = time.perf_counter() - phase_start
+    return {
+        "files": file_count,
+        "workers": workers,
+        "pipeline": pipeline,
+        "seconds": round(seconds, 4),
+        "files_per_sec": round(file_count / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="fix_photo_time 基准测试")
+    parser.add_argument("--files", type=int, default=1000, help="合成文件数量")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--corpus", help="语料目录（默认使用临时目录，运行后删除）")
+    parser.add_argument("--keep", action="store_true", help="保留生成的语料目录")
+    parser.add_argument("--end-to-end", action="store_true", help="另外生成一份语料，完整运行 process_photos")
+    parser.add_argument("--workers", type=int, default=1, help="端到端运行的并行进程数")
+    parser.add_argument("--pipeline", action="store_true", help="端到端运行使用多阶段流水线（忽略 --workers）")
+    parser.add_argument("--output", help="JSON 结果输出文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    base = Path(args.corpus) if args.corpus else Path(tempfile.mkdtemp(prefix="fix_photo_time_bench_"))
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "settings": {
+            "files": args.files,
+            "seed": args.seed,
+            "workers": args.workers,
+            "time_delta_threshold": fix_photo_time.TIME_DELTA_THRESHOLD,
+            "exiftool_stay_open": fix_photo_time.EXIFTOOL_STAY_OPEN,
+        },
+    }
+    try:
+        corpus_dir = base / "phases"
+        generate_start = time.perf_counter()
+        report["corpus"] = generate_corpus(corpus_dir, args.files, seed=args.seed)
+        report["corpus"]["generate_seconds"] = round(time.perf_counter() - generate_start, 3)
+
+        # 处理过程中的逐文件输出不计入结果
+        with silence_output():
+            report["phases"], report["outcomes"] = run_phases(corpus_dir)
+
+        if args.end_to_end:
+            e2e_dir = base / "end_to_end"
+            generate_corpus(e2e_dir, args.files, seed=args.seed)
+            with silence_output():
+                report["end_to_end"] = run_end_to_end(e2e_dir, args.workers, args.pipeline)
+        fix_photo_time.close_exiftool_session()
+        report["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if not args.keep and not args.corpus:
+            shutil.rmtree(base, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
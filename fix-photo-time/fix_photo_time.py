@@ -3,18 +3,269 @@
 
 import os
 import re
+import errno
 import datetime
 import subprocess
 import shutil
+import functools
+import concurrent.futures
+import threading
+import mmap
+import struct
+import sqlite3
+import hashlib
+import time
+import argparse
+import queue
+import collections
+import csv
+import json
 from pathlib import Path
-import piexif
-from PIL import Image
-import pillow_heif
-import tqdm
+# piexif、Pillow、tqdm、cProfile/pstats 在用到时才导入：大多数文件只读取文件头、原地改写 EXIF，不需要这些库
 
 # 时间偏差阈值（秒）
 TIME_DELTA_THRESHOLD = 2
 
+# 支持的图片和视频格式
+MEDIA_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.mov', '.mp4', '.heic', '.gif'}
+# 分类文件夹（遍历时跳过）
+EXIF_DIR_NAME = "exif_and_filetime_updated"
+FILETIME_DIR_NAME = "filetime_only_updated"
+UNPROCESSED_DIR_NAME = "unprocessed_files"
+OUTPUT_DIR_NAMES = {EXIF_DIR_NAME, FILETIME_DIR_NAME, UNPROCESSED_DIR_NAME}
+# 遍历线程和处理循环之间的队列长度
+WALK_QUEUE_SIZE = 1024
+# 进程池每个任务包含的文件数，以及同时在途的任务数（每个进程）
+POOL_BATCH_SIZE = 16
+POOL_BATCHES_PER_WORKER = 4
+
+# 是否使用常驻 exiftool 进程（-stay_open），失败时自动回退为每个文件单独调用
+EXIFTOOL_STAY_OPEN = True
+# 常驻 exiftool 意外退出后的最大重启次数，超过后本进程改为单次调用
+EXIFTOOL_MAX_RESTARTS = 3
+
+# 汇总表中阶段的显示顺序（嵌套阶段的耗时会重复计入外层阶段）
+STAGE_ORDER = [
+    "walk", "cache_lookup", "classify", "parse_filename", "read_metadata",
+    "update", "jpeg_write", "exiftool", "utime", "move",
+]
+
+class _Timer:
+    """Instrumentation.timer 返回的计时器"""
+    __slots__ = ("stats", "stage", "ext", "start")
+
+    def __init__(self, stats, stage, ext):
+        self.stats = stats
+        self.stage = stage
+        self.ext = ext
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.add(self.stage, self.ext, self.start, time.perf_counter())
+        return False
+
+class Instrumentation:
+    """
+    轻量计时器和计数器，按 (阶段, 扩展名) 汇总次数、总耗时和最大耗时
+    开启 trace 时额外记录每次调用的时间线（用于 CSV 或 Chrome trace 输出）
+    进程池中的子进程各自记录，通过 drain/merge 汇总到主进程
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, trace=False):
+        # 流水线模式下多个线程同时记录；子进程中重新创建，不继承 fork 时可能被占用的锁
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.counters = {}
+        self.events = [] if trace else None
+        self.origin = time.perf_counter()
+
+    def __getstate__(self):
+        # 进程池以 spawn 方式启动时 initializer 会随对象一起序列化，锁不能序列化
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def timer(self, stage, ext=""):
+        return _Timer(self, stage, ext)
+
+    def add(self, stage, ext, start, end, count=1):
+        duration = end - start
+        with self.lock:
+            total = self.totals.get((stage, ext))
+            if total is None:
+                self.totals[(stage, ext)] = [count, duration, duration]
+            else:
+                total[0] += count
+                total[1] += duration
+                if duration > total[2]:
+                    total[2] = duration
+            if self.events is not None:
+                self.events.append((stage, ext, start, duration, os.getpid(), threading.get_ident()))
+
+    def count(self, name, ext="", n=1):
+        key = (name, ext)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def drain(self):
+        """取出并清空当前记录（子进程每批处理完后交给主进程）"""
+        with self.lock:
+            snapshot = (self.totals, self.counters, self.events)
+            self.totals = {}
+            self.counters = {}
+            self.events = [] if self.events is not None else None
+        return snapshot
+
+    def merge(self, snapshot):
+        totals, counters, events = snapshot
+        with self.lock:
+            for key, (count, duration, longest) in totals.items():
+                total = self.totals.setdefault(key, [0, 0.0, 0.0])
+                total[0] += count
+                total[1] += duration
+                total[2] = max(total[2], longest)
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            if self.events is not None and events:
+                self.events.extend(events)
+
+    def summary_lines(self):
+        """生成阶段耗时汇总表和计数器"""
+        def sort_key(item):
+            (stage, ext), _ = item
+            order = STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER)
+            return order, stage, ext
+        lines = [f"{'阶段':<16}{'扩展名':<8}{'次数':>9}{'总耗时(s)':>12}{'平均(ms)':>11}{'最大(ms)':>11}"]
+        for (stage, ext), (count, duration, longest) in sorted(self.totals.items(), key=sort_key):
+            average = duration / count * 1000 if count else 0
+            lines.append(f"{stage:<16}{ext or '-':<8}{count:>9}{duration:>12.3f}{average:>11.3f}{longest * 1000:>11.3f}")
+        if self.counters:
+            lines.append("计数:")
+            for (name, ext), value in sorted(self.counters.items()):
+                lines.append(f"  {name} {ext or '-'}: {value}")
+        return lines
+
+    def write_trace(self, path):
+        """
+        写出调用时间线：.csv 为逐条记录，其他扩展名为 Chrome trace 格式的 JSON
+        （可在 chrome://tracing 或 Perfetto 中打开，汇总数据在 otherData 中）
+        """
+        events = self.events or []
+        if str(path).lower().endswith(".csv"):
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["stage", "ext", "start_ms", "duration_ms", "pid", "tid"])
+                for stage, ext, start, duration, pid, tid in events:
+                    writer.writerow([stage, ext, f"{(start - self.origin) * 1000:.3f}", f"{duration * 1000:.3f}", pid, tid])
+            return
+        trace = {
+            "traceEvents": [
+                {
+                    "name": stage, "cat": ext or "-", "ph": "X",
+                    "ts": round((start - self.origin) * 1e6, 1), "dur": round(duration * 1e6, 1),
+                    "pid": pid, "tid": tid,
+                }
+                for stage, ext, start, duration, pid, tid in events
+            ],
+            "otherData": {
+                "totals": [
+                    {"stage": stage, "ext": ext, "count": count, "seconds": round(duration, 6), "max_seconds": round(longest, 6)}
+                    for (stage, ext), (count, duration, longest) in self.totals.items()
+                ],
+                "counters": [
+                    {"name": name, "ext": ext, "value": value}
+                    for (name, ext), value in self.counters.items()
+                ],
+            },
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False)
+
+# 当前进程的计时器（进程池子进程中各有一份）
+INSTRUMENTATION = Instrumentation()
+
+# 文件名时间格式注册表: {格式ID: (顺序, 正则)}
+# 正则使用命名分组 year（或两位年份 yy，按 2000-2099 处理）、month、day，
+# 可选 hour、minute、second；多个格式同时匹配时取顺序值最小的
+FILENAME_PATTERNS = {}
+_filename_regex = None
+_filename_group_names = {}
+
+def register_filename_pattern(pattern_id, regex, order):
+    """
+    注册文件名时间格式，无需修改 parse_filename_datetime
+    例如: register_filename_pattern("pixel", r'PXL_(?P<year>\\d{4})(?P<month>\\d{2})...', order=15)
+    同一格式ID重复注册会覆盖原有格式
+    """
+    global _filename_regex
+    re.compile(regex)
+    FILENAME_PATTERNS[pattern_id] = (order, regex)
+    _filename_regex = None
+
+def _compile_filename_patterns():
+    """
+    将所有格式编译为一个正则: ^(?:(?=.*?P1)|(?=.*?P2)|...)
+    各分支在字符串开头按顺序尝试，每个分支内部等价于 re.search，
+    因此一次匹配的结果与按顺序逐个 re.search 相同
+    """
+    global _filename_regex, _filename_group_names
+    branches = []
+    group_names = {}
+    ordered = sorted(FILENAME_PATTERNS.items(), key=lambda item: item[1][0])
+    for index, (pattern_id, (order, regex)) in enumerate(ordered):
+        prefix = f"p{index}_"
+        branch = re.sub(r"\(\?P<(\w+)>", lambda m: f"(?P<{prefix}{m.group(1)}>", regex)
+        branches.append(f"(?P<p{index}>(?=.*?{branch}))")
+        group_names[f"p{index}"] = (pattern_id, prefix)
+    _filename_regex = re.compile("^(?:" + "|".join(branches) + ")", re.DOTALL)
+    _filename_group_names = group_names
+    return _filename_regex
+
+def match_filename_pattern(filename):
+    """
+    一次匹配所有已注册的文件名格式
+    返回 (格式ID, {分组名: 值})，没有匹配时返回 None
+    """
+    regex = _filename_regex or _compile_filename_patterns()
+    match = regex.match(filename)
+    if not match:
+        return None
+    for branch_name, (pattern_id, prefix) in _filename_group_names.items():
+        if match.group(branch_name) is not None:
+            fields = {
+                name[len(prefix):]: value
+                for name, value in match.groupdict().items()
+                if name.startswith(prefix) and value is not None
+            }
+            return pattern_id, fields
+    return None
+
+# 模式1: YYYY-MM-DD HHMMSS (如: 2015-03-25 115355.jpg)
+register_filename_pattern("date_space_time", r'(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})\s+(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=10)
+# 模式2: YYYYMMDD_HHMMSS... (如: 20200214_150140525_iOS.jpg)
+register_filename_pattern("date_underscore_time", r'(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})_(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=20)
+# 模式3: IMG_YYYYMMDD_HHMMSS (如: IMG_20160408_201545.jpg)
+register_filename_pattern("img_underscore", r'IMG_(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})_(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=30)
+# 模式4: Screenshot_YYYY-MM-DD-HH-MM-SS (如: Screenshot_2015-11-21-22-50-58.png)
+register_filename_pattern("screenshot_dashed", r'Screenshot_(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})-(?P<hour>\d{2})-(?P<minute>\d{2})-(?P<second>\d{2})', order=40)
+# 模式5: Screenshot_YYYYMMDD-HHMMSS (如: Screenshot_20160321-222949.png)
+register_filename_pattern("screenshot_compact", r'Screenshot_(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})-(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=50)
+# 模式6: YY-MM-DD (如: 19-05-16-8e40504419249f1087c216e30242a984__c0_30_960_960__w960_h1280.jpg)
+register_filename_pattern("short_date", r'^(?P<yy>\d{2})-(?P<month>\d{2})-(?P<day>\d{2})[-_]', order=60)
+# 模式7: QQ图片YYYYMMDDHHMMSS (如: QQ图片20150815155353.jpg)
+register_filename_pattern("qq_image", r'QQ图片(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=70)
+# 模式8: IMGYYYYMMDDHHMMSS (如: IMG20150812205222.jpg)
+register_filename_pattern("img_compact", r'IMG(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=80)
+
 def parse_filename_datetime(filename, file_path):
     """
     从文件名中解析时间信息
@@ -27,145 +278,555 @@ def parse_filename_datetime(filename, file_path):
     6. YY-MM-DD (如: 19-05-16-8e40504419249f1087c216e30242a984__c0_30_960_960__w960_h1280.jpg)
     7. QQ图片YYYYMMDDHHMMSS (如: QQ图片20150815155353.jpg)
     8. IMGYYYYMMDDHHMMSS (如: IMG20150812205222.jpg)
+    其他格式可通过 register_filename_pattern 注册
     """
-    file_ext = os.path.splitext(filename)[1].lower()
+    matched = match_filename_pattern(filename)
+    if matched is None:
+        return None
+    pattern_id, fields = matched
+    try:
+        # 假设 00-99 表示 2000-2099
+        year = int(fields["year"]) if "year" in fields else int(fields["yy"]) + 2000
+        return datetime.datetime(
+            year, int(fields["month"]), int(fields["day"]),
+            int(fields.get("hour", 0)), int(fields.get("minute", 0)), int(fields.get("second", 0))
+        )
+    except ValueError as e:
+        print(f"时间格式错误: {filename} - {e}")
+        return None
 
-    # 模式1: YYYY-MM-DD HHMMSS
-    pattern1 = r'(\d{4})-(\d{2})-(\d{2})\s+(\d{2})(\d{2})(\d{2})'
-    match1 = re.search(pattern1, filename)
-    
-    if match1:
-        year, month, day, hour, minute, second = match1.groups()
+class ExifToolError(Exception):
+    """常驻 exiftool 进程不可用（未启动、已退出或管道断开）"""
+
+# exiftool 的输出摘要，如 "1 files weren't updated due to errors"（常驻模式下 ${status} 不可用时据此判断）
+EXIFTOOL_FAILURE_SUMMARY = re.compile(r"^\s*([1-9]\d*) .*\bweren't (?:updated|read)\b", re.MULTILINE)
+
+class ExifToolSession:
+    """
+    常驻 exiftool 进程，使用 -stay_open True -@ - 协议
+    每条命令的参数逐行写入 stdin，以 -execute{N} 结尾；stdout 读到 {readyN} 标记为止，
+    stderr 由后台线程持续读出（避免大量警告写满管道后双方互相等待），读到 -echo4 写入的标记为止。
+    命令的退出码通过 -echo3 输出的 ${status} 取得，多个文件的读写复用同一个 Perl 进程
+    """
+    def __init__(self, executable="exiftool"):
+        self.executable = executable
+        self.process = None
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+        self.owner_pid = os.getpid()
+        self.stderr_lines = queue.Queue()
+        reader = threading.Thread(target=self._drain_stderr, args=(self.process.stderr, self.stderr_lines), daemon=True)
+        reader.start()
+
+    @staticmethod
+    def _drain_stderr(stream, lines):
+        """后台线程：逐行读出 stderr，进程退出（EOF）时放入 None"""
         try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
-            return None
-    
-    # 模式2: YYYYMMDD_HHMMSS... (如: 20200214_150140525_iOS.jpg)
-    pattern2 = r'(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})'
-    match2 = re.search(pattern2, filename)
-    
-    if match2:
-        year, month, day, hour, minute, second = match2.groups()
+            for line in stream:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, args):
+        """
+        执行一条 exiftool 命令，返回 (退出码, stdout, stderr)
+        exiftool 不支持 ${status} 时根据输出摘要判断退出码
+        进程不可用时抛出 ExifToolError
+        """
+        with self.lock:
+            if not self.alive:
+                raise ExifToolError("exiftool 常驻进程未运行")
+            self.sequence += 1
+            marker = f"{{ready{self.sequence}}}"
+            status_prefix = f"{{status{self.sequence}}} "
+            lines = [str(a) for a in args] + [
+                "-echo3", status_prefix + "${status}", "-echo4", marker, f"-execute{self.sequence}"]
+            try:
+                self.process.stdin.write("\n".join(lines) + "\n")
+                self.process.stdin.flush()
+                stdout = self._read_until(self.process.stdout.readline, marker)
+                stderr = "".join(self._read_until(self.stderr_lines.get, marker))
+            except (OSError, ValueError) as e:
+                self._kill()
+                raise ExifToolError(f"exiftool 常驻进程通信失败: {e}")
+            status = None
+            output = []
+            for line in stdout:
+                if line.startswith(status_prefix):
+                    value = line[len(status_prefix):].strip()
+                    status = int(value) if value.isdigit() else None
+                else:
+                    output.append(line)
+            stdout = "".join(output)
+            if status is None:
+                failed = EXIFTOOL_FAILURE_SUMMARY.search(stdout) or re.search(r"^Error:", stderr, re.MULTILINE)
+                status = 1 if failed else 0
+            return status, stdout, stderr
+
+    def _read_until(self, readline, marker):
+        """逐行读取到 marker 为止，返回之前的各行"""
+        output = []
+        while True:
+            line = readline()
+            if not line:
+                self._kill()
+                raise ExifToolError("exiftool 常驻进程意外退出")
+            if line.rstrip("\r\n") == marker:
+                return output
+            output.append(line)
+
+    def _kill(self):
+        if self.process is not None:
+            try:
+                self.process.kill()
+                self.process.wait()
+            except Exception:
+                pass
+        self.process = None
+
+    def close(self):
+        """通知 exiftool 退出常驻模式并等待进程结束"""
+        if not self.alive:
+            self.process = None
+            return
         try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
+            self.process.stdin.write("-stay_open\nFalse\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=5)
+        except Exception:
+            self._kill()
+        self.process = None
+
+# 每个进程各自持有一个常驻 exiftool（进程池的每个 worker 各一个）
+_exiftool_session = None
+_exiftool_session_failed = False
+_exiftool_restarts = 0
+# 已注册退出时关闭常驻 exiftool 的进程号（fork 出的子进程需要各自注册）
+_exiftool_cleanup_pid = None
+# 流水线的多个写入线程共用本进程的常驻 exiftool，启动时加锁避免重复启动
+_exiftool_session_lock = threading.Lock()
+
+def _reset_exiftool_session_lock():
+    global _exiftool_session_lock
+    _exiftool_session_lock = threading.Lock()
+
+# 流水线的线程向进程池提交任务时可能触发 fork，子进程中不能继承被其他线程占用的锁
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_exiftool_session_lock)
+
+def get_exiftool_session():
+    """
+    返回当前进程的常驻 exiftool，首次调用时启动
+    启动失败或已被禁用时返回 None
+    """
+    global _exiftool_session, _exiftool_session_failed
+    if not EXIFTOOL_STAY_OPEN or _exiftool_session_failed:
+        return None
+    if _exiftool_session is not None and _exiftool_session.alive and _exiftool_session.owner_pid == os.getpid():
+        return _exiftool_session
+    with _exiftool_session_lock:
+        if _exiftool_session_failed:
             return None
-    
-    # 模式3: IMG_YYYYMMDD_HHMMSS (如: IMG_20160408_201545.jpg)
-    pattern3 = r'IMG_(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})'
-    match3 = re.search(pattern3, filename)
-    
-    if match3:
-        year, month, day, hour, minute, second = match3.groups()
+        if _exiftool_session is not None and _exiftool_session.alive and _exiftool_session.owner_pid == os.getpid():
+            return _exiftool_session
         try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
+            session = ExifToolSession()
+            session.start()
+        except OSError as e:
+            print(f"⚠ 无法启动常驻 exiftool，改为逐个文件调用: {e}")
+            _exiftool_session_failed = True
             return None
-    
-    # 模式4: Screenshot_YYYY-MM-DD-HH-MM-SS (如: Screenshot_2015-11-21-22-50-58.png)
-    pattern4 = r'Screenshot_(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{2})'
-    match4 = re.search(pattern4, filename)
-    
-    if match4:
-        year, month, day, hour, minute, second = match4.groups()
+        _register_exiftool_cleanup()
+        _exiftool_session = session
+        return session
+
+def _register_exiftool_cleanup():
+    """
+    进程退出时关闭常驻 exiftool（发送 -stay_open False），每个进程注册一次
+    进程池的 worker 退出时不执行 atexit，因此使用 multiprocessing 的终结器：
+    worker 结束时由 multiprocessing 执行，主进程中同样在解释器退出时执行
+    """
+    global _exiftool_cleanup_pid
+    if _exiftool_cleanup_pid == os.getpid():
+        return
+    from multiprocessing import util
+    util.Finalize(None, close_exiftool_session, exitpriority=10)
+    _exiftool_cleanup_pid = os.getpid()
+
+def close_exiftool_session():
+    """关闭当前进程的常驻 exiftool"""
+    global _exiftool_session
+    if _exiftool_session is not None and _exiftool_session.owner_pid == os.getpid():
+        _exiftool_session.close()
+    _exiftool_session = None
+
+def run_exiftool(args, check=True):
+    """
+    执行 exiftool 命令，优先通过常驻进程，进程退出时回退为单次调用
+    返回 subprocess.CompletedProcess（文本模式），check=True 时失败抛出 CalledProcessError
+    """
+    ext = os.path.splitext(str(args[-1]))[1].lower() if args else ""
+    with INSTRUMENTATION.timer("exiftool", ext):
+        return _run_exiftool(args, check, ext)
+
+def _run_exiftool(args, check, ext):
+    global _exiftool_session_failed, _exiftool_restarts
+    cmd = ["exiftool"] + [str(a) for a in args]
+    session = get_exiftool_session()
+    if session is not None:
         try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
+            status, stdout, stderr = session.execute(args)
+            result = subprocess.CompletedProcess(cmd, status, stdout, stderr)
+            if check:
+                result.check_returncode()
+            return result
+        except ExifToolError as e:
+            print(f"⚠ {e}，回退为单次调用 exiftool")
+            INSTRUMENTATION.count("exiftool_fallback", ext)
+            # 下次调用时重启常驻进程，多次失败后本进程不再使用常驻模式
+            _exiftool_restarts += 1
+            if _exiftool_restarts > EXIFTOOL_MAX_RESTARTS:
+                _exiftool_session_failed = True
+    return subprocess.run(cmd, capture_output=True, text=True, check=check)
+
+# EXIF 时间字段的 TIFF 标签号
+TAG_DATETIME = 0x0132               # IFD0 DateTime
+TAG_EXIF_IFD_POINTER = 0x8769       # IFD0 -> Exif IFD 指针
+TAG_DATETIME_ORIGINAL = 0x9003      # Exif IFD DateTimeOriginal
+TAG_DATETIME_DIGITIZED = 0x9004     # Exif IFD DateTimeDigitized
+EXIF_TYPE_ASCII = 2
+
+def find_jpeg_exif(buf):
+    """
+    在 JPEG 头部逐段查找 APP1 Exif 段（遇到 SOS 即停止，不读取压缩图像数据）
+    返回 TIFF 数据在 buf 中的 (起始, 结束) 位置，未找到返回 None
+    """
+    if buf[0:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    size = len(buf)
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
             return None
-    
-    # 模式5: Screenshot_YYYYMMDD-HHMMSS (如: Screenshot_20160321-222949.png)
-    pattern5 = r'Screenshot_(\d{4})(\d{2})(\d{2})-(\d{2})(\d{2})(\d{2})'
-    match5 = re.search(pattern5, filename)
-    
-    if match5:
-        year, month, day, hour, minute, second = match5.groups()
-        try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            # 填充字节
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # 无长度字段的标记
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
             return None
+        length = struct.unpack(">H", buf[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and buf[pos + 4:pos + 10] == b"Exif\x00\x00":
+            return pos + 10, min(pos + 2 + length, size)
+        pos += 2 + length
+    return None
+
+def _read_ifd(buf, tiff_start, tiff_end, ifd_offset, endian):
+    """读取一个 IFD，返回 {标签: (类型, 数量, 值字段位置)}"""
+    pos = tiff_start + ifd_offset
+    if ifd_offset <= 0 or pos + 2 > tiff_end:
+        return {}
+    count = struct.unpack(endian + "H", buf[pos:pos + 2])[0]
+    pos += 2
+    entries = {}
+    for _ in range(count):
+        if pos + 12 > tiff_end:
+            break
+        tag, value_type, value_count = struct.unpack(endian + "HHI", buf[pos:pos + 8])
+        entries[tag] = (value_type, value_count, pos + 8)
+        pos += 12
+    return entries
+
+def locate_exif_datetimes(buf, tiff_start, tiff_end):
+    """
+    在 TIFF 数据中定位 DateTime / DateTimeOriginal / DateTimeDigitized
+    返回 {标签: (字符串在 buf 中的位置, 长度)}，只包含存在且为 ASCII 类型的字段
+    """
+    byte_order = buf[tiff_start:tiff_start + 2]
+    if byte_order == b"II":
+        endian = "<"
+    elif byte_order == b"MM":
+        endian = ">"
+    else:
+        return {}
+    ifd0_offset = struct.unpack(endian + "I", buf[tiff_start + 4:tiff_start + 8])[0]
+    ifd0 = _read_ifd(buf, tiff_start, tiff_end, ifd0_offset, endian)
+    wanted = {TAG_DATETIME: ifd0.get(TAG_DATETIME)}
+    if TAG_EXIF_IFD_POINTER in ifd0:
+        value_pos = ifd0[TAG_EXIF_IFD_POINTER][2]
+        exif_offset = struct.unpack(endian + "I", buf[value_pos:value_pos + 4])[0]
+        exif_ifd = _read_ifd(buf, tiff_start, tiff_end, exif_offset, endian)
+        wanted[TAG_DATETIME_ORIGINAL] = exif_ifd.get(TAG_DATETIME_ORIGINAL)
+        wanted[TAG_DATETIME_DIGITIZED] = exif_ifd.get(TAG_DATETIME_DIGITIZED)
     
-    # 模式6: YY-MM-DD (如: 19-05-16-8e40504419249f1087c216e30242a984__c0_30_960_960__w960_h1280.jpg)
-    pattern6 = r'^(\d{2})-(\d{2})-(\d{2})[-_]'
-    match6 = re.search(pattern6, filename)
-    
-    if match6:
-        year, month, day = match6.groups()
-        try:
-            # 假设 00-99 表示 2000-2099
-            year = int(year) + 2000
-            dt = datetime.datetime(year, int(month), int(day))
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
-            return None
+    locations = {}
+    for tag, entry in wanted.items():
+        if not entry or entry[0] != EXIF_TYPE_ASCII:
+            continue
+        value_type, value_count, value_pos = entry
+        if value_count <= 4:
+            string_pos = value_pos
+        else:
+            string_pos = tiff_start + struct.unpack(endian + "I", buf[value_pos:value_pos + 4])[0]
+        if string_pos + value_count <= tiff_end:
+            locations[tag] = (string_pos, value_count)
+    return locations
+
+# 头部读取器最多读取的 EXIF 数据量（字节）
+HEADER_READ_LIMIT = 64 * 1024
+# QuickTime Keys 中 exiftool CreationDate 对应的键名
+QUICKTIME_CREATIONDATE_KEY = b"com.apple.quicktime.creationdate"
+
+class HeaderFormatError(Exception):
+    """文件头结构无法识别，需要回退到 Pillow/exiftool 读取"""
+
+def _exif_datetime_original(buf, tiff_start, tiff_end):
+    """从 TIFF 数据中读取 DateTimeOriginal，没有时返回 None"""
+    location = locate_exif_datetimes(buf, tiff_start, tiff_end).get(TAG_DATETIME_ORIGINAL)
+    if location is None:
+        return None
+    string_pos, length = location
+    time_str = bytes(buf[string_pos:string_pos + length]).split(b"\x00", 1)[0]
+    try:
+        return datetime.datetime.strptime(time_str.decode('utf-8'), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+def _iter_boxes(f, start, end):
+    """
+    遍历 [start, end) 范围内的 ISOBMFF/QuickTime box，只读取 box 头
+    产出 (类型, 内容起始位置, box 结束位置)
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise HeaderFormatError(f"box 长度异常: {box_type!r}")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+def _find_box(f, start, end, box_type):
+    """在 [start, end) 中查找第一个指定类型的 box，返回 (内容起始, 结束) 或 None"""
+    for current_type, content_start, box_end in _iter_boxes(f, start, end):
+        if current_type == box_type:
+            return content_start, box_end
+    return None
+
+def _read_uint(data, pos, size):
+    """按大端序读取 size 字节的无符号整数（size 可为 0/2/4/8）"""
+    if size == 0:
+        return 0, pos
+    return int.from_bytes(data[pos:pos + size], "big"), pos + size
+
+def _heif_exif_location(f, meta_start, meta_end):
+    """
+    解析 HEIF meta box 中的 iinf 和 iloc，返回 Exif 项的 (文件偏移, 长度)，没有 Exif 项时返回 None
+    """
+    iinf = _find_box(f, meta_start, meta_end, b"iinf")
+    iloc = _find_box(f, meta_start, meta_end, b"iloc")
+    if iinf is None or iloc is None:
+        return None
     
-    # 模式7: QQ图片YYYYMMDDHHMMSS (如: QQ图片20150815155353.jpg)
-    pattern7 = r'QQ图片(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})'
-    match7 = re.search(pattern7, filename)
+    # iinf: 找到 item_type 为 'Exif' 的 item_ID
+    f.seek(iinf[0])
+    version = f.read(4)[0]
+    entries_start = iinf[0] + 4 + (2 if version == 0 else 4)
+    exif_item_id = None
+    for box_type, infe_start, infe_end in _iter_boxes(f, entries_start, iinf[1]):
+        if box_type != b"infe":
+            continue
+        f.seek(infe_start)
+        infe = f.read(min(infe_end - infe_start, 16))
+        infe_version = infe[0]
+        if infe_version < 2:
+            continue
+        id_size = 2 if infe_version == 2 else 4
+        item_id, pos = _read_uint(infe, 4, id_size)
+        item_type = infe[pos + 2:pos + 6]
+        if item_type == b"Exif":
+            exif_item_id = item_id
+            break
+    if exif_item_id is None:
+        return None
     
-    if match7:
-        year, month, day, hour, minute, second = match7.groups()
-        try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
-            return None
+    # iloc: 查找该 item 的第一个 extent
+    f.seek(iloc[0])
+    data = f.read(iloc[1] - iloc[0])
+    version = data[0]
+    offset_size = data[4] >> 4
+    length_size = data[4] & 0x0F
+    base_offset_size = data[5] >> 4
+    index_size = data[5] & 0x0F if version in (1, 2) else 0
+    pos = 6
+    item_count, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+    for _ in range(item_count):
+        item_id, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method = data[pos + 1] & 0x0F
+            pos += 2
+        pos += 2  # data_reference_index
+        base_offset, pos = _read_uint(data, pos, base_offset_size)
+        extent_count, pos = _read_uint(data, pos, 2)
+        extents = []
+        for _ in range(extent_count):
+            pos += index_size
+            extent_offset, pos = _read_uint(data, pos, offset_size)
+            extent_length, pos = _read_uint(data, pos, length_size)
+            extents.append((extent_offset, extent_length))
+        if item_id == exif_item_id:
+            if construction_method != 0 or not extents:
+                raise HeaderFormatError("Exif 项不是直接的文件偏移")
+            return base_offset + extents[0][0], extents[0][1]
+    return None
 
-    # 模式8: IMGYYYYMMDDHHMMSS (如: IMG20150812205222.jpg)
-    pattern8 = r'IMG(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})'
-    match8 = re.search(pattern8, filename)
+def read_heif_datetime(f, file_size):
+    """读取 HEIC/HEIF 中 Exif 项的 DateTimeOriginal"""
+    meta = _find_box(f, 0, file_size, b"meta")
+    if meta is None:
+        raise HeaderFormatError("未找到 meta box")
+    # meta 为 FullBox，跳过 version/flags
+    location = _heif_exif_location(f, meta[0] + 4, meta[1])
+    if location is None:
+        return None
+    item_offset, item_length = location
+    f.seek(item_offset)
+    data = f.read(min(item_length, HEADER_READ_LIMIT))
+    # Exif 项以 4 字节的 TIFF 头偏移开始，其后通常是 "Exif\0\0"
+    tiff_start = 4 + struct.unpack(">I", data[0:4])[0]
+    return _exif_datetime_original(data, tiff_start, len(data))
+
+def read_quicktime_creationdate(f, file_size):
+    """
+    读取 MOV/MP4 moov/meta 中 Keys 的 com.apple.quicktime.creationdate
+    这是 exiftool -CreationDate 读取和 update_mov_metadata 写入的字段，按原样解析为本地时间
+    moov 可能在 mdat 之后，中间的 box 只读头部并直接跳过
+    """
+    moov = _find_box(f, 0, file_size, b"moov")
+    if moov is None:
+        raise HeaderFormatError("未找到 moov box")
+    meta = _find_box(f, moov[0], moov[1], b"meta")
+    if meta is None:
+        return None
+    # QuickTime 的 meta 没有 version/flags，MP4 的 meta 有
+    f.seek(meta[0] + 4)
+    meta_start = meta[0] if f.read(4) in (b"hdlr", b"keys") else meta[0] + 4
+    keys = _find_box(f, meta_start, meta[1], b"keys")
+    ilst = _find_box(f, meta_start, meta[1], b"ilst")
+    if keys is None or ilst is None:
+        return None
     
-    if match8:
-        year, month, day, hour, minute, second = match8.groups()
-        try:
-            dt = datetime.datetime(
-                int(year), int(month), int(day),
-                int(hour), int(minute), int(second)
-            )
-            return dt
-        except ValueError as e:
-            print(f"时间格式错误: {filename} - {e}")
-            return None
+    f.seek(keys[0])
+    data = f.read(min(keys[1] - keys[0], HEADER_READ_LIMIT))
+    entry_count = struct.unpack(">I", data[4:8])[0]
+    pos = 8
+    key_index = None
+    for index in range(1, entry_count + 1):
+        if pos + 8 > len(data):
+            break
+        key_size = struct.unpack(">I", data[pos:pos + 4])[0]
+        if key_size < 8:
+            raise HeaderFormatError("keys 条目长度异常")
+        if data[pos + 8:pos + key_size] == QUICKTIME_CREATIONDATE_KEY:
+            key_index = index
+            break
+        pos += key_size
+    if key_index is None:
+        return None
+    
+    item = _find_box(f, ilst[0], ilst[1], struct.pack(">I", key_index))
+    if item is None:
+        return None
+    value = _find_box(f, item[0], item[1], b"data")
+    if value is None:
+        return None
+    # data box: 4 字节类型 + 4 字节 locale + 值（如 2019-01-26T15:01:22+0800）
+    f.seek(value[0] + 8)
+    time_str = f.read(min(value[1] - value[0] - 8, 64)).decode('utf-8', 'replace')
+    try:
+        return datetime.datetime.strptime(time_str[:19], "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return None
 
+def read_header_datetime(file_path):
+    """
+    只读取文件头获取元数据时间，不经过 Pillow 解码或 exiftool
+    JPEG 读 APP1 中的 DateTimeOriginal，HEIC 读 meta 中 Exif 项的 DateTimeOriginal，
+    MOV/MP4 读 moov/meta/keys 中的 CreationDate
+    结构无法识别时抛出 HeaderFormatError
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    with open(file_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_ext in ['.jpg', '.jpeg']:
+            if file_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[0:2] != b"\xff\xd8":
+                    raise HeaderFormatError("不是 JPEG 文件头")
+                span = find_jpeg_exif(mm)
+                if span is None:
+                    return None
+                return _exif_datetime_original(mm, span[0], min(span[1], span[0] + HEADER_READ_LIMIT))
+        elif file_ext == '.heic':
+            return read_heif_datetime(f, file_size)
+        elif file_ext in ['.mov', '.mp4']:
+            return read_quicktime_creationdate(f, file_size)
     return None
 
 def get_metadata_datetime(file_path):
     """
     获取文件的 EXIF 或 QuickTime 元数据时间
+    优先只读取文件头，文件头结构无法识别时回退到 Pillow/exiftool
+    """
+    try:
+        return read_header_datetime(file_path)
+    except (HeaderFormatError, struct.error, IndexError, ValueError):
+        return get_metadata_datetime_fallback(file_path)
+    except OSError:
+        return None
+
+def get_metadata_datetime_fallback(file_path):
+    """
+    通过 Pillow/piexif 或 exiftool 获取文件的 EXIF 或 QuickTime 元数据时间
     """
     file_ext = os.path.splitext(file_path)[1].lower()
     if file_ext in ['.jpg', '.jpeg', '.heic']:
         try:
+            import piexif
+            from PIL import Image
             img = Image.open(file_path)
             exif_dict = piexif.load(img.info.get('exif', b''))
             time_str = exif_dict.get('Exif', {}).get(piexif.ExifIFD.DateTimeOriginal)
@@ -175,9 +836,9 @@ def get_metadata_datetime(file_path):
             return None
     elif file_ext in ['.mov', '.mp4']:
         try:
-            result = subprocess.run([
-                "exiftool", "-CreationDate", "-d", "%Y:%m:%d %H:%M:%S", file_path
-            ], capture_output=True, text=True, check=True)
+            result = run_exiftool([
+                "-CreationDate", "-d", "%Y:%m:%d %H:%M:%S", file_path
+            ])
             time_str = result.stdout.split(": ", 1)[1].strip()
             return datetime.datetime.strptime(time_str, "%Y:%m:%d %H:%M:%S")
         except Exception:
@@ -192,18 +853,76 @@ def update_mov_metadata(file_path, target_datetime):
     try:
         # 对于 HEIC，使用 DateTimeOriginal；对于 MOV/MP4，使用 CreationDate
         tag = "DateTimeOriginal" if os.path.splitext(file_path)[1].lower() == '.heic' else "CreationDate"
-        subprocess.run([
-            "exiftool",
+        run_exiftool([
             "-overwrite_original",
             f"-{tag}={time_str}",
             file_path
-        ], check=True)
+        ])
         print(f"✓ 已更新: {os.path.basename(file_path)} -> {time_str} ({tag}元数据)")
         return True
     except subprocess.CalledProcessError as e:
         print(f"⚠ 元数据更新失败: {os.path.basename(file_path)} - {e}")
         return False
 
+def patch_jpeg_exif_datetime(file_path, time_str):
+    """
+    通过内存映射原地改写 JPEG APP1 段中的 DateTime/DateTimeOriginal/DateTimeDigitized
+    只修改这三个字符串，压缩图像数据和其他 EXIF 字段保持不变
+    三个字段不全或长度不够时不做任何修改并返回 False
+    """
+    value = time_str.encode("ascii") + b"\x00"
+    with open(file_path, "r+b") as f:
+        with mmap.mmap(f.fileno(), 0) as mm:
+            span = find_jpeg_exif(mm)
+            if span is None:
+                return False
+            locations = locate_exif_datetimes(mm, span[0], span[1])
+            if len(locations) < 3 or any(length < len(value) for _, length in locations.values()):
+                return False
+            for string_pos, _ in locations.values():
+                mm[string_pos:string_pos + len(value)] = value
+            mm.flush()
+    return True
+
+def read_jpeg_exif_bytes(file_path):
+    """只读取 JPEG 头部的 APP1 Exif 段（含 Exif 标识），没有 EXIF 时返回 b''"""
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            span = find_jpeg_exif(mm)
+            if span is None:
+                return b""
+            return mm[span[0] - 6:span[1]]
+
+def update_jpeg_exif(file_path, time_str):
+    """
+    无损更新 JPEG 的 EXIF 时间，不解码/重新编码图像
+    优先原地改写 APP1 中的时间字符串；字段缺失时用 piexif.insert 替换整个 APP1 段
+    """
+    try:
+        if patch_jpeg_exif_datetime(file_path, time_str):
+            return
+    except (ValueError, OSError, struct.error):
+        # 空文件或结构异常，交给 piexif 处理
+        pass
+    
+    import piexif
+    exif_bytes = read_jpeg_exif_bytes(file_path)
+    exif_dict = piexif.load(exif_bytes) if exif_bytes else {}
+    
+    # 确保EXIF字典有必要的键
+    if '0th' not in exif_dict:
+        exif_dict['0th'] = {}
+    if 'Exif' not in exif_dict:
+        exif_dict['Exif'] = {}
+    
+    # 更新EXIF中的时间字段
+    exif_dict['0th'][piexif.ImageIFD.DateTime] = time_str
+    exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal] = time_str
+    exif_dict['Exif'][piexif.ExifIFD.DateTimeDigitized] = time_str
+    
+    # 替换 APP1 段，图像数据原样保留
+    piexif.insert(piexif.dump(exif_dict), file_path)
+
 def update_photo_times(file_path, target_datetime):
     """
     更新照片的EXIF时间信息、视频的QuickTime元数据和文件修改时间
@@ -216,31 +935,12 @@ def update_photo_times(file_path, target_datetime):
         # 对于支持EXIF的格式，尝试更新EXIF数据
         if file_ext in ['.jpg', '.jpeg']:
             try:
-                # 打开图片
-                img = Image.open(file_path)
-                
-                # 获取现有的EXIF数据
-                exif_dict = piexif.load(img.info.get('exif', b''))
-                
                 # 格式化时间字符串 (EXIF格式: "YYYY:MM:DD HH:MM:SS")
                 time_str = target_datetime.strftime("%Y:%m:%d %H:%M:%S")
                 
-                # 确保EXIF字典有必要的键
-                if '0th' not in exif_dict:
-                    exif_dict['0th'] = {}
-                if 'Exif' not in exif_dict:
-                    exif_dict['Exif'] = {}
-                
-                # 更新EXIF中的时间字段
-                exif_dict['0th'][piexif.ImageIFD.DateTime] = time_str
-                exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal] = time_str
-                exif_dict['Exif'][piexif.ExifIFD.DateTimeDigitized] = time_str
-                
-                # 转换为字节数据
-                exif_bytes = piexif.dump(exif_dict)
-                
-                # 保存图片（会覆盖原文件）
-                img.save(file_path, exif=exif_bytes)
+                # 只改写 EXIF 段，不重新编码图像
+                with INSTRUMENTATION.timer("jpeg_write", file_ext):
+                    update_jpeg_exif(file_path, time_str)
                 
                 print(f"✓ 已更新: {os.path.basename(file_path)} -> {time_str} (EXIF + 文件时间)")
                 metadata_updated = True
@@ -261,7 +961,8 @@ def update_photo_times(file_path, target_datetime):
         
         # 更新文件的修改时间和访问时间
         timestamp = target_datetime.timestamp()
-        os.utime(file_path, (timestamp, timestamp))
+        with INSTRUMENTATION.timer("utime", file_ext):
+            os.utime(file_path, (timestamp, timestamp))
         
         if file_ext in ['.png', '.gif', '.heic', '.mov', '.mp4']:
             print(f"✓ 已更新: {os.path.basename(file_path)} -> {target_datetime.strftime('%Y:%m:%d %H:%M:%S')} (仅文件时间)")
@@ -272,23 +973,1390 @@ def update_photo_times(file_path, target_datetime):
         print(f"✗ 更新失败: {os.path.basename(file_path)} - {e}")
         return False
 
+# 移动阶段：每批登记的文件数、跨设备复制时每次系统调用复制的字节数、移动日志文件名
+MOVE_BATCH_SIZE = 256
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+MOVE_JOURNAL_NAME = ".fix_photo_time_moves.journal"
+
+def unique_destination(file_path, target_dir, root=None, reserved=()):
+    """
+    返回目标目录中不会覆盖已有文件的目标路径
+    同名文件已存在（或已被本批其他文件占用）时，在文件名后加上源路径的短哈希；
+    哈希只取决于源文件相对照片目录的路径，因此重复运行会得到相同的文件名
+    """
+    file_path = Path(file_path)
+    target_dir = Path(target_dir)
+    dest_path = target_dir / file_path.name
+    if dest_path not in reserved and not os.path.lexists(dest_path):
+        return dest_path
+    if root is not None:
+        source_key = file_path.relative_to(root).as_posix()
+    else:
+        source_key = str(file_path)
+    digest = hashlib.sha1(source_key.encode("utf-8")).hexdigest()[:8]
+    dest_path = target_dir / f"{file_path.stem}_{digest}{file_path.suffix}"
+    n = 2
+    while dest_path in reserved or os.path.lexists(dest_path):
+        dest_path = target_dir / f"{file_path.stem}_{digest}_{n}{file_path.suffix}"
+        n += 1
+    return dest_path
+
+def copy_file_data(src, dst):
+    """
+    复制文件内容，优先使用 copy_file_range 在内核中复制（Linux）
+    不支持时交给 shutil.copyfile（macOS 上为 fcopyfile，Linux 上为 sendfile）
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                while copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+    shutil.copyfile(src, dst)
+
+def copy_across_devices(src, dst):
+    """
+    跨设备移动：先复制到目标目录中的临时文件并落盘，保留时间戳后改名为目标文件，最后删除源文件
+    任何时刻中断都不会丢失数据，最多留下一个 .part 临时文件
+    """
+    src = Path(src)
+    dst = Path(dst)
+    part_path = dst.with_name(dst.name + ".part")
+    try:
+        copy_file_data(src, part_path)
+        # 保留刚更新过的修改时间
+        shutil.copystat(src, part_path)
+        with open(part_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.rename(part_path, dst)
+    except BaseException:
+        try:
+            os.unlink(part_path)
+        except OSError:
+            pass
+        raise
+    os.unlink(src)
+
+def move_path(src, dst):
+    """同一设备上直接 os.rename，跨设备时复制后删除源文件"""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_across_devices(src, dst)
+
 def move_file(file_path, target_dir, dry_run):
     """
-    移动文件到指定目录
+    移动文件到指定目录（同名文件不会被覆盖）
     """
     if dry_run:
         print(f"[试运行] 将移动到 {target_dir.name}: {os.path.basename(file_path)}")
         return True
     try:
-        dest_path = target_dir / os.path.basename(file_path)
-        shutil.move(str(file_path), str(dest_path))
-        print(f"已移动到 {target_dir.name}: {os.path.basename(file_path)}")
+        dest_path = unique_destination(file_path, target_dir)
+        move_path(file_path, dest_path)
+        print(f"已移动到 {target_dir.name}: {dest_path.name}")
         return True
     except Exception as e:
         print(f"移动文件失败: {os.path.basename(file_path)} - {e}")
         return False
 
-def process_photos(directory_path, dry_run=True):
+class MoveBatch:
+    """
+    批量移动文件到分类文件夹
+    add() 只登记移动并确定不冲突的目标文件名，登记满 batch_size 个后由 flush() 统一执行：
+    与目标目录在同一设备上的文件直接 os.rename，跨设备的文件集中复制后删除源文件
+    每批执行前先把计划写入照片目录下的移动日志，每完成一个文件追加一条记录；
+    运行正常结束时删除日志，中断后可用 recover_moves() 继续完成或回滚
+    """
+    def __init__(self, directory, dry_run=True, batch_size=MOVE_BATCH_SIZE):
+        self.directory = Path(directory)
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.journal_path = self.directory / MOVE_JOURNAL_NAME
+        self.pending = []
+        self.reserved = set()
+        self.devices = {}
+
+    def add(self, file_path, target_dir, tag=None):
+        """
+        登记一次移动；tag 原样出现在结果中
+        返回本次触发执行的那一批结果（未满一批时为空列表），格式同 flush()
+        """
+        file_path = Path(file_path)
+        dest_path = unique_destination(file_path, target_dir, self.directory, self.reserved)
+        self.reserved.add(dest_path)
+        self.pending.append((file_path, dest_path, tag))
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def _device(self, target_dir):
+        device = self.devices.get(target_dir)
+        if device is None:
+            device = self.devices[target_dir] = os.stat(target_dir).st_dev
+        return device
+
+    def flush(self):
+        """执行已登记的移动，返回 [(源路径, 目标路径, tag, 是否成功)]"""
+        batch, self.pending = self.pending, []
+        # 已执行的目标文件存在于磁盘上，冲突检查不再需要 reserved
+        self.reserved = set()
+        if not batch:
+            return []
+        if self.dry_run:
+            for file_path, dest_path, tag in batch:
+                print(f"[试运行] 将移动到 {dest_path.parent.name}: {dest_path.name}")
+            return [(file_path, dest_path, tag, True) for file_path, dest_path, tag in batch]
+        
+        # 同设备的文件只需 rename；跨设备的文件集中放到后面复制
+        renames = []
+        copies = []
+        for file_path, dest_path, tag in batch:
+            try:
+                same_device = os.stat(file_path).st_dev == self._device(dest_path.parent)
+            except OSError:
+                same_device = True
+            (renames if same_device else copies).append((file_path, dest_path, tag))
+        
+        results = []
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            for mode, items in (("rename", renames), ("copy", copies)):
+                for file_path, dest_path, tag in items:
+                    journal.write(json.dumps({"op": "plan", "mode": mode, "src": str(file_path), "dst": str(dest_path)}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            
+            for mode, items in (("rename", renames), ("copy", copies)):
+                for file_path, dest_path, tag in items:
+                    with INSTRUMENTATION.timer("move", file_path.suffix.lower()):
+                        try:
+                            if mode == "rename":
+                                move_path(file_path, dest_path)
+                            else:
+                                copy_across_devices(file_path, dest_path)
+                            ok = True
+                        except OSError as e:
+                            print(f"移动文件失败: {file_path.name} - {e}")
+                            ok = False
+                    if ok:
+                        journal.write(json.dumps({"op": "done", "dst": str(dest_path)}) + "\n")
+                        print(f"已移动到 {dest_path.parent.name}: {dest_path.name}")
+                    results.append((file_path, dest_path, tag, ok))
+            journal.flush()
+            os.fsync(journal.fileno())
+        return results
+
+    def close(self):
+        """执行剩余的移动并删除移动日志，返回最后一批的结果"""
+        results = self.flush()
+        if not self.dry_run:
+            try:
+                os.unlink(self.journal_path)
+            except FileNotFoundError:
+                pass
+        return results
+
+def recover_moves(directory, rollback=False):
+    """
+    根据上次中断时留下的移动日志继续完成或回滚移动
+    
+    Args:
+        directory: 照片和视频目录路径
+        rollback: False 时完成日志中尚未完成的移动；True 时把已完成的移动还原到原位置
+    
+    rename 记录的源路径和目标路径都存在时不做处理并保留移动日志，需要手动确认
+    
+    Returns:
+        处理的文件数；没有移动日志时返回 0
+    """
+    journal_path = Path(directory) / MOVE_JOURNAL_NAME
+    if not journal_path.exists():
+        return 0
+    plans = {}
+    done = set()
+    with open(journal_path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时最后一行可能只写了一半
+                continue
+            if record.get("op") == "plan":
+                plans[record["dst"]] = (Path(record["src"]), record["mode"])
+            elif record.get("op") == "done":
+                done.add(record["dst"])
+    
+    recovered = 0
+    conflicts = 0
+    for dst, (src, mode) in plans.items():
+        if dst in done and not rollback:
+            continue
+        dst = Path(dst)
+        part_path = dst.with_name(dst.name + ".part")
+        if part_path.exists():
+            part_path.unlink()
+        src_exists = src.exists()
+        dst_exists = dst.exists()
+        if src_exists and dst_exists and mode != "copy":
+            # rename 是原子操作，两端都存在说明 dst 是移动后的唯一副本、src 处又出现了新文件，两个都保留
+            print(f"源路径和目标路径都存在，未处理: {src} / {dst}")
+            conflicts += 1
+            continue
+        try:
+            if rollback:
+                if dst_exists and src_exists:
+                    # 跨设备复制已完成但源文件尚未删除
+                    dst.unlink()
+                elif dst_exists:
+                    src.parent.mkdir(parents=True, exist_ok=True)
+                    move_path(dst, src)
+                else:
+                    continue
+                print(f"已还原: {src}")
+            else:
+                if dst_exists and src_exists and mode == "copy":
+                    src.unlink()
+                elif src_exists and not dst_exists:
+                    move_path(src, dst)
+                else:
+                    continue
+                print(f"已完成移动: {dst.parent.name}/{dst.name}")
+            recovered += 1
+        except OSError as e:
+            print(f"{'还原' if rollback else '移动'}文件失败: {src.name} - {e}")
+            return recovered
+    if conflicts:
+        print(f"{conflicts} 个文件需要手动处理，保留移动日志 {journal_path}")
+        return recovered
+    journal_path.unlink()
+    return recovered
+
+# 单个文件的处理结果（决定父进程中的计数和移动目标）
+OUTCOME_SKIPPED = "skipped"
+OUTCOME_EXIF = "exif"
+OUTCOME_FILETIME = "filetime"
+OUTCOME_UNPROCESSED = "unprocessed"
+
+def read_file_times(file_path):
+    """
+    读取判断所需的时间（只读，不修改文件）
+
+    Returns:
+        (文件名时间, EXIF/QuickTime 元数据时间, 文件修改时间)，无法获取的项为 None
+    """
+    file_path = Path(file_path)
+    file_ext = file_path.suffix.lower()
+    # 从文件名解析时间
+    with INSTRUMENTATION.timer("parse_filename", file_ext):
+        target_datetime = parse_filename_datetime(file_path.name, str(file_path))
+    
+    # 获取 EXIF/QuickTime 元数据时间和文件修改时间
+    with INSTRUMENTATION.timer("read_metadata", file_ext):
+        metadata_datetime = get_metadata_datetime(str(file_path))
+    try:
+        file_mtime = datetime.datetime.fromtimestamp(os.stat(file_path).st_mtime)
+    except Exception as e:
+        print(f"无法获取文件时间: {file_path.name} - {e}")
+        file_mtime = None
+    return target_datetime, metadata_datetime, file_mtime
+
+def decide_outcome(file_path, target_datetime, metadata_datetime, file_mtime):
+    """
+    根据 read_file_times 读取的时间判断单个文件（不访问文件）
+
+    Returns:
+        (outcome, target_datetime)
+        outcome 为 OUTCOME_SKIPPED / OUTCOME_UNPROCESSED，
+        或 OUTCOME_EXIF 表示需要按 target_datetime 更新
+    """
+    file_path = Path(file_path)
+    file_ext = file_path.suffix.lower()
+    if target_datetime:
+        # 检查时间是否接近（±60秒）
+        metadata_match = (
+            (metadata_datetime and file_ext not in ['.png', '.gif'] and
+             abs((metadata_datetime - target_datetime).total_seconds()) <= TIME_DELTA_THRESHOLD)
+            or (file_ext in ['.png', '.gif'] and not metadata_datetime)
+        )
+        filetime_match = (
+            file_mtime and
+            abs((file_mtime - target_datetime).total_seconds()) <= TIME_DELTA_THRESHOLD
+        )
+        
+        if metadata_match and filetime_match:
+            print(f"时间接近，跳过: {file_path.name} -> {target_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+            return OUTCOME_SKIPPED, target_datetime
+        elif file_ext in ['.png', '.gif'] and filetime_match:
+            print(f"文件名时间与文件时间接近，跳过: {file_path.name} -> {target_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+            return OUTCOME_SKIPPED, target_datetime
+        else:
+            return OUTCOME_EXIF, target_datetime
+    else:
+        # 文件名无法解析，检查 EXIF/QuickTime 时间和文件修改时间
+        if metadata_datetime and file_mtime and (
+            abs((metadata_datetime - file_mtime).total_seconds()) <= TIME_DELTA_THRESHOLD
+        ):
+            print(f"文件名无法解析但元数据与文件时间接近，跳过: {file_path.name} -> {metadata_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+            return OUTCOME_SKIPPED, None
+        else:
+            print(f"文件名和元数据均无法解析或时间不一致: {file_path.name}")
+            return OUTCOME_UNPROCESSED, None
+
+def classify_file(file_path):
+    """
+    解析并判断单个文件（只读，不修改文件）
+
+    Returns:
+        (outcome, target_datetime)，含义同 decide_outcome
+    """
+    return decide_outcome(file_path, *read_file_times(file_path))
+
+# 列式批量判断（classify_columns）使用的编码
+# 时间列: 本地时间（与文件名、元数据时间一样不带时区）距 1970-01-01 的微秒数（int64），缺失为 MISSING_TIME；
+# 使用微秒而不是秒，是因为 decide_outcome 比较的文件修改时间带有微秒
+MISSING_TIME = -(2 ** 63)
+_NAIVE_EPOCH = datetime.datetime(1970, 1, 1)
+# 扩展名编码（0 为其他扩展名）；没有元数据时间、只比较文件时间的扩展名（与 decide_outcome 一致）
+EXTENSION_CODES = {ext: code for code, ext in enumerate(sorted(MEDIA_EXTENSIONS), start=1)}
+NO_METADATA_EXTENSIONS = {'.png', '.gif'}
+# 判断结果编码: OUTCOME_CODES[编码] 为对应的 OUTCOME_*
+OUTCOME_CODES = (OUTCOME_SKIPPED, OUTCOME_EXIF, OUTCOME_FILETIME, OUTCOME_UNPROCESSED)
+
+def time_column_value(value):
+    """datetime（不带时区）转为时间列的微秒数，None 转为 MISSING_TIME"""
+    if value is None:
+        return MISSING_TIME
+    return (value - _NAIVE_EPOCH) // datetime.timedelta(microseconds=1)
+
+def extension_code(ext):
+    """扩展名（含点，不区分大小写）的编码"""
+    return EXTENSION_CODES.get(ext.lower(), 0)
+
+def time_columns(rows):
+    """
+    把 [(文件路径或扩展名, 文件名时间, 元数据时间, 文件修改时间)] 转为 classify_columns 的输入
+    时间为 read_file_times 返回的 datetime 或 None
+
+    Returns:
+        (扩展名编码, 文件名时间, 元数据时间, 文件修改时间) 四个 numpy 数组
+    """
+    import numpy as np
+    rows = list(rows)
+    ext_codes = np.fromiter((extension_code(os.path.splitext(str(row[0]))[1] or str(row[0])) for row in rows),
+                            dtype=np.int8, count=len(rows))
+    columns = [
+        np.fromiter((time_column_value(row[index]) for row in rows), dtype=np.int64, count=len(rows))
+        for index in (1, 2, 3)
+    ]
+    return (ext_codes, *columns)
+
+def classify_columns(ext_codes, target, metadata, mtime, threshold=None):
+    """
+    对一批文件做与 decide_outcome 完全相同的判断（向量化，不打印、不访问文件）
+    用于阈值变化后重新判断大量已记录的文件
+
+    Args:
+        ext_codes: 扩展名编码数组（EXTENSION_CODES）
+        target, metadata, mtime: 文件名时间、元数据时间、文件修改时间的 int64 数组（见 time_column_value）
+        threshold: 时间偏差阈值（秒），默认为 TIME_DELTA_THRESHOLD
+
+    Returns:
+        (metadata_match, filetime_match, outcome_codes)
+        前两个为布尔数组，文件名无法解析的文件两者均为 False；
+        outcome_codes 为 int8 数组，OUTCOME_CODES[编码] 为 OUTCOME_SKIPPED / OUTCOME_EXIF / OUTCOME_UNPROCESSED
+    """
+    import numpy as np
+    threshold = TIME_DELTA_THRESHOLD if threshold is None else threshold
+    ext_codes = np.asarray(ext_codes)
+    target = np.asarray(target, dtype=np.int64)
+    metadata = np.asarray(metadata, dtype=np.int64)
+    mtime = np.asarray(mtime, dtype=np.int64)
+    
+    def close(a, b, valid):
+        # 与 abs((a - b).total_seconds()) <= threshold 相同：微秒差除以 10^6（正确舍入的浮点数）后比较
+        diff = np.subtract(a, b, out=np.zeros(a.shape, dtype=np.int64), where=valid)
+        return valid & (np.abs(diff) / 1e6 <= threshold)
+    
+    no_metadata_ext = np.isin(ext_codes, [EXTENSION_CODES[ext] for ext in NO_METADATA_EXTENSIONS])
+    has_target = target != MISSING_TIME
+    has_metadata = metadata != MISSING_TIME
+    has_mtime = mtime != MISSING_TIME
+    
+    # 文件名可以解析：元数据和文件时间都接近时跳过，PNG/GIF 只要文件时间接近就跳过，否则更新
+    metadata_match = has_target & (
+        (~no_metadata_ext & close(metadata, target, has_target & has_metadata))
+        | (no_metadata_ext & ~has_metadata)
+    )
+    filetime_match = close(mtime, target, has_target & has_mtime)
+    skip_named = filetime_match & (metadata_match | no_metadata_ext)
+    # 文件名无法解析：元数据时间与文件时间接近时跳过，否则为未处理
+    skip_unnamed = ~has_target & close(metadata, mtime, ~has_target & has_metadata & has_mtime)
+    
+    outcome_codes = np.where(
+        has_target,
+        np.where(skip_named, OUTCOME_CODES.index(OUTCOME_SKIPPED), OUTCOME_CODES.index(OUTCOME_EXIF)),
+        np.where(skip_unnamed, OUTCOME_CODES.index(OUTCOME_SKIPPED), OUTCOME_CODES.index(OUTCOME_UNPROCESSED)),
+    ).astype(np.int8)
+    return metadata_match, filetime_match, outcome_codes
+
+def time_from_column_value(value):
+    """time_column_value 的逆转换，MISSING_TIME 转为 None"""
+    if value == MISSING_TIME:
+        return None
+    return _NAIVE_EPOCH + datetime.timedelta(microseconds=value)
+
+# 记录集合中尚未判断的文件的结果编码
+OUTCOME_CODE_PENDING = -1
+# 记录集合映射文件的标识
+RECORD_STORE_MAGIC = b"FPTRECS1"
+
+class FileRecordStore:
+    """
+    紧凑的逐文件记录集合，用于需要保留每个文件状态的处理（排序、报告、冲突检测、断点续跑等）
+    每个文件不再是 Path 和 datetime 对象，而是若干 array 列中的一行（约 60 字节加文件名长度）：
+    - 目录前缀去重，每行只保存目录编号；文件名以 UTF-8 连续存放，只保存结束位置
+    - 大小、mtime_ns 用于核对文件是否变化；三个时间列与 classify_columns 的编码相同
+    - 判断结果为 OUTCOME_CODES 中的编码，未判断为 OUTCOME_CODE_PENDING
+    spill() 把全部列写入文件并改为内存映射访问，之后不能再添加（判断结果列在可写映射中仍可修改）
+    """
+    # (列名, array 类型码)
+    COLUMNS = (
+        ("dir", "I"), ("name_end", "Q"), ("size", "q"), ("mtime_ns", "q"),
+        ("target", "q"), ("metadata", "q"), ("mtime", "q"), ("ext", "b"), ("outcome", "b"),
+    )
+
+    def __init__(self):
+        import array
+        self.columns = {name: array.array(typecode) for name, typecode in self.COLUMNS}
+        self.names = bytearray()
+        self.dirs = []
+        self.dir_index = {}
+        self.mapped = None
+        self.writable = True
+
+    def __len__(self):
+        return len(self.columns["dir"])
+
+    def append(self, file_path, size, mtime_ns, target=None, metadata=None, mtime=None, outcome=None):
+        """
+        添加一个文件，返回行号
+        target、metadata、mtime 为 read_file_times 返回的 datetime 或 None，outcome 为 OUTCOME_* 或 None
+        """
+        if self.mapped is not None:
+            raise ValueError("记录集合已写入映射文件，不能再添加")
+        directory, name = os.path.split(os.fspath(file_path))
+        dir_number = self.dir_index.get(directory)
+        if dir_number is None:
+            dir_number = self.dir_index[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        self.names += os.fsencode(name)
+        columns = self.columns
+        columns["dir"].append(dir_number)
+        columns["name_end"].append(len(self.names))
+        columns["size"].append(size)
+        columns["mtime_ns"].append(mtime_ns)
+        columns["target"].append(time_column_value(target))
+        columns["metadata"].append(time_column_value(metadata))
+        columns["mtime"].append(time_column_value(mtime))
+        columns["ext"].append(extension_code(os.path.splitext(name)[1]))
+        columns["outcome"].append(OUTCOME_CODE_PENDING if outcome is None else OUTCOME_CODES.index(outcome))
+        return len(self) - 1
+
+    def path(self, index):
+        """第 index 行的文件路径"""
+        start = self.columns["name_end"][index - 1] if index > 0 else 0
+        name = os.fsdecode(bytes(self.names[start:self.columns["name_end"][index]]))
+        return os.path.join(self.dirs[self.columns["dir"][index]], name)
+
+    def get(self, index):
+        """第 index 行，返回 (路径, 大小, mtime_ns, 文件名时间, 元数据时间, 文件修改时间, outcome)"""
+        columns = self.columns
+        code = columns["outcome"][index]
+        return (
+            self.path(index), columns["size"][index], columns["mtime_ns"][index],
+            time_from_column_value(columns["target"][index]),
+            time_from_column_value(columns["metadata"][index]),
+            time_from_column_value(columns["mtime"][index]),
+            OUTCOME_CODES[code] if code != OUTCOME_CODE_PENDING else None,
+        )
+
+    def _check_writable(self):
+        if not self.writable:
+            raise ValueError("记录集合以只读方式打开，不能修改判断结果（请使用 open(path, writable=True)）")
+
+    def set_outcome(self, index, outcome):
+        self._check_writable()
+        self.columns["outcome"][index] = OUTCOME_CODES.index(outcome)
+
+    def outcome_counts(self):
+        """各判断结果的文件数（未判断的计为 None）"""
+        counts = collections.Counter(self.columns["outcome"])
+        return {OUTCOME_CODES[code] if code != OUTCOME_CODE_PENDING else None: count for code, count in counts.items()}
+
+    def reclassify(self, threshold=None):
+        """用 classify_columns 按 threshold（默认 TIME_DELTA_THRESHOLD）重新判断全部文件并写回判断结果列"""
+        self._check_writable()
+        import numpy as np
+        column = lambda name, dtype: np.frombuffer(self.columns[name], dtype=dtype)
+        _, _, codes = classify_columns(
+            column("ext", np.int8), column("target", np.int64),
+            column("metadata", np.int64), column("mtime", np.int64), threshold)
+        outcomes = column("outcome", np.int8)
+        outcomes[:] = codes
+        # 释放对列缓冲区的引用，array 列才能继续追加
+        del outcomes
+        return self.outcome_counts()
+
+    def nbytes(self):
+        """列、文件名和目录前缀占用的字节数（不含 array 的预留空间）"""
+        total = len(self.names) + sum(len(os.fsencode(directory)) for directory in self.dirs)
+        return total + sum(len(column) * column.itemsize for column in self.columns.values())
+
+    def spill(self, path):
+        """
+        把全部记录写入 path 并改为内存映射访问，释放内存中的列
+        已映射的记录集合也可以再次写入（例如复制到其他路径），之后映射新文件
+        """
+        # 每列按 8 字节对齐：文件头之后依次为各列和文件名
+        layout = {}
+        offset = 0
+        for name, typecode in self.COLUMNS:
+            size = len(self.columns[name]) * self.columns[name].itemsize
+            layout[name] = [typecode, self.columns[name].itemsize, offset, size]
+            offset += (size + 7) & ~7
+        header = json.dumps({
+            "count": len(self), "dirs": self.dirs, "columns": layout, "names": [offset, len(self.names)],
+        }).encode("utf-8")
+        data_start = (len(RECORD_STORE_MAGIC) + 8 + len(header) + 7) & ~7
+        tmp_path = os.fspath(path) + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(RECORD_STORE_MAGIC + struct.pack("<Q", len(header)) + header)
+                for name, (_, _, column_offset, _) in layout.items():
+                    f.seek(data_start + column_offset)
+                    # array 列和映射后的 memoryview 列都按缓冲区写入
+                    f.write(self.columns[name])
+                f.seek(data_start + offset)
+                f.write(self.names)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._map(path, writable=True)
+
+    @classmethod
+    def open(cls, path, writable=False):
+        """以内存映射方式打开 spill() 写入的文件；writable=True 时可修改判断结果列"""
+        store = cls.__new__(cls)
+        store._map(path, writable)
+        return store
+
+    def _map(self, path, writable):
+        with open(path, "r+b" if writable else "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        # 出错时先释放所有 memoryview 再关闭映射，否则 mmap.close() 会抛出 BufferError
+        views = []
+        try:
+            if mapped[:len(RECORD_STORE_MAGIC)] != RECORD_STORE_MAGIC:
+                raise ValueError(f"不是记录集合文件: {path}")
+            header_start = len(RECORD_STORE_MAGIC) + 8
+            header_size = struct.unpack("<Q", mapped[len(RECORD_STORE_MAGIC):header_start])[0]
+            header = json.loads(mapped[header_start:header_start + header_size])
+            data_start = (header_start + header_size + 7) & ~7
+            views.append(memoryview(mapped))
+            view = views[0]
+            columns = {}
+            for name, (typecode, itemsize, offset, size) in header["columns"].items():
+                views.append(view[data_start + offset:data_start + offset + size])
+                views.append(views[-1].cast(typecode))
+                if views[-1].itemsize != itemsize:
+                    raise ValueError(f"记录集合文件的列 {name} 与本机类型长度不同: {path}")
+                columns[name] = views[-1]
+            names_offset, names_size = header["names"]
+            views.append(view[data_start + names_offset:data_start + names_offset + names_size])
+            names = views[-1]
+            dirs = list(header["dirs"])
+        except Exception as e:
+            for item in reversed(views):
+                item.release()
+            mapped.close()
+            if isinstance(e, ValueError) and not isinstance(e, json.JSONDecodeError):
+                raise
+            raise ValueError(f"记录集合文件已损坏: {path} ({e})") from e
+        self.close()
+        self.columns = columns
+        self.names = names
+        self.dirs = dirs
+        self.dir_index = {directory: index for index, directory in enumerate(self.dirs)}
+        self.mapped = mapped
+        self.writable = writable
+
+    def close(self):
+        """释放内存映射（未映射时不做任何事）"""
+        mapped = getattr(self, "mapped", None)
+        if mapped is None:
+            return
+        for column in self.columns.values():
+            column.release()
+        self.names.release()
+        self.columns = {}
+        self.names = b""
+        self.mapped = None
+        mapped.close()
+
+def apply_update(file_path, target_datetime, dry_run=True):
+    """
+    对需要更新的文件执行更新（试运行时只打印）
+    返回 OUTCOME_EXIF（元数据和文件时间均已更新）或 OUTCOME_FILETIME（仅文件时间）
+    """
+    file_path = Path(file_path)
+    if dry_run:
+        print(f"[试运行] {file_path.name} -> {target_datetime.strftime('%Y-%m-%d %H:%M:%S')} (元数据 + 文件时间)")
+        return OUTCOME_EXIF
+    if update_photo_times(str(file_path), target_datetime):
+        return OUTCOME_EXIF
+    return OUTCOME_FILETIME
+
+def classify_and_update(file_path, dry_run=True):
+    """
+    解析并判断单个文件，必要时更新元数据和文件时间（不移动文件）
+    可在子进程中执行，移动和计数由父进程根据返回结果完成
+
+    Args:
+        file_path: 文件路径
+        dry_run: 是否为试运行模式
+
+    Returns:
+        OUTCOME_SKIPPED / OUTCOME_EXIF / OUTCOME_FILETIME / OUTCOME_UNPROCESSED
+    """
+    file_ext = os.path.splitext(str(file_path))[1].lower()
+    with INSTRUMENTATION.timer("classify", file_ext):
+        outcome, target_datetime = classify_file(file_path)
+    if outcome != OUTCOME_EXIF:
+        return outcome
+    with INSTRUMENTATION.timer("update", file_ext):
+        return apply_update(file_path, target_datetime, dry_run)
+
+# 增量运行索引文件名（位于照片目录根部）
+RUN_CACHE_NAME = ".fix_photo_time_cache.sqlite"
+# 可以缓存的判断结果：文件本身不会被修改，只要路径、大小、mtime 和 inode 不变结果就不变
+CACHEABLE_OUTCOMES = {OUTCOME_SKIPPED, OUTCOME_UNPROCESSED}
+
+def decision_fingerprint():
+    """判断规则的指纹（时间阈值和文件名格式），规则变化时索引整体失效"""
+    rules = repr((TIME_DELTA_THRESHOLD, sorted(FILENAME_PATTERNS.items())))
+    return hashlib.sha1(rules.encode("utf-8")).hexdigest()
+
+class RunCache:
+    """
+    增量运行索引（SQLite），记录每个文件的 (路径, 大小, mtime_ns, inode) 和判断结果
+    文件未变化时直接复用上次的判断结果，不再打开文件
+    路径以相对照片目录的形式保存
+    """
+    def __init__(self, directory, full=False):
+        self.directory = Path(directory)
+        self.full = full
+        self.started_at = time.time()
+        self.connection = sqlite3.connect(str(self.directory / RUN_CACHE_NAME))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "outcome TEXT, checked_at REAL)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.entries = {}
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        fingerprint = decision_fingerprint()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                print("判断规则已变化，增量索引失效")
+            self.invalidate()
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            self.connection.commit()
+        if not full:
+            for path, size, mtime_ns, inode, outcome in self.connection.execute(
+                "SELECT path, size, mtime_ns, inode, outcome FROM files"
+            ):
+                self.entries[path] = (size, mtime_ns, inode, outcome)
+        self.hits = 0
+        self.pending = 0
+
+    def _key(self, file_path):
+        return Path(file_path).relative_to(self.directory).as_posix()
+
+    def lookup(self, file_path, st=None):
+        """
+        文件未变化时返回上次的判断结果，否则返回 None（--full 模式下总是返回 None）
+        st 可传入遍历时已取得的 stat 结果，避免重复 stat
+        """
+        entry = self.entries.get(self._key(file_path))
+        if entry is None:
+            return None
+        try:
+            if st is None:
+                st = os.stat(file_path)
+        except OSError:
+            return None
+        if (st.st_size, st.st_mtime_ns, st.st_ino) != entry[:3]:
+            return None
+        self.hits += 1
+        return entry[3]
+
+    def record(self, file_path, outcome):
+        """记录文件当前状态和判断结果，只记录 CACHEABLE_OUTCOMES"""
+        if outcome not in CACHEABLE_OUTCOMES:
+            return
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+        key = self._key(file_path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (key, st.st_size, st.st_mtime_ns, st.st_ino, outcome, time.time())
+        )
+        self.entries[key] = (st.st_size, st.st_mtime_ns, st.st_ino, outcome)
+        self.pending += 1
+        if self.pending >= 1000:
+            self.connection.commit()
+            self.pending = 0
+
+    def forget(self, file_path):
+        """删除单个文件的索引记录（不立即提交），用于已移入分类文件夹、不会再被遍历的文件"""
+        key = self._key(file_path)
+        if self.entries.pop(key, None) is None:
+            return
+        self.connection.execute("DELETE FROM files WHERE path = ?", (key,))
+        self.pending += 1
+        if self.pending >= 1000:
+            self.connection.commit()
+            self.pending = 0
+
+    def invalidate(self, file_paths=None):
+        """删除指定文件的索引记录，不指定时清空整个索引"""
+        if file_paths is None:
+            self.connection.execute("DELETE FROM files")
+            self.entries.clear()
+        else:
+            keys = [self._key(p) for p in file_paths]
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(k,) for k in keys])
+            for key in keys:
+                self.entries.pop(key, None)
+        self.connection.commit()
+
+    def close(self):
+        """提交索引；--full 模式下删除本次没有再出现的旧记录"""
+        if self.full:
+            self.connection.execute("DELETE FROM files WHERE checked_at < ?", (self.started_at,))
+        self.connection.commit()
+        self.connection.close()
+
+def walk_media_files(directory):
+    """
+    使用 os.scandir 流式遍历目录，产出媒体文件的 DirEntry
+    跳过隐藏目录和根目录下的分类文件夹，不跟随目录符号链接
+    """
+    root = os.fspath(directory)
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name.startswith('.'):
+                                continue
+                            if current == root and entry.name in OUTPUT_DIR_NAMES:
+                                continue
+                            subdirs.append(entry.path)
+                        elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in MEDIA_EXTENSIONS:
+                            yield entry
+                    except OSError as e:
+                        print(f"无法读取: {entry.path} - {e}")
+        except OSError as e:
+            print(f"无法读取目录: {current} - {e}")
+        # 倒序入栈，使子目录按 scandir 返回的顺序处理
+        stack.extend(reversed(subdirs))
+
+class BackgroundWalk:
+    """
+    在后台线程中遍历目录，通过有界队列把 DirEntry 交给处理循环
+    处理可以在遍历完成前开始；遍历结束后 total 为文件总数
+    """
+    _DONE = object()
+
+    def __init__(self, directory, maxsize=WALK_QUEUE_SIZE):
+        self.directory = directory
+        self.queue = queue.Queue(maxsize)
+        self.total = None
+        self.thread = threading.Thread(target=self._run, name="media-walk", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        count = 0
+        start = time.perf_counter()
+        try:
+            for entry in walk_media_files(self.directory):
+                self.queue.put(entry)
+                count += 1
+        finally:
+            # 包含队列已满时的等待时间
+            INSTRUMENTATION.add("walk", "", start, time.perf_counter(), count=count)
+            self.total = count
+            self.queue.put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            entry = self.queue.get()
+            if entry is self._DONE:
+                return
+            yield entry
+
+def classify_batch(file_paths, dry_run=True, trace=False):
+    """
+    在子进程中依次处理一批文件
+    返回 (结果列表, 本批的计时记录)，计时记录由主进程合并
+    """
+    if trace and INSTRUMENTATION.events is None:
+        INSTRUMENTATION.events = []
+    outcomes = [classify_and_update(file_path, dry_run) for file_path in file_paths]
+    return outcomes, INSTRUMENTATION.drain()
+
+class FileTask:
+    """流水线中的单个文件，各阶段依次填入读取到的时间和处理结果"""
+    __slots__ = ("path", "ext", "target_datetime", "metadata_datetime", "file_mtime", "outcome")
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = os.path.splitext(path)[1].lower()
+        self.target_datetime = None
+        self.metadata_datetime = None
+        self.file_mtime = None
+        self.outcome = None
+
+def read_stage(task):
+    """流水线读取阶段：解析文件名，读取元数据时间和文件修改时间"""
+    task.target_datetime, task.metadata_datetime, task.file_mtime = read_file_times(task.path)
+    return task
+
+def classify_stage(task):
+    """流水线判断阶段：只根据已读取的时间判断，不访问文件"""
+    with INSTRUMENTATION.timer("classify", task.ext):
+        task.outcome, task.target_datetime = decide_outcome(
+            task.path, task.target_datetime, task.metadata_datetime, task.file_mtime)
+    return task
+
+def write_stage(task, dry_run=True):
+    """流水线写入阶段：需要更新的文件改写元数据和文件时间（试运行时只打印）"""
+    if task.outcome == OUTCOME_EXIF:
+        with INSTRUMENTATION.timer("update", task.ext):
+            task.outcome = apply_update(task.path, task.target_datetime, dry_run)
+    return task
+
+def run_stage_in_process(func, task, trace=False):
+    """在进程池中执行一个阶段，返回 (task, 本次的计时记录)"""
+    if trace and INSTRUMENTATION.events is None:
+        INSTRUMENTATION.events = []
+    return func(task), INSTRUMENTATION.drain()
+
+# 流水线模式：阶段之间队列的长度，以及各阶段默认的 (并发数, 执行方式)
+# thread 阶段在线程中执行，适合主要在等待磁盘的读取和写入；
+# process 阶段由线程转交给共用的进程池，适合耗 CPU 的阶段（线程数即该阶段在进程池中的在途任务数）
+PIPELINE_QUEUE_SIZE = 256
+PIPELINE_STAGES = {
+    "read": (8, "thread"),
+    "classify": (1, "thread"),
+    "write": (4, "thread"),
+}
+PIPELINE_STAGE_KINDS = ("thread", "process")
+
+class StagedPipeline:
+    """
+    多阶段流水线：每个阶段有自己的有界输入队列和若干工作线程，各阶段同时处理不同的文件
+    下游处理不过来时上游阻塞在队列上（背压）；submit() 在在途任务达到 max_in_flight 时先取回结果，
+    因此内存占用只取决于队列长度，与文件总数无关
+    结果按提交顺序交付；任务出错时异常随结果返回，后续阶段不再执行
+    submit()、collect()、finish() 只能由同一个线程调用
+    """
+    _STOP = object()
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, max_in_flight=None, trace=False):
+        """stages: [(阶段名, 函数, 并发数, "thread" 或 "process")]，函数接收并返回 FileTask"""
+        self.names = [name for name, _, _, _ in stages]
+        self.queues = [queue.Queue(queue_size) for _ in stages]
+        self.output = queue.Queue()
+        self.max_in_flight = max_in_flight or queue_size * len(stages)
+        self.trace = trace
+        self.watched = []
+        self.depth_stats = {}       # 队列名 -> [采样次数, 长度总和, 最大长度]
+        self.submitted = 0
+        self.delivered = 0
+        self.buffered = {}
+        
+        process_workers = sum(count for _, _, count, kind in stages if kind == "process")
+        self.pool = None
+        if process_workers:
+            # 子进程以 fork 方式启动时会继承主进程已有的计时记录，需先清空
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=process_workers, initializer=INSTRUMENTATION.reset, initargs=(trace,))
+        
+        self.live = [count for _, _, count, _ in stages]
+        self.live_lock = threading.Lock()
+        self.threads = []
+        for index, (name, func, count, kind) in enumerate(stages):
+            for n in range(count):
+                thread = threading.Thread(target=self._work, args=(index, func, kind),
+                                          name=f"pipeline-{name}-{n}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self, index, func, kind):
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else self.output
+        while True:
+            item = inbox.get()
+            if item is self._STOP:
+                # 本阶段最后一个线程退出时通知下一阶段，其余线程把结束标记留给同阶段的其他线程
+                with self.live_lock:
+                    self.live[index] -= 1
+                    last = self.live[index] == 0
+                (outbox if last else inbox).put(self._STOP)
+                return
+            seq, task, error = item
+            if error is None:
+                try:
+                    if kind == "process":
+                        task, snapshot = self.pool.submit(run_stage_in_process, func, task, self.trace).result()
+                        INSTRUMENTATION.merge(snapshot)
+                    else:
+                        task = func(task)
+                except Exception as e:
+                    error = e
+            outbox.put((seq, task, error))
+
+    def watch(self, name, source):
+        """把流水线之外的队列（如遍历队列）也计入 depths() 和队列长度统计"""
+        self.watched.append((name, source))
+
+    def depths(self):
+        """
+        各队列当前的长度 {队列名: 长度}，阶段名对应该阶段的输入队列
+        长期接近上限的队列后面那个阶段就是瓶颈，长期为空的队列说明上游供应不足
+        """
+        depths = {name: source.qsize() for name, source in self.watched}
+        depths.update((name, stage_queue.qsize()) for name, stage_queue in zip(self.names, self.queues))
+        return depths
+
+    def _sample(self):
+        for name, depth in self.depths().items():
+            stats = self.depth_stats.get(name)
+            if stats is None:
+                stats = self.depth_stats[name] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += depth
+            if depth > stats[2]:
+                stats[2] = depth
+
+    def depth_summary(self):
+        """每次提交时采样的队列长度 {队列名: (平均长度, 最大长度)}"""
+        return {name: (total / count if count else 0, longest)
+                for name, (count, total, longest) in self.depth_stats.items()}
+
+    def submit(self, task):
+        """提交一个任务，返回已按顺序完成的结果 [(task, 异常或 None)]"""
+        ready = []
+        while self.submitted - self.delivered >= self.max_in_flight:
+            ready.extend(self.collect(block=True))
+        self._sample()
+        self.queues[0].put((self.submitted, task, None))
+        self.submitted += 1
+        ready.extend(self.collect(block=False))
+        return ready
+
+    def collect(self, block=True):
+        """
+        取回已完成的结果，只交付到第一个未完成的任务为止
+        block=True 时至少等到一个任务完成（可能因前面的任务未完成而仍返回空列表）
+        """
+        try:
+            item = self.output.get(block)
+        except queue.Empty:
+            return []
+        while True:
+            seq, task, error = item
+            self.buffered[seq] = (task, error)
+            try:
+                item = self.output.get_nowait()
+            except queue.Empty:
+                break
+        ready = []
+        while self.delivered in self.buffered:
+            ready.append(self.buffered.pop(self.delivered))
+            self.delivered += 1
+        return ready
+
+    @property
+    def pending(self):
+        """已提交但尚未交付的任务数"""
+        return self.submitted - self.delivered
+
+    def close(self):
+        """通知各阶段结束并等待线程退出（应在所有结果都已交付后调用）"""
+        self.queues[0].put(self._STOP)
+        for thread in self.threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def abort(self):
+        """处理循环异常退出时使用：不再等待在途任务，工作线程随主进程退出"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+def build_pipeline(dry_run=True, stages=None, queue_size=PIPELINE_QUEUE_SIZE, trace=False):
+    """
+    创建 读取 → 判断 → 写入 三个阶段的流水线
+    stages 为 {阶段名: (并发数, 执行方式)}，未指定的阶段使用 PIPELINE_STAGES 中的默认值
+    遍历在 BackgroundWalk 线程中、索引查找和移动在主线程中完成，不属于流水线
+    """
+    settings = dict(PIPELINE_STAGES)
+    for name, (count, kind) in (stages or {}).items():
+        if name not in PIPELINE_STAGES:
+            raise ValueError(f"未知的流水线阶段: {name}")
+        if count < 1 or kind not in PIPELINE_STAGE_KINDS:
+            raise ValueError(f"流水线阶段设置无效: {name}={count}:{kind}")
+        settings[name] = (count, kind)
+    funcs = {
+        "read": read_stage,
+        "classify": classify_stage,
+        "write": functools.partial(write_stage, dry_run=dry_run),
+    }
+    return StagedPipeline(
+        [(name, funcs[name], count, kind) for name, (count, kind) in settings.items()],
+        queue_size=queue_size, trace=trace,
+    )
+
+def iter_outcomes(entries, dry_run, workers=1, cache=None, pipeline=None):
+    """
+    按 entries（DirEntry）的顺序产出 (file_path, outcome, 是否来自索引)
+    索引命中的文件直接使用缓存结果，其余文件交给 classify_and_update
+    workers > 1 时按批提交到进程池，在途批次数有上限，结果顺序与串行一致
+    传入 pipeline（StagedPipeline）时改为逐个文件提交到流水线，结果顺序同样与串行一致
+    """
+    def lookup(entry):
+        file_path = Path(entry.path)
+        if cache is None:
+            return file_path, None
+        ext = os.path.splitext(entry.name)[1].lower()
+        with INSTRUMENTATION.timer("cache_lookup", ext):
+            try:
+                cached = cache.lookup(file_path, entry.stat())
+            except OSError:
+                cached = None
+        if cached is not None:
+            INSTRUMENTATION.count("cache_hit", ext)
+        return file_path, cached
+    
+    if pipeline is not None:
+        yield from _iter_pipeline_outcomes(entries, lookup, pipeline)
+        return
+    
+    if workers <= 1:
+        for entry in entries:
+            file_path, cached = lookup(entry)
+            if cached is not None:
+                yield file_path, cached, True
+            else:
+                yield file_path, classify_and_update(file_path, dry_run), False
+        return
+    
+    def resolve(batch, future):
+        fresh = []
+        if future is not None:
+            fresh, snapshot = future.result()
+            INSTRUMENTATION.merge(snapshot)
+        fresh = iter(fresh)
+        for file_path, cached in batch:
+            if cached is not None:
+                yield file_path, cached, True
+            else:
+                yield file_path, next(fresh), False
+    
+    max_pending = workers * POOL_BATCHES_PER_WORKER
+    pending = collections.deque()
+    # 子进程以 fork 方式启动时会继承主进程已有的计时记录，需先清空
+    trace = INSTRUMENTATION.events is not None
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=INSTRUMENTATION.reset, initargs=(trace,)) as executor:
+        def submit(batch):
+            misses = [str(file_path) for file_path, cached in batch if cached is None]
+            future = executor.submit(classify_batch, misses, dry_run, trace) if misses else None
+            pending.append((batch, future))
+        
+        batch = []
+        for entry in entries:
+            batch.append(lookup(entry))
+            if len(batch) >= POOL_BATCH_SIZE:
+                submit(batch)
+                batch = []
+                # 在途批次达到上限时先交付最早的一批（背压）
+                while len(pending) > max_pending:
+                    yield from resolve(*pending.popleft())
+        if batch:
+            submit(batch)
+        while pending:
+            yield from resolve(*pending.popleft())
+
+# 计划文件：试运行的判断结果，实际修改时直接执行而不再扫描
+PLAN_VERSION = 1
+PLAN_FILE_NAME = ".fix_photo_time_plan.jsonl"
+PLAN_ACTION_UPDATE = "update"       # 更新元数据和文件时间后移动
+PLAN_ACTION_MOVE = "move"           # 只移动（文件名和元数据均无法解析）
+
+class PlanWriter:
+    """
+    把试运行的判断结果写入计划文件（JSON Lines）
+    第一行为文件头，之后每个需要处理的文件一行: [相对路径, 大小, mtime_ns, 目标时间, 动作, 目标文件夹]
+    跳过的文件不写入；先写临时文件，close() 时替换，中断时不会留下不完整的计划
+    """
+    def __init__(self, path, directory):
+        self.path = os.fspath(path)
+        self.directory = Path(directory)
+        self.tmp_path = self.path + ".tmp"
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        self.counts = collections.Counter()
+        header = {
+            "plan": PLAN_VERSION,
+            "directory": os.path.abspath(self.directory),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "threshold": TIME_DELTA_THRESHOLD,
+        }
+        self.file.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+    def add(self, file_path, outcome):
+        """登记一个试运行判断为需要处理的文件（OUTCOME_EXIF 或 OUTCOME_UNPROCESSED）"""
+        file_path = Path(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError as e:
+            print(f"无法获取文件信息，不写入计划: {file_path.name} - {e}")
+            return
+        if outcome == OUTCOME_UNPROCESSED:
+            action, bucket, target = PLAN_ACTION_MOVE, UNPROCESSED_DIR_NAME, None
+        else:
+            # 需要更新的文件的目标时间就是文件名时间，这里只解析文件名，不再读取文件
+            target_datetime = parse_filename_datetime(file_path.name, str(file_path))
+            action, bucket, target = PLAN_ACTION_UPDATE, EXIF_DIR_NAME, target_datetime.isoformat()
+        row = [file_path.relative_to(self.directory).as_posix(), st.st_size, st.st_mtime_ns, target, action, bucket]
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.counts[action] += 1
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+def read_plan(plan_path):
+    """
+    读取计划文件，返回 (文件头, 逐行产出 [相对路径, 大小, mtime_ns, 目标时间, 动作, 目标文件夹] 的迭代器)
+    文件头无法识别时抛出 ValueError
+    """
+    f = open(plan_path, encoding="utf-8")
+    try:
+        header = json.loads(f.readline() or "null")
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("plan") != PLAN_VERSION:
+        f.close()
+        raise ValueError(f"无法识别的计划文件: {plan_path}")
+
+    def rows():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return header, rows()
+
+def apply_plan(plan_path, use_cache=True, trace_path=None, profile_path=None):
+    """
+    按计划文件执行修改和移动，不重新扫描目录或读取元数据
+    每个文件只核对大小和 mtime 是否与生成计划时一致，不一致或已不存在的文件跳过
+    
+    Args:
+        plan_path: process_photos(..., plan_path=...) 生成的计划文件
+        use_cache: 是否把移动到 unprocessed_files 的文件记入增量运行索引
+        trace_path: 调用时间线输出路径，.csv 为 CSV，其他为 Chrome trace 格式 JSON
+        profile_path: 在 cProfile 下运行，并将统计结果写入该路径
+
+    Returns:
+        各结果的文件数 Counter（OUTCOME_* 以及 "changed"、"missing"），计划文件无法读取时返回 None
+    """
+    try:
+        header, rows = read_plan(plan_path)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return None
+    directory = Path(header["directory"])
+    if not directory.exists():
+        print(f"错误: 目录不存在 - {directory}")
+        rows.close()
+        return None
+    
+    targets = {name: directory / name for name in OUTPUT_DIR_NAMES}
+    for d in targets.values():
+        if not d.exists():
+            d.mkdir()
+            print(f"已创建文件夹: {d}")
+    
+    INSTRUMENTATION.reset(trace=trace_path is not None)
+    if (directory / MOVE_JOURNAL_NAME).exists():
+        print(f"发现未完成的移动日志，继续完成上次中断的移动")
+        recover_moves(directory)
+    
+    print(f"按计划执行: {plan_path}（生成于 {header.get('created')}）")
+    print(f"目录: {directory}")
+    print("-" * 50)
+    
+    counts = collections.Counter()
+    cache = RunCache(directory) if use_cache else None
+    mover = MoveBatch(directory, dry_run=False)
+    
+    def finish_moves(results):
+        for file_path, dest_path, outcome, ok in results:
+            if ok:
+                counts[outcome] += 1
+            if cache is None:
+                continue
+            # 分类文件夹不会被遍历，已移动的文件只删除原路径的记录
+            if ok:
+                cache.forget(file_path)
+            else:
+                cache.record(file_path, outcome)
+    
+    profiler = _start_profiler(profile_path)
+    import tqdm
+    pbar = tqdm.tqdm(total=None, desc="Applying", unit="photo")
+    for relative_path, size, mtime_ns, target, action, bucket in rows:
+        file_path = directory / relative_path
+        ext = file_path.suffix.lower()
+        pbar.update(1)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            print(f"文件已不存在，跳过: {relative_path}")
+            counts["missing"] += 1
+            continue
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            print(f"文件在生成计划后已变化，跳过: {relative_path}")
+            counts["changed"] += 1
+            continue
+        if bucket not in targets or action not in (PLAN_ACTION_UPDATE, PLAN_ACTION_MOVE):
+            print(f"计划条目无效，跳过: {relative_path}")
+            counts["invalid"] += 1
+            continue
+        INSTRUMENTATION.count(f"plan:{action}", ext)
+        if action == PLAN_ACTION_UPDATE:
+            with INSTRUMENTATION.timer("update", ext):
+                outcome = apply_update(file_path, datetime.datetime.fromisoformat(target), dry_run=False)
+            target_dir = targets[bucket] if outcome == OUTCOME_EXIF else targets[FILETIME_DIR_NAME]
+        else:
+            outcome = OUTCOME_UNPROCESSED
+            target_dir = targets[bucket]
+        finish_moves(mover.add(file_path, target_dir, outcome))
+    finish_moves(mover.close())
+    pbar.close()
+    if cache is not None:
+        cache.close()
+    
+    print("-" * 50)
+    print(f"计划执行完成!")
+    print(f"成功更新 EXIF 和文件时间: {counts[OUTCOME_EXIF]}")
+    print(f"成功仅更新文件时间: {counts[OUTCOME_FILETIME]}")
+    print(f"已移动到 unprocessed_files: {counts[OUTCOME_UNPROCESSED]}")
+    if counts["changed"] or counts["missing"] or counts["invalid"]:
+        print(f"跳过（生成计划后已变化 {counts['changed']}，已不存在 {counts['missing']}，条目无效 {counts['invalid']}）")
+    _report_instrumentation(trace_path, profiler, profile_path)
+    return counts
+
+def _start_profiler(profile_path):
+    """profile_path 不为空时开始 cProfile，返回 Profile 对象"""
+    if not profile_path:
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def _report_instrumentation(trace_path, profiler, profile_path):
+    """打印阶段耗时汇总，写出调用时间线和 cProfile 结果"""
+    if profiler is not None:
+        profiler.disable()
+    print("-" * 50)
+    print("阶段耗时:")
+    for line in INSTRUMENTATION.summary_lines():
+        print(line)
+    if trace_path:
+        INSTRUMENTATION.write_trace(trace_path)
+        print(f"调用时间线已写入: {trace_path}")
+    if profiler is not None:
+        profiler.dump_stats(profile_path)
+        print(f"cProfile 结果已写入: {profile_path}（仅主进程）")
+        import pstats
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+def _iter_pipeline_outcomes(entries, lookup, pipeline):
+    """iter_outcomes 的流水线模式：索引命中的文件不进入流水线，但按原顺序与流水线结果一起交付"""
+    order = collections.deque()     # (file_path, 缓存结果)，缓存结果为 None 的文件等待流水线结果
+    fresh = collections.deque()     # 流水线按提交顺序交付的 (task, 异常)
+    
+    def deliver():
+        while order:
+            file_path, cached = order[0]
+            if cached is None:
+                if not fresh:
+                    return
+                task, error = fresh.popleft()
+                if error is not None:
+                    raise error
+                order.popleft()
+                yield file_path, task.outcome, False
+            else:
+                order.popleft()
+                yield file_path, cached, True
+    
+    try:
+        for entry in entries:
+            file_path, cached = lookup(entry)
+            order.append((file_path, cached))
+            if cached is None:
+                fresh.extend(pipeline.submit(FileTask(str(file_path))))
+            yield from deliver()
+            # 排在未完成文件之后的索引命中也计入在途数量，避免一个慢文件后面堆积大量结果
+            while len(order) > pipeline.max_in_flight and pipeline.pending:
+                fresh.extend(pipeline.collect(block=True))
+                yield from deliver()
+        while pipeline.pending:
+            fresh.extend(pipeline.collect(block=True))
+            yield from deliver()
+        yield from deliver()
+    except BaseException:
+        pipeline.abort()
+        raise
+    pipeline.close()
+
+def process_photos(directory_path, dry_run=True, workers=1, use_cache=True, full=False,
+                   trace_path=None, profile_path=None, pipeline=False, stages=None,
+                   queue_size=PIPELINE_QUEUE_SIZE, plan_path=None):
     """
     处理指定目录下的所有照片和视频
     按处理结果分类移动文件到子文件夹：
@@ -301,17 +2369,28 @@ def process_photos(directory_path, dry_run=True):
     Args:
         directory_path: 照片和视频目录路径
         dry_run: 是否为试运行模式（不实际修改文件或移动文件）
+        workers: 并行进程数，大于1时解析和更新在进程池中执行，移动和计数仍在主进程中完成
+        use_cache: 是否使用增量运行索引，跳过上次已判断且未变化的文件
+        full: 忽略索引中的已有记录，重新检查所有文件并重建索引
+        trace_path: 调用时间线输出路径，.csv 为 CSV，其他为 Chrome trace 格式 JSON
+        profile_path: 在 cProfile 下运行主进程的处理循环，并将统计结果写入该路径
+        pipeline: 使用多阶段流水线（读取 → 判断 → 写入，各阶段同时进行），此时忽略 workers
+        stages: 流水线各阶段的 {阶段名: (并发数, "thread" 或 "process")}，未指定的阶段使用 PIPELINE_STAGES
+        queue_size: 流水线阶段之间队列的长度
+        plan_path: 试运行时把判断结果写入该计划文件，之后可用 apply_plan 直接执行
     """
     directory = Path(directory_path)
+    if plan_path and not dry_run:
+        raise ValueError("计划文件只能在试运行时生成")
     
     if not directory.exists():
         print(f"错误: 目录不存在 - {directory_path}")
         return
     
     # 创建分类文件夹
-    exif_dir = directory / "exif_and_filetime_updated"
-    filetime_dir = directory / "filetime_only_updated"
-    unprocessed_dir = directory / "unprocessed_files"
+    exif_dir = directory / EXIF_DIR_NAME
+    filetime_dir = directory / FILETIME_DIR_NAME
+    unprocessed_dir = directory / UNPROCESSED_DIR_NAME
     
     if not dry_run:
         for d in [exif_dir, filetime_dir, unprocessed_dir]:
@@ -319,136 +2398,197 @@ def process_photos(directory_path, dry_run=True):
                 d.mkdir()
                 print(f"已创建文件夹: {d}")
     
-    # 支持的图片和视频格式
-    media_extensions = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.mov', '.mp4', '.heic', '.gif'}
-    
     # 统计信息
     total_files = 0
-    exif_updated_files = 0
-    filetime_updated_files = 0
-    unprocessed_files = 0
+    processed_count = 0
     skipped_unchanged = 0
+    moved = collections.Counter()
+    
+    INSTRUMENTATION.reset(trace=trace_path is not None)
+    
+    # 上次运行在移动过程中被中断时，先完成日志中剩余的移动
+    if (directory / MOVE_JOURNAL_NAME).exists():
+        if dry_run:
+            print(f"发现未完成的移动日志 {MOVE_JOURNAL_NAME}，实际修改模式下会先继续完成")
+        else:
+            print(f"发现未完成的移动日志，继续完成上次中断的移动")
+            recover_moves(directory)
     
-    # 收集所有媒体文件
-    media_files = [f for f in directory.rglob("*") if f.is_file() and f.suffix.lower() in media_extensions]
-    total_files = len(media_files)
+    # 在后台流式遍历媒体文件，边遍历边处理；总数在遍历完成后确定
+    walk = BackgroundWalk(directory)
     
     print(f"开始处理目录: {directory_path}")
     print(f"模式: {'试运行' if dry_run else '实际修改'}")
+    stage_pipeline = None
+    if pipeline:
+        stage_pipeline = build_pipeline(dry_run, stages, queue_size, trace=trace_path is not None)
+        stage_pipeline.watch("walk", walk.queue)
+        print("流水线: " + " → ".join(
+            f"{name}×{thread_count}({kind})"
+            for name, (thread_count, kind) in {**PIPELINE_STAGES, **(stages or {})}.items()))
+    elif workers > 1:
+        print(f"并行进程数: {workers}")
+    if use_cache and full:
+        print("完整重新扫描，忽略增量索引")
     print("-" * 50)
     
+    cache = RunCache(directory, full=full) if use_cache else None
+    mover = MoveBatch(directory, dry_run)
+    plan = PlanWriter(plan_path, directory) if plan_path else None
+    targets = {
+        OUTCOME_EXIF: exif_dir,
+        OUTCOME_FILETIME: filetime_dir,
+        OUTCOME_UNPROCESSED: unprocessed_dir,
+    }
+    
+    def finish_moves(results):
+        for file_path, dest_path, (outcome, from_cache), ok in results:
+            if ok:
+                moved[outcome] += 1
+            if cache is None:
+                continue
+            # 分类文件夹不会被遍历，已移动的文件只删除原路径的记录
+            if ok and not dry_run:
+                cache.forget(file_path)
+            elif not from_cache:
+                cache.record(file_path, outcome)
+    
+    profiler = _start_profiler(profile_path)
+    
     # 使用 tqdm 显示进度条
-    pbar = tqdm.tqdm(total=total_files, desc="Processing", unit="photo")
-    for file_path in media_files:
-        file_ext = file_path.suffix.lower()
-        # 从文件名解析时间
-        target_datetime = parse_filename_datetime(file_path.name, str(file_path))
-        
-        if target_datetime:
-            # 获取 EXIF/QuickTime 元数据时间和文件修改时间
-            metadata_datetime = get_metadata_datetime(str(file_path))
-            try:
-                file_mtime = datetime.datetime.fromtimestamp(os.stat(file_path).st_mtime)
-            except Exception as e:
-                print(f"无法获取文件时间: {file_path.name} - {e}")
-                file_mtime = None
-            
-            # 检查时间是否接近（±60秒）
-            metadata_match = (
-                (metadata_datetime and file_ext not in ['.png', '.gif'] and
-                 abs((metadata_datetime - target_datetime).total_seconds()) <= TIME_DELTA_THRESHOLD)
-                or (file_ext in ['.png', '.gif'] and not metadata_datetime)
-            )
-            filetime_match = (
-                file_mtime and
-                abs((file_mtime - target_datetime).total_seconds()) <= TIME_DELTA_THRESHOLD
-            )
-            
-            if metadata_match and filetime_match:
-                print(f"时间接近，跳过: {file_path.name} -> {target_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-                skipped_unchanged += 1
-            elif file_ext in ['.png', '.gif'] and filetime_match:
-                print(f"文件名时间与文件时间接近，跳过: {file_path.name} -> {target_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-                skipped_unchanged += 1
-            else:
-                if dry_run:
-                    print(f"[试运行] {file_path.name} -> {target_datetime.strftime('%Y-%m-%d %H:%M:%S')} (元数据 + 文件时间)")
-                    move_file(file_path, exif_dir, dry_run)
-                    exif_updated_files += 1
-                else:
-                    metadata_updated = update_photo_times(str(file_path), target_datetime)
-                    if metadata_updated:
-                        if move_file(file_path, exif_dir, dry_run):
-                            exif_updated_files += 1
-                    else:
-                        if move_file(file_path, filetime_dir, dry_run):
-                            filetime_updated_files += 1
+    import tqdm
+    pbar = tqdm.tqdm(total=None, desc="Processing", unit="photo")
+    for file_path, outcome, from_cache in iter_outcomes(walk, dry_run, workers, cache, stage_pipeline):
+        INSTRUMENTATION.count(f"outcome:{outcome}", file_path.suffix.lower())
+        if outcome == OUTCOME_SKIPPED:
+            skipped_unchanged += 1
+            if cache is not None and not from_cache:
+                cache.record(file_path, outcome)
         else:
-            # 文件名无法解析，检查 EXIF/QuickTime 时间和文件修改时间
-            metadata_datetime = get_metadata_datetime(str(file_path))
-            try:
-                file_mtime = datetime.datetime.fromtimestamp(os.stat(file_path).st_mtime)
-            except Exception as e:
-                print(f"无法获取文件时间: {file_path.name} - {e}")
-                file_mtime = None
-            
-            if metadata_datetime and file_mtime and (
-                abs((metadata_datetime - file_mtime).total_seconds()) <= TIME_DELTA_THRESHOLD
-            ):
-                print(f"文件名无法解析但元数据与文件时间接近，跳过: {file_path.name} -> {metadata_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-                skipped_unchanged += 1
-            else:
-                print(f"文件名和元数据均无法解析或时间不一致: {file_path.name}")
-                if move_file(file_path, unprocessed_dir, dry_run):
-                    unprocessed_files += 1
+            if plan is not None:
+                plan.add(file_path, outcome)
+            # 移动分批执行，计数和索引记录在每批完成后更新
+            finish_moves(mover.add(file_path, targets[outcome], (outcome, from_cache)))
         
-        # 更新进度条描述
-        processed_count = exif_updated_files + filetime_updated_files + unprocessed_files + skipped_unchanged
-        remaining = total_files - processed_count
-        percentage = processed_count / total_files * 100 if total_files > 0 else 0
-        pbar.set_description(f"Processing: {processed_count}/{total_files} photos ({remaining} remaining, {percentage:.2f}%)")
+        # 更新进度条描述（遍历完成前总数未知）
+        processed_count += 1
+        if walk.total is None:
+            pbar.set_description(f"Processing: {processed_count}/? photos (scanning)")
+        else:
+            total_files = walk.total
+            if pbar.total is None:
+                pbar.total = total_files
+            remaining = total_files - processed_count
+            percentage = processed_count / total_files * 100 if total_files > 0 else 0
+            pbar.set_description(f"Processing: {processed_count}/{total_files} photos ({remaining} remaining, {percentage:.2f}%)")
+        if stage_pipeline is not None and processed_count % 64 == 0:
+            # 各阶段输入队列的当前长度
+            pbar.set_postfix_str(" ".join(f"{name}={depth}" for name, depth in stage_pipeline.depths().items()), refresh=False)
         pbar.update(1)
     
+    finish_moves(mover.close())
     pbar.close()
+    if profiler is not None:
+        profiler.disable()
+    if plan is not None:
+        plan.close()
+    total_files = walk.total
+    if cache is not None:
+        cache.close()
+    exif_updated_files = moved[OUTCOME_EXIF]
+    filetime_updated_files = moved[OUTCOME_FILETIME]
+    unprocessed_files = moved[OUTCOME_UNPROCESSED]
     
     # 输出统计信息
     print("-" * 50)
     print(f"处理完成!")
     print(f"总文件数: {total_files}")
+    if cache is not None:
+        print(f"增量索引命中（未重新读取）: {cache.hits}")
     print(f"未处理（时间一致或接近）: {skipped_unchanged}")
     print(f"{'预计' if dry_run else '成功'}更新 EXIF 和文件时间: {exif_updated_files}")
     print(f"{'预计' if dry_run else '成功'}仅更新文件时间: {filetime_updated_files}")
     print(f"{'预计' if dry_run else '已'}移动到 unprocessed_files: {unprocessed_files}")
     
+    if plan is not None:
+        print(f"计划已写入: {plan_path}（更新 {plan.counts[PLAN_ACTION_UPDATE]}，移动 {plan.counts[PLAN_ACTION_MOVE]}）")
+    if stage_pipeline is not None:
+        print("-" * 50)
+        print(f"流水线队列长度（上限 {stage_pipeline.queues[0].maxsize}，遍历队列上限 {walk.queue.maxsize}）:")
+        for name, (average, longest) in stage_pipeline.depth_summary().items():
+            print(f"  {name:<10}平均 {average:>8.1f}  最大 {longest:>6}")
+    _report_instrumentation(trace_path, profiler, profile_path)
+    
     if dry_run:
         print("\n这是试运行模式，没有实际修改或移动文件。")
-        print("如果结果看起来正确，请将 dry_run=False 来实际执行修改和移动。")
+        if plan is not None:
+            print("如果结果看起来正确，请用 apply_plan（命令行 --apply）按计划执行修改和移动。")
+        else:
+            print("如果结果看起来正确，请将 dry_run=False 来实际执行修改和移动。")
+
+def parse_stage_option(text):
+    """解析 --stage 参数 阶段名=并发数[:thread|process]，返回 (阶段名, (并发数, 执行方式))"""
+    name, _, value = text.partition("=")
+    count, _, kind = value.partition(":")
+    kind = kind or PIPELINE_STAGES.get(name, (0, "thread"))[1]
+    try:
+        count = int(count)
+    except ValueError:
+        count = 0
+    if name not in PIPELINE_STAGES or count < 1 or kind not in PIPELINE_STAGE_KINDS:
+        raise argparse.ArgumentTypeError(
+            f"格式应为 阶段名=并发数[:thread|process]，阶段名为 {'/'.join(PIPELINE_STAGES)}: {text}")
+    return name, (count, kind)
 
 def main():
     """
     主函数 - 使用示例
     """
-    # 修改这里的路径为你的照片和视频目录
+    # 修改这里的路径为你的照片和视频目录（也可以通过命令行参数传入）
     photo_directory = "/path/to/your/photos"
     
-    # 首先试运行，检查结果
+    parser = argparse.ArgumentParser(description="根据文件名修正照片和视频的时间")
+    parser.add_argument("directory", nargs="?", default=photo_directory, help="照片和视频目录")
+    parser.add_argument("--workers", type=int, default=1, help="并行进程数（默认 1 为串行处理）")
+    parser.add_argument("--full", action="store_true", help="忽略增量索引，重新检查所有文件")
+    parser.add_argument("--no-cache", action="store_true", help="不使用增量索引")
+    parser.add_argument("--trace", help="实际修改模式的调用时间线输出路径（.csv 或 Chrome trace .json）")
+    parser.add_argument("--profile", help="在 cProfile 下运行实际修改模式并写入统计结果")
+    parser.add_argument("--rollback-moves", action="store_true", help="把上次中断的运行中已完成的移动还原后退出")
+    parser.add_argument("--pipeline", action="store_true", help="使用多阶段流水线（读取、判断、写入同时进行），忽略 --workers")
+    parser.add_argument("--stage", action="append", type=parse_stage_option, default=[],
+                        help="流水线阶段的并发数和执行方式，如 read=16 或 classify=4:process（可重复）")
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE, help="流水线阶段之间队列的长度")
+    parser.add_argument("--plan", help="只试运行，把判断结果写入该计划文件后退出")
+    parser.add_argument("--apply", help="按计划文件执行修改和移动后退出（只核对文件大小和 mtime，不重新扫描）")
+    args = parser.parse_args()
+    
+    if args.rollback_moves:
+        count = recover_moves(args.directory, rollback=True)
+        print(f"已还原 {count} 个文件")
+        return
+    if args.apply:
+        apply_plan(args.apply, use_cache=not args.no_cache, trace_path=args.trace, profile_path=args.profile)
+        return
+    options = dict(workers=args.workers, use_cache=not args.no_cache,
+                   pipeline=args.pipeline or bool(args.stage), stages=dict(args.stage), queue_size=args.queue_size)
+    
+    # 首先试运行，检查结果；判断结果写入计划文件，实际修改时直接按计划执行，不再扫描一遍
+    plan_path = args.plan or os.path.join(args.directory, PLAN_FILE_NAME)
     print("=== 试运行模式 ===")
-    process_photos(photo_directory, dry_run=True)
+    process_photos(args.directory, dry_run=True, full=args.full, plan_path=plan_path, **options)
+    if args.plan or not os.path.exists(plan_path):
+        return
     
     # 确认无误后，取消下面的注释来实际执行
     print("\n=== 实际修改模式 ===")
-    process_photos(photo_directory, dry_run=False)
+    if apply_plan(plan_path, use_cache=not args.no_cache, trace_path=args.trace, profile_path=args.profile) is not None:
+        os.unlink(plan_path)
 
 if __name__ == "__main__":
-    # 检查依赖库
-    try:
-        import piexif
-        from PIL import Image
-        import subprocess
-        import pillow_heif
-        import shutil
-        import tqdm
-    except ImportError as e:
+    # 检查依赖库（只查找不导入，真正用到时才导入）
+    import importlib.util
+    if any(importlib.util.find_spec(name) is None for name in ("piexif", "PIL", "pillow_heif", "tqdm")):
         print("错误: 缺少必要的库")
         print("请先安装依赖:")
         print("pip install pillow piexif pillow-heif tqdm")
@@ -0,0 +1,917 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fix_photo_time 的单元测试（只使用标准库 unittest）
+
+用法:
+    python3 -m unittest test_fix_photo_time
+    python3 -m pytest test_fix_photo_time.py
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import random
+import struct
+import datetime
+import collections
+import importlib.util
+import tempfile
+import textwrap
+import threading
+import unittest
+import concurrent.futures
+import contextlib
+from pathlib import Path
+from unittest import mock
+
+import fix_photo_time
+
+
+def quiet(func, *args, **kwargs):
+    """执行 func 并丢弃其打印输出"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+# 模拟 exiftool 的 -stay_open 协议，用 -fake_* 参数控制输出，退出常驻模式时写入 FAKE_EXIFTOOL_LOG
+FAKE_EXIFTOOL = textwrap.dedent('''\
+    import os, sys
+    args = []
+    lines = iter(sys.stdin.readline, "")
+    for line in lines:
+        line = line.rstrip("\\n")
+        if line == "-stay_open" and next(lines, "").strip() == "False":
+            with open(os.environ["FAKE_EXIFTOOL_LOG"], "a") as log:
+                log.write("closed\\n")
+            break
+        if not line.startswith("-execute"):
+            args.append(line)
+            continue
+        options = dict(arg.split("=", 1) for arg in args if arg.startswith("-fake_"))
+        echo3 = args[args.index("-echo3") + 1]
+        echo4 = args[args.index("-echo4") + 1]
+        sys.stderr.write("Warning: minor problem\\n" * int(options.get("-fake_warnings", 0)))
+        sys.stdout.write(options.get("-fake_stdout", "    1 image files updated").replace("|", "\\n") + "\\n")
+        status = "" if "-fake_no_status" in options else options.get("-fake_status", "0")
+        sys.stdout.write(echo3.replace("${status}", status) + "\\n{ready%s}\\n" % line[len("-execute"):])
+        sys.stderr.write(echo4 + "\\n")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        args = []
+''')
+
+
+def write_fake_exiftool(directory):
+    """在 directory 中写入可执行的模拟 exiftool，返回其路径"""
+    path = Path(directory) / "exiftool"
+    path.write_text(f"#!{sys.executable}\n" + FAKE_EXIFTOOL, encoding="utf-8")
+    path.chmod(0o755)
+    return path
+
+
+class FilenamePatternTest(unittest.TestCase):
+    """合并后的文件名格式正则与按顺序逐个 re.search 的结果相同"""
+
+    # (文件名, 期望的格式ID, 期望的时间)
+    CASES = [
+        ("2015-03-25 115355.jpg", "date_space_time", datetime.datetime(2015, 3, 25, 11, 53, 55)),
+        ("20200214_150140525_iOS.jpg", "date_underscore_time", datetime.datetime(2020, 2, 14, 15, 1, 40)),
+        # IMG_ 前缀的名称同时符合格式2，按顺序由格式2匹配
+        ("IMG_20160408_201545.jpg", "date_underscore_time", datetime.datetime(2016, 4, 8, 20, 15, 45)),
+        ("Screenshot_2015-11-21-22-50-58.png", "screenshot_dashed", datetime.datetime(2015, 11, 21, 22, 50, 58)),
+        ("Screenshot_20160321-222949.png", "screenshot_compact", datetime.datetime(2016, 3, 21, 22, 29, 49)),
+        ("19-05-16-8e40504419249f1087c216e30242a984__c0_30_960_960__w960_h1280.jpg", "short_date",
+         datetime.datetime(2019, 5, 16)),
+        ("19-05-16_a.jpg", "short_date", datetime.datetime(2019, 5, 16)),
+        ("QQ图片20150815155353.jpg", "qq_image", datetime.datetime(2015, 8, 15, 15, 53, 53)),
+        ("IMG20150812205222.jpg", "img_compact", datetime.datetime(2015, 8, 12, 20, 52, 22)),
+        ("VID_2015-03-25 115355_20200214_150140.mp4", "date_space_time", datetime.datetime(2015, 3, 25, 11, 53, 55)),
+        ("x\n2015-03-25 115355.jpg", "date_space_time", datetime.datetime(2015, 3, 25, 11, 53, 55)),
+        # 匹配但日期无效：返回 None
+        ("20201345_101010.jpg", "date_underscore_time", None),
+        ("IMG20150230205222.jpg", "img_compact", None),
+    ]
+    NON_MATCHING = [
+        "", "photo.jpg", "IMG_2016.jpg", "2015-03-25.jpg", "2015-03-25_115355.jpg",
+        "a19-05-16-x.jpg", "Screenshot_2015-11-21.png", "QQ图片2015081515.jpg", "IMG2015081220522.jpg",
+    ]
+
+    @staticmethod
+    def reference_match(filename):
+        """改为合并正则之前的做法：按顺序逐个 re.search"""
+        for pattern_id, (_, regex) in sorted(fix_photo_time.FILENAME_PATTERNS.items(), key=lambda item: item[1][0]):
+            match = re.search(regex, filename)
+            if match:
+                return pattern_id, {name: value for name, value in match.groupdict().items() if value is not None}
+        return None
+
+    def test_every_registered_pattern_is_covered(self):
+        # 格式3（IMG_）的名称总是先由格式2匹配，因此只检查每个格式都至少匹配一个用例
+        for pattern_id, (_, regex) in fix_photo_time.FILENAME_PATTERNS.items():
+            with self.subTest(pattern_id):
+                self.assertTrue(any(re.search(regex, filename) for filename, _, _ in self.CASES))
+
+    def test_matches_reference(self):
+        for filename, pattern_id, expected in self.CASES:
+            with self.subTest(filename):
+                matched = fix_photo_time.match_filename_pattern(filename)
+                self.assertEqual(matched, self.reference_match(filename))
+                self.assertEqual(matched[0], pattern_id)
+                self.assertEqual(quiet(fix_photo_time.parse_filename_datetime, filename, filename), expected)
+
+    def test_non_matching_names(self):
+        for filename in self.NON_MATCHING:
+            with self.subTest(filename):
+                self.assertIsNone(self.reference_match(filename))
+                self.assertIsNone(fix_photo_time.match_filename_pattern(filename))
+                self.assertIsNone(fix_photo_time.parse_filename_datetime(filename, filename))
+
+    def test_registered_pattern_takes_part_by_order(self):
+        saved = dict(fix_photo_time.FILENAME_PATTERNS)
+        self.addCleanup(fix_photo_time._compile_filename_patterns)
+        self.addCleanup(fix_photo_time.FILENAME_PATTERNS.update, saved)
+        self.addCleanup(fix_photo_time.FILENAME_PATTERNS.clear)
+        fix_photo_time.register_filename_pattern(
+            "pixel", r'PXL_(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})_(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})', order=15)
+        filename = "PXL_20230501_120000123.jpg"
+        self.assertEqual(fix_photo_time.match_filename_pattern(filename)[0], "pixel")
+        self.assertEqual(fix_photo_time.match_filename_pattern(filename), self.reference_match(filename))
+        self.assertEqual(fix_photo_time.parse_filename_datetime(filename, filename), datetime.datetime(2023, 5, 1, 12, 0, 0))
+
+
+class RecoverMovesTest(unittest.TestCase):
+    """recover_moves 按手写的移动日志继续完成或回滚"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.target = self.root / fix_photo_time.EXIF_DIR_NAME
+        self.target.mkdir()
+        self.journal = self.root / fix_photo_time.MOVE_JOURNAL_NAME
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_journal(self, plans, done=()):
+        with open(self.journal, "w", encoding="utf-8") as f:
+            for src, dst, mode in plans:
+                f.write(json.dumps({"op": "plan", "mode": mode, "src": str(src), "dst": str(dst)}) + "\n")
+            for dst in done:
+                f.write(json.dumps({"op": "done", "dst": str(dst)}) + "\n")
+
+    def make(self, path, content):
+        Path(path).write_bytes(content)
+        return Path(path)
+
+    def test_resume_rename_moves_remaining_file(self):
+        src = self.make(self.root / "a.jpg", b"a")
+        dst = self.target / "a.jpg"
+        self.write_journal([(src, dst, "rename")])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root), 1)
+        self.assertFalse(src.exists())
+        self.assertEqual(dst.read_bytes(), b"a")
+        self.assertFalse(self.journal.exists())
+
+    def test_resume_copy_removes_source_after_finished_copy(self):
+        src = self.make(self.root / "b.jpg", b"b")
+        dst = self.make(self.target / "b.jpg", b"b")
+        self.write_journal([(src, dst, "copy")])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root), 1)
+        self.assertFalse(src.exists())
+        self.assertEqual(dst.read_bytes(), b"b")
+        self.assertFalse(self.journal.exists())
+
+    def test_resume_skips_done_entries(self):
+        src = self.make(self.root / "c.jpg", b"new")
+        dst = self.make(self.target / "c.jpg", b"c")
+        self.write_journal([(src, dst, "rename")], done=[dst])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root), 0)
+        self.assertEqual(src.read_bytes(), b"new")
+        self.assertEqual(dst.read_bytes(), b"c")
+        self.assertFalse(self.journal.exists())
+
+    def test_resume_rename_conflict_keeps_both_and_journal(self):
+        src = self.make(self.root / "d.jpg", b"new")
+        dst = self.make(self.target / "d.jpg", b"d")
+        self.write_journal([(src, dst, "rename")])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root), 0)
+        self.assertEqual(src.read_bytes(), b"new")
+        self.assertEqual(dst.read_bytes(), b"d")
+        self.assertTrue(self.journal.exists())
+
+    def test_rollback_rename_moves_file_back(self):
+        src = self.root / "e.jpg"
+        dst = self.make(self.target / "e.jpg", b"e")
+        self.write_journal([(src, dst, "rename")], done=[dst])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root, rollback=True), 1)
+        self.assertEqual(src.read_bytes(), b"e")
+        self.assertFalse(dst.exists())
+        self.assertFalse(self.journal.exists())
+
+    def test_rollback_copy_removes_unfinished_copy(self):
+        src = self.make(self.root / "f.jpg", b"f")
+        dst = self.make(self.target / "f.jpg", b"f")
+        self.write_journal([(src, dst, "copy")])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root, rollback=True), 1)
+        self.assertEqual(src.read_bytes(), b"f")
+        self.assertFalse(dst.exists())
+        self.assertFalse(self.journal.exists())
+
+    def test_rollback_rename_conflict_keeps_both_and_journal(self):
+        src = self.make(self.root / "g.jpg", b"new")
+        dst = self.make(self.target / "g.jpg", b"g")
+        self.write_journal([(src, dst, "rename")], done=[dst])
+        self.assertEqual(quiet(fix_photo_time.recover_moves, self.root, rollback=True), 0)
+        self.assertEqual(src.read_bytes(), b"new")
+        self.assertEqual(dst.read_bytes(), b"g")
+        self.assertTrue(self.journal.exists())
+
+
+class FileRecordStoreTest(unittest.TestCase):
+    """FileRecordStore 的追加、读取、写入映射文件和重新判断"""
+
+    BASE = datetime.datetime(2023, 5, 1, 12, 0, 0)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.path = self.root / "records.bin"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def rows(self):
+        """(路径, 大小, mtime_ns, 文件名时间, 元数据时间, 文件修改时间)，覆盖 decide_outcome 的各个分支"""
+        base, second = self.BASE, datetime.timedelta(seconds=1)
+        return [
+            ("/photos/IMG_20230501_120000.jpg", 100, 1, base, base + second, base + 2 * second),
+            ("/photos/IMG_20230501_120000.JPG", 101, 2, base, base + 3 * second, base),
+            ("/photos/VID_20230501_120000.mov", 102, 3, base, None, base),
+            ("/photos/2023/截图_20230501.png", 103, 4, base, None, base - second),
+            ("/photos/2023/anim.gif", 104, 5, base, base, base + datetime.timedelta(microseconds=2000001)),
+            ("/photos/2023/scan.heic", 105, 6, None, base, base + second),
+            ("/photos/2023/scan2.heic", 106, 7, None, base, None),
+            ("/photos/2023/unknown.jpg", 107, 8, None, None, None),
+        ]
+
+    def make_store(self):
+        store = fix_photo_time.FileRecordStore()
+        for row in self.rows():
+            store.append(*row)
+        return store
+
+    def assert_rows(self, store, outcome=None):
+        self.assertEqual(len(store), len(self.rows()))
+        for index, row in enumerate(self.rows()):
+            self.assertEqual(store.get(index), row + (outcome,))
+
+    def test_append_get_round_trip(self):
+        store = self.make_store()
+        self.assert_rows(store)
+        self.assertEqual(store.dirs, ["/photos", "/photos/2023"])
+        store.set_outcome(2, fix_photo_time.OUTCOME_EXIF)
+        self.assertEqual(store.get(2)[-1], fix_photo_time.OUTCOME_EXIF)
+        self.assertEqual(store.outcome_counts(), {None: 7, fix_photo_time.OUTCOME_EXIF: 1})
+
+    def test_nbytes_counts_encoded_directory_names(self):
+        store = fix_photo_time.FileRecordStore()
+        store.append("/照片/a.jpg", 1, 1)
+        columns = sum(column.itemsize for column in store.columns.values())
+        self.assertEqual(store.nbytes(), len("a.jpg") + len("/照片".encode("utf-8")) + columns)
+
+    def test_spill_and_open(self):
+        store = self.make_store()
+        store.spill(self.path)
+        self.assertIsNotNone(store.mapped)
+        self.assert_rows(store)
+        store.set_outcome(0, fix_photo_time.OUTCOME_SKIPPED)
+        with self.assertRaises(ValueError):
+            store.append("/photos/late.jpg", 1, 1)
+        store.close()
+        self.assertFalse(Path(str(self.path) + ".tmp").exists())
+
+        opened = fix_photo_time.FileRecordStore.open(self.path)
+        self.addCleanup(opened.close)
+        self.assertEqual(opened.get(0)[-1], fix_photo_time.OUTCOME_SKIPPED)
+        for index, row in enumerate(self.rows()[1:], start=1):
+            self.assertEqual(opened.get(index), row + (None,))
+
+    def test_spill_mapped_store_again(self):
+        store = self.make_store()
+        store.spill(self.path)
+        copy_path = self.root / "copy.bin"
+        store.spill(copy_path)
+        self.addCleanup(store.close)
+        self.assertFalse(Path(str(copy_path) + ".tmp").exists())
+        self.assert_rows(store)
+        self.assertEqual(self.path.read_bytes(), copy_path.read_bytes())
+
+    def test_read_only_store_rejects_writes(self):
+        self.make_store().spill(self.path)
+        store = fix_photo_time.FileRecordStore.open(self.path)
+        self.addCleanup(store.close)
+        with self.assertRaisesRegex(ValueError, "只读"):
+            store.set_outcome(0, fix_photo_time.OUTCOME_EXIF)
+        with self.assertRaisesRegex(ValueError, "只读"):
+            store.reclassify()
+        self.assert_rows(store)
+
+    def test_open_rejects_malformed_files(self):
+        magic = fix_photo_time.RECORD_STORE_MAGIC
+        self.make_store().spill(self.path)
+        valid = self.path.read_bytes()
+        header_size = int.from_bytes(valid[len(magic):len(magic) + 8], "little")
+        header = json.loads(valid[len(magic) + 8:len(magic) + 8 + header_size])
+        header["columns"]["size"][1] = 4
+
+        def with_header(data):
+            data = json.dumps(data).encode("utf-8") if not isinstance(data, bytes) else data
+            return magic + len(data).to_bytes(8, "little") + data + b"\0" * 64
+
+        cases = {
+            "magic": b"NOTRECS1" + valid[len(magic):],
+            "json": with_header(b"{not json"),
+            "keys": with_header({"count": 0, "dirs": []}),
+            "itemsize": with_header(header),
+        }
+        for name, data in cases.items():
+            with self.subTest(name):
+                self.path.write_bytes(data)
+                with self.assertRaises(ValueError):
+                    fix_photo_time.FileRecordStore.open(self.path)
+
+    def expected_outcomes(self, threshold):
+        with mock.patch.object(fix_photo_time, "TIME_DELTA_THRESHOLD", threshold):
+            return [quiet(fix_photo_time.decide_outcome, row[0], *row[3:])[0] for row in self.rows()]
+
+    @unittest.skipIf(importlib.util.find_spec("numpy") is None, "numpy 未安装")
+    def test_reclassify_matches_decide_outcome(self):
+        expected = self.expected_outcomes(fix_photo_time.TIME_DELTA_THRESHOLD)
+        self.assertEqual(len(set(expected)), 3)
+        store = self.make_store()
+        counts = store.reclassify()
+        self.assertEqual([store.get(index)[-1] for index in range(len(store))], expected)
+        self.assertEqual(counts, dict(collections.Counter(expected)))
+
+        # 映射后按新阈值重新判断，结果写回文件
+        store.spill(self.path)
+        store.close()
+        expected = self.expected_outcomes(3600)
+        self.assertNotEqual(expected, self.expected_outcomes(fix_photo_time.TIME_DELTA_THRESHOLD))
+        with contextlib.closing(fix_photo_time.FileRecordStore.open(self.path, writable=True)) as opened:
+            opened.reclassify(threshold=3600)
+        with contextlib.closing(fix_photo_time.FileRecordStore.open(self.path)) as opened:
+            self.assertEqual([opened.get(index)[-1] for index in range(len(opened))], expected)
+
+
+@unittest.skipIf(os.name == "nt", "模拟 exiftool 需要 #! 脚本")
+class ExifToolSessionTest(unittest.TestCase):
+    """常驻 exiftool 的输出读取、退出码和进程池 worker 退出时的关闭"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.executable = write_fake_exiftool(self.tmp.name)
+        self.log = Path(self.tmp.name) / "exiftool.log"
+        mock.patch.dict(os.environ, {"FAKE_EXIFTOOL_LOG": str(self.log)}).start()
+        self.addCleanup(mock.patch.stopall)
+        self.session = fix_photo_time.ExifToolSession(str(self.executable))
+        self.session.start()
+        self.addCleanup(self.session.close)
+
+    def execute(self, *args):
+        """在线程中执行，卡住时测试失败而不是一直等待"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.session.execute(list(args) + ["a.mov"])), daemon=True)
+        thread.start()
+        thread.join(10)
+        if thread.is_alive():
+            self.session._kill()
+            self.fail("exiftool 常驻进程通信卡住")
+        return result[0]
+
+    def test_large_stderr_does_not_block(self):
+        status, stdout, stderr = self.execute("-fake_warnings=20000")
+        self.assertEqual(status, 0)
+        self.assertEqual(stdout, "    1 image files updated\n")
+        self.assertEqual(stderr.count("Warning"), 20000)
+        # 下一条命令的输出不会混入上一条的内容
+        self.assertEqual(self.execute("-fake_warnings=1")[2], "Warning: minor problem\n")
+
+    def test_status_comes_from_exiftool(self):
+        self.assertEqual(self.execute("-fake_status=1", "-fake_stdout=    0 image files updated")[0], 1)
+        self.assertEqual(self.execute("-fake_stdout=Error_report.mov|    1 image files updated")[0], 0)
+
+    def test_summary_when_status_unavailable(self):
+        failed = "-fake_stdout=    0 image files updated|    1 files weren't updated due to errors"
+        self.assertEqual(self.execute("-fake_no_status=1", failed)[0], 1)
+        self.assertEqual(self.execute("-fake_no_status=1", "-fake_stdout=Errors.mov|    1 image files updated")[0], 0)
+
+    def test_close_ends_stay_open(self):
+        self.session.close()
+        self.assertEqual(self.log.read_text(), "closed\n")
+
+    def test_pool_worker_closes_its_session(self):
+        self.session.close()
+        self.log.unlink()
+        with mock.patch.dict(os.environ, {"PATH": self.tmp.name + os.pathsep + os.environ.get("PATH", "")}):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(fix_photo_time.run_exiftool, ["-fake_stdout=ok", "a.mov"]).result()
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, "ok\n")
+        self.assertEqual(self.log.read_text(), "closed\n")
+
+
+HAS_PIEXIF = importlib.util.find_spec("piexif") is not None and importlib.util.find_spec("PIL") is not None
+
+
+@unittest.skipUnless(HAS_PIEXIF, "piexif 或 Pillow 未安装")
+class JpegExifPatchTest(unittest.TestCase):
+    """patch_jpeg_exif_datetime 原地改写时间字符串，字段缺失时 update_jpeg_exif 回退到 piexif.insert"""
+
+    OLD = "2000:01:01 00:00:00"
+    NEW = "2021:06:07 08:09:10"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = Path(self.tmp.name) / "photo.jpg"
+
+    def make_jpeg(self, digitized=True, exif=True):
+        import piexif
+        from PIL import Image
+        image = Image.new("RGB", (16, 8), (200, 100, 50))
+        if not exif:
+            image.save(self.path, "JPEG")
+            return self.path.read_bytes()
+        exif_ifd = {piexif.ExifIFD.DateTimeOriginal: self.OLD}
+        if digitized:
+            exif_ifd[piexif.ExifIFD.DateTimeDigitized] = self.OLD
+        exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.DateTime: self.OLD, piexif.ImageIFD.Make: "Test"},
+                                  "Exif": exif_ifd})
+        image.save(self.path, "JPEG", exif=exif_bytes)
+        return self.path.read_bytes()
+
+    def read_times(self):
+        import piexif
+        exif = piexif.load(str(self.path))
+        return (exif["0th"].get(piexif.ImageIFD.DateTime), exif["Exif"].get(piexif.ExifIFD.DateTimeOriginal),
+                exif["Exif"].get(piexif.ExifIFD.DateTimeDigitized))
+
+    def test_patch_changes_only_datetime_bytes(self):
+        before = self.make_jpeg()
+        span = fix_photo_time.find_jpeg_exif(before)
+        locations = fix_photo_time.locate_exif_datetimes(before, *span)
+        self.assertEqual(len(locations), 3)
+        allowed = {pos for start, length in locations.values() for pos in range(start, start + length)}
+
+        self.assertTrue(fix_photo_time.patch_jpeg_exif_datetime(str(self.path), self.NEW))
+        after = self.path.read_bytes()
+        self.assertEqual(len(after), len(before))
+        changed = {pos for pos in range(len(before)) if before[pos] != after[pos]}
+        self.assertTrue(changed)
+        self.assertLessEqual(changed, allowed)
+        self.assertEqual(self.read_times(), (self.NEW.encode(),) * 3)
+
+    def test_missing_tag_falls_back_to_piexif_insert(self):
+        import piexif
+        before = self.make_jpeg(digitized=False)
+        self.assertFalse(fix_photo_time.patch_jpeg_exif_datetime(str(self.path), self.NEW))
+        self.assertEqual(self.path.read_bytes(), before)
+        with mock.patch.object(piexif, "insert", wraps=piexif.insert) as insert:
+            fix_photo_time.update_jpeg_exif(str(self.path), self.NEW)
+        insert.assert_called_once()
+        self.assertEqual(self.read_times(), (self.NEW.encode(),) * 3)
+
+    def test_no_exif_falls_back_to_piexif_insert(self):
+        import piexif
+        self.make_jpeg(exif=False)
+        self.assertFalse(fix_photo_time.patch_jpeg_exif_datetime(str(self.path), self.NEW))
+        with mock.patch.object(piexif, "insert", wraps=piexif.insert) as insert:
+            fix_photo_time.update_jpeg_exif(str(self.path), self.NEW)
+        insert.assert_called_once()
+        self.assertEqual(self.read_times(), (self.NEW.encode(),) * 3)
+
+    def test_in_place_patch_skips_piexif(self):
+        import piexif
+        self.make_jpeg()
+        with mock.patch.object(piexif, "insert") as insert:
+            fix_photo_time.update_jpeg_exif(str(self.path), self.NEW)
+        insert.assert_not_called()
+        self.assertEqual(self.read_times(), (self.NEW.encode(),) * 3)
+
+
+def box(box_type, payload):
+    """构造 ISOBMFF/QuickTime box"""
+    return struct.pack(">I", 8 + len(payload)) + box_type + payload
+
+
+def tiff_bytes(time_str, endian="<"):
+    """构造只有 IFD0 -> Exif IFD -> DateTimeOriginal 的最小 TIFF 数据"""
+    value = time_str.encode() + b"\x00"
+    exif_ifd_offset = 8 + 2 + 12 + 4
+    string_offset = exif_ifd_offset + 2 + 12 + 4
+    return ((b"II" if endian == "<" else b"MM") + struct.pack(endian + "HI", 42, 8)
+            + struct.pack(endian + "H", 1) + struct.pack(endian + "HHII", 0x8769, 4, 1, exif_ifd_offset)
+            + struct.pack(endian + "I", 0)
+            + struct.pack(endian + "H", 1) + struct.pack(endian + "HHII", 0x9003, 2, len(value), string_offset)
+            + struct.pack(endian + "I", 0) + value)
+
+
+def jpeg_bytes(tiff=None):
+    """SOI + APP0 + 可选的 APP1 Exif 段 + SOS + 少量图像数据 + EOI"""
+    app0 = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    data = b"\xff\xd8" + b"\xff\xe0" + struct.pack(">H", 2 + len(app0)) + app0
+    if tiff is not None:
+        data += b"\xff\xe1" + struct.pack(">H", 2 + 6 + len(tiff)) + b"Exif\x00\x00" + tiff
+    return data + b"\xff\xda\x00\x08" + bytes(6) + bytes(range(32)) + b"\xff\xd9"
+
+
+def heic_bytes(tiff=None):
+    """ftyp + meta(hdlr, iinf, iloc v0) + mdat，Exif 项放在 mdat 中"""
+    ftyp = box(b"ftyp", b"heic" + bytes(4) + b"mif1heic")
+    hdlr = box(b"hdlr", bytes(8) + b"pict" + bytes(13))
+    item_type = b"Exif" if tiff is not None else b"hvc1"
+    infe = box(b"infe", bytes([2, 0, 0, 0]) + struct.pack(">HH", 1, 0) + item_type + b"\x00")
+    iinf = box(b"iinf", bytes(4) + struct.pack(">H", 1) + infe)
+    item = struct.pack(">I", 6) + b"Exif\x00\x00" + tiff if tiff is not None else bytes(16)
+
+    def meta(offset):
+        iloc = box(b"iloc", bytes(4) + bytes([0x44, 0x00]) + struct.pack(">HHHHII", 1, 1, 0, 1, offset, len(item)))
+        return box(b"meta", bytes(4) + hdlr + iinf + iloc)
+
+    offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(offset) + box(b"mdat", item)
+
+
+def quicktime_bytes(creation_date="2019-01-26T15:01:22+0800", mp4_meta=False):
+    """ftyp + mdat + moov(mvhd, meta(hdlr, keys, ilst))，moov 放在 mdat 之后"""
+    def key(name):
+        return struct.pack(">I", 8 + len(name)) + b"mdta" + name
+
+    def item(index, value):
+        return box(struct.pack(">I", index), box(b"data", struct.pack(">I", 1) + bytes(4) + value.encode()))
+
+    names = [b"com.apple.quicktime.make"]
+    values = [item(1, "Apple")]
+    if creation_date is not None:
+        names.append(fix_photo_time.QUICKTIME_CREATIONDATE_KEY)
+        values.append(item(2, creation_date))
+    hdlr = box(b"hdlr", bytes(8) + b"mdta" + bytes(13))
+    keys = box(b"keys", bytes(4) + struct.pack(">I", len(names)) + b"".join(key(name) for name in names))
+    ilst = box(b"ilst", b"".join(reversed(values)))
+    meta = box(b"meta", (bytes(4) if mp4_meta else b"") + hdlr + keys + ilst)
+    moov = box(b"moov", box(b"mvhd", bytes(100)) + meta)
+    return box(b"ftyp", b"qt  " + bytes(4) + b"qt  ") + box(b"mdat", bytes(64)) + moov
+
+
+class HeaderReaderTest(unittest.TestCase):
+    """read_header_datetime 解析逐字节构造的 JPEG/HEIC/QuickTime 文件头，损坏的输入回退而不抛出异常"""
+
+    EXPECTED = datetime.datetime(2021, 6, 7, 8, 9, 10)
+    EXIF_TIME = "2021:06:07 08:09:10"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, data):
+        path = Path(self.tmp.name) / name
+        path.write_bytes(data)
+        return str(path)
+
+    def read(self, name, data):
+        return fix_photo_time.read_header_datetime(self.write(name, data))
+
+    def samples(self):
+        return [
+            ("photo.jpg", jpeg_bytes(tiff_bytes(self.EXIF_TIME))),
+            ("photo.jpeg", jpeg_bytes(tiff_bytes(self.EXIF_TIME, ">"))),
+            ("photo.heic", heic_bytes(tiff_bytes(self.EXIF_TIME))),
+            ("clip.mov", quicktime_bytes()),
+            ("clip.mp4", quicktime_bytes(mp4_meta=True)),
+        ]
+
+    def test_jpeg(self):
+        self.assertEqual(self.read("a.jpg", jpeg_bytes(tiff_bytes(self.EXIF_TIME))), self.EXPECTED)
+        self.assertEqual(self.read("b.JPEG", jpeg_bytes(tiff_bytes(self.EXIF_TIME, ">"))), self.EXPECTED)
+        self.assertIsNone(self.read("c.jpg", jpeg_bytes()))
+        self.assertIsNone(self.read("d.jpg", jpeg_bytes(tiff_bytes("0000:00:00 00:00:00"))))
+        self.assertIsNone(self.read("e.jpg", b""))
+        with self.assertRaises(fix_photo_time.HeaderFormatError):
+            self.read("f.jpg", b"GIF89a")
+
+    def test_heic_iinf_iloc(self):
+        self.assertEqual(self.read("a.heic", heic_bytes(tiff_bytes(self.EXIF_TIME))), self.EXPECTED)
+        self.assertEqual(self.read("b.heic", heic_bytes(tiff_bytes(self.EXIF_TIME, ">"))), self.EXPECTED)
+        self.assertIsNone(self.read("c.heic", heic_bytes()))
+        with self.assertRaises(fix_photo_time.HeaderFormatError):
+            self.read("d.heic", box(b"ftyp", b"heic" + bytes(4)))
+
+    def test_quicktime_keys(self):
+        expected = datetime.datetime(2019, 1, 26, 15, 1, 22)
+        self.assertEqual(self.read("a.mov", quicktime_bytes()), expected)
+        self.assertEqual(self.read("b.mp4", quicktime_bytes(mp4_meta=True)), expected)
+        self.assertIsNone(self.read("c.mov", quicktime_bytes(creation_date=None)))
+        self.assertIsNone(self.read("d.mov", quicktime_bytes(creation_date="not a date")))
+        with self.assertRaises(fix_photo_time.HeaderFormatError):
+            self.read("e.mov", box(b"ftyp", b"qt  ") + box(b"mdat", bytes(16)))
+
+    def test_truncated_and_garbage_input_falls_back(self):
+        rng = random.Random(0)
+        inputs = []
+        for name, data in self.samples():
+            inputs += [(name, data[:size]) for size in range(len(data))]
+            for _ in range(200):
+                mutated = bytearray(data)
+                for _ in range(rng.randint(1, 4)):
+                    mutated[rng.randrange(len(data))] = rng.randrange(256)
+                inputs.append((name, bytes(mutated)))
+            inputs.append((name, bytes(rng.randrange(256) for _ in range(len(data)))))
+            inputs.append((name, data[:8] + b"\xff" * 64))
+
+        fallback = object()
+        with mock.patch.object(fix_photo_time, "get_metadata_datetime_fallback", return_value=fallback) as patched:
+            for name, data in inputs:
+                path = self.write(name, data)
+                with self.subTest(name=name, size=len(data)):
+                    result = fix_photo_time.get_metadata_datetime(path)
+                    self.assertTrue(result is None or result is fallback or isinstance(result, datetime.datetime))
+                    if result is fallback:
+                        patched.assert_called_with(path)
+        self.assertTrue(patched.called)
+
+
+class RunCacheTest(unittest.TestCase):
+    """RunCache 按大小/mtime/inode 命中，判断规则变化时整体失效，已移动的文件不按目标路径记录"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        self.path = self.root / "sub" / "scan.png"
+        self.path.parent.mkdir()
+        self.path.write_bytes(b"png")
+
+    def reopen(self, cache=None, **kwargs):
+        if cache is not None:
+            cache.close()
+        return quiet(fix_photo_time.RunCache, self.root, **kwargs)
+
+    def test_hit_and_miss_on_size_and_mtime(self):
+        cache = self.reopen()
+        cache.record(self.path, fix_photo_time.OUTCOME_UNPROCESSED)
+        cache.record(self.root / "missing.png", fix_photo_time.OUTCOME_UNPROCESSED)
+        cache = self.reopen(cache)
+        self.assertEqual(set(cache.entries), {"sub/scan.png"})
+        self.assertEqual(cache.lookup(self.path), fix_photo_time.OUTCOME_UNPROCESSED)
+        self.assertEqual(cache.lookup(self.path, os.stat(self.path)), fix_photo_time.OUTCOME_UNPROCESSED)
+        self.assertEqual(cache.hits, 2)
+
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertIsNone(cache.lookup(self.path))
+        cache.record(self.path, fix_photo_time.OUTCOME_UNPROCESSED)
+        self.assertEqual(cache.lookup(self.path), fix_photo_time.OUTCOME_UNPROCESSED)
+
+        st = os.stat(self.path)
+        self.path.write_bytes(b"png!")
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertIsNone(cache.lookup(self.path))
+        self.assertEqual(cache.hits, 3)
+        cache.close()
+
+    def test_only_cacheable_outcomes_are_recorded(self):
+        cache = self.reopen()
+        cache.record(self.path, fix_photo_time.OUTCOME_EXIF)
+        self.assertIsNone(cache.lookup(self.path))
+        cache.record(self.path, fix_photo_time.OUTCOME_SKIPPED)
+        cache = self.reopen(cache)
+        self.assertEqual(cache.lookup(self.path), fix_photo_time.OUTCOME_SKIPPED)
+        cache.close()
+
+    def test_full_rescan_ignores_and_prunes_entries(self):
+        other = self.root / "other.png"
+        other.write_bytes(b"png")
+        cache = self.reopen()
+        cache.record(self.path, fix_photo_time.OUTCOME_SKIPPED)
+        cache.record(other, fix_photo_time.OUTCOME_SKIPPED)
+        cache = self.reopen(cache, full=True)
+        self.assertIsNone(cache.lookup(self.path))
+        cache.record(self.path, fix_photo_time.OUTCOME_SKIPPED)
+        # 本次没有再检查的记录在 close 时删除
+        cache = self.reopen(cache)
+        self.assertEqual(set(cache.entries), {"sub/scan.png"})
+        cache.close()
+
+    def test_fingerprint_change_invalidates(self):
+        cache = self.reopen()
+        cache.record(self.path, fix_photo_time.OUTCOME_UNPROCESSED)
+        cache = self.reopen(cache)
+        self.assertEqual(cache.lookup(self.path), fix_photo_time.OUTCOME_UNPROCESSED)
+        cache.close()
+
+        with mock.patch.object(fix_photo_time, "TIME_DELTA_THRESHOLD", fix_photo_time.TIME_DELTA_THRESHOLD + 1):
+            cache = self.reopen()
+            self.assertIsNone(cache.lookup(self.path))
+            cache.record(self.path, fix_photo_time.OUTCOME_UNPROCESSED)
+            cache.close()
+        with mock.patch.dict(fix_photo_time.FILENAME_PATTERNS, {"extra": r"^extra_(\d{8})"}):
+            cache = self.reopen()
+            self.assertEqual(cache.entries, {})
+            cache.close()
+        # 规则恢复后指纹也随之变化，之前的记录不会复活
+        cache = self.reopen()
+        self.assertEqual(cache.entries, {})
+        cache.close()
+
+    def test_moved_files_are_not_recorded_under_destination(self):
+        target = datetime.datetime(2021, 6, 7, 8, 9, 10)
+        skipped = self.root / "IMG_20210607_080910.png"
+        skipped.write_bytes(b"png")
+        os.utime(skipped, (target.timestamp(), target.timestamp()))
+
+        quiet(fix_photo_time.process_photos, self.root, dry_run=True)
+        cache = self.reopen()
+        self.assertEqual(set(cache.entries), {"sub/scan.png", skipped.name})
+        cache.close()
+
+        quiet(fix_photo_time.process_photos, self.root, dry_run=False)
+        self.assertTrue((self.root / fix_photo_time.UNPROCESSED_DIR_NAME / "scan.png").exists())
+        cache = self.reopen()
+        self.assertEqual(set(cache.entries), {skipped.name})
+        cache.close()
+
+
+def build_media_tree(root, count=40):
+    """
+    构造一个照片目录：文件名时间与 mtime 一致（跳过）、不一致（需要更新）和文件名无法解析（未处理）的
+    PNG 文件交替分布在根目录和两层子目录中
+    """
+    base = datetime.datetime(2021, 6, 7, 8, 0, 0)
+    for i in range(count):
+        folder = Path(root) / ("", "trip", "trip/day2")[i % 3]
+        folder.mkdir(parents=True, exist_ok=True)
+        moment = base + datetime.timedelta(minutes=i)
+        if i % 3 == 2:
+            path = folder / f"scan_{i:03d}.png"
+        else:
+            path = folder / f"IMG_{moment:%Y%m%d_%H%M%S}.png"
+        path.write_bytes(b"png" * (i + 1))
+        mtime = moment if i % 3 == 0 else moment + datetime.timedelta(days=1)
+        os.utime(path, (mtime.timestamp(), mtime.timestamp()))
+
+
+def tree_state(root):
+    """目录中每个文件的 (相对路径, mtime 秒)，不包括索引等隐藏文件"""
+    return sorted((path.relative_to(root).as_posix(), int(path.stat().st_mtime))
+                  for path in Path(root).rglob("*") if path.is_file() and not path.name.startswith("."))
+
+
+class WorkersConsistencyTest(unittest.TestCase):
+    """--workers 2 和 --pipeline 的判断结果、顺序和最终分类与串行一致"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        # 缩小批次，使 40 个文件分成多批并触发背压
+        patcher = mock.patch.multiple(fix_photo_time, POOL_BATCH_SIZE=3, POOL_BATCHES_PER_WORKER=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def outcomes(self, directory, workers, cache=None):
+        return quiet(lambda: [
+            (file_path.relative_to(directory).as_posix(), outcome, from_cache)
+            for file_path, outcome, from_cache in fix_photo_time.iter_outcomes(
+                fix_photo_time.walk_media_files(directory), True, workers, cache)
+        ])
+
+    def test_iter_outcomes_order_matches_serial(self):
+        directory = self.root / "photos"
+        build_media_tree(directory)
+        serial = self.outcomes(directory, 1)
+        self.assertEqual(len(serial), 40)
+        self.assertEqual({outcome for _, outcome, _ in serial},
+                         {fix_photo_time.OUTCOME_SKIPPED, fix_photo_time.OUTCOME_EXIF, fix_photo_time.OUTCOME_UNPROCESSED})
+        self.assertEqual(self.outcomes(directory, 2), serial)
+
+        # 部分文件命中索引时，命中与未命中的结果仍按遍历顺序交错产出
+        cache = quiet(fix_photo_time.RunCache, directory)
+        self.addCleanup(cache.close)
+        for relative_path, outcome, _ in serial[::4]:
+            cache.record(directory / relative_path, outcome)
+        cached = self.outcomes(directory, 2, cache)
+        self.assertEqual([(p, o) for p, o, _ in cached], [(p, o) for p, o, _ in serial])
+        self.assertEqual(sum(hit for _, _, hit in cached), len(cache.entries))
+
+    def test_pipeline_order_matches_serial(self):
+        directory = self.root / "photos"
+        build_media_tree(directory)
+        serial = self.outcomes(directory, 1)
+        for stages in (None, {"read": (2, "thread"), "classify": (2, "process"), "write": (1, "thread")}):
+            # iter_outcomes 在交付全部结果后关闭流水线
+            pipeline = fix_photo_time.build_pipeline(True, stages, queue_size=2)
+            outcomes = quiet(lambda: [
+                (file_path.relative_to(directory).as_posix(), outcome, from_cache)
+                for file_path, outcome, from_cache in fix_photo_time.iter_outcomes(
+                    fix_photo_time.walk_media_files(directory), True, pipeline=pipeline)
+            ])
+            self.assertEqual(outcomes, serial)
+
+    def test_process_photos_buckets_match_serial(self):
+        states = []
+        for name, kwargs in (("serial", {}), ("workers2", {"workers": 2}), ("pipeline", {"pipeline": True})):
+            directory = self.root / name
+            build_media_tree(directory)
+            quiet(fix_photo_time.process_photos, directory, dry_run=False, **kwargs)
+            states.append(tree_state(directory))
+        self.assertEqual(states[1], states[0])
+        self.assertEqual(states[2], states[0])
+        folders = collections.Counter(path.split("/", 1)[0] for path, _ in states[0])
+        self.assertEqual(folders[fix_photo_time.UNPROCESSED_DIR_NAME], 13)
+        # 没有 exiftool 时 PNG 只能更新文件时间
+        self.assertEqual(folders[fix_photo_time.EXIF_DIR_NAME] + folders[fix_photo_time.FILETIME_DIR_NAME], 13)
+
+
+class PlanRoundTripTest(unittest.TestCase):
+    """试运行写出计划，apply_plan 按计划修改和移动；计划生成后变化或删除的文件跳过"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name) / "photos"
+        build_media_tree(self.root, count=12)
+        self.plan_path = self.root / fix_photo_time.PLAN_FILE_NAME
+
+    def write_plan(self, **kwargs):
+        quiet(fix_photo_time.process_photos, self.root, dry_run=True, plan_path=self.plan_path, **kwargs)
+        header, rows = fix_photo_time.read_plan(self.plan_path)
+        return header, list(rows)
+
+    def test_plan_matches_dry_run_and_pipeline(self):
+        header, rows = self.write_plan()
+        self.assertEqual(header["directory"], str(self.root))
+        self.assertEqual(header["threshold"], fix_photo_time.TIME_DELTA_THRESHOLD)
+        self.assertFalse(Path(str(self.plan_path) + ".tmp").exists())
+        # 跳过的文件不写入计划
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(self.write_plan(pipeline=True)[1], rows)
+        self.assertEqual(self.write_plan(workers=2)[1], rows)
+
+    def test_apply_moves_files_and_sets_times(self):
+        before = tree_state(self.root)
+        _, rows = self.write_plan()
+        self.assertEqual(tree_state(self.root), before)
+
+        counts = quiet(fix_photo_time.apply_plan, self.plan_path)
+        self.assertEqual(counts[fix_photo_time.OUTCOME_UNPROCESSED], 4)
+        self.assertEqual(counts[fix_photo_time.OUTCOME_EXIF] + counts[fix_photo_time.OUTCOME_FILETIME], 4)
+        for relative_path, size, mtime_ns, target, action, bucket in rows:
+            self.assertFalse((self.root / relative_path).exists())
+            name = Path(relative_path).name
+            if action == fix_photo_time.PLAN_ACTION_MOVE:
+                moved = self.root / fix_photo_time.UNPROCESSED_DIR_NAME / name
+                self.assertEqual(moved.stat().st_mtime_ns, mtime_ns)
+            else:
+                # 没有 exiftool 时 PNG 只更新文件时间，移入 filetime_only_updated
+                candidates = [path for path in (self.root / fix_photo_time.EXIF_DIR_NAME / name,
+                                                self.root / fix_photo_time.FILETIME_DIR_NAME / name) if path.exists()]
+                self.assertEqual(len(candidates), 1)
+                moved = candidates[0]
+                expected = datetime.datetime.fromisoformat(target).timestamp()
+                self.assertAlmostEqual(moved.stat().st_mtime, expected, delta=1)
+            self.assertEqual(moved.stat().st_size, size)
+        # 再次扫描时计划中的文件都已处理，只剩跳过的文件
+        _, rows = self.write_plan()
+        self.assertEqual(rows, [])
+
+    def test_stale_plan_skips_changed_and_missing_files(self):
+        _, rows = self.write_plan()
+        changed = self.root / rows[0][0]
+        missing = self.root / rows[1][0]
+        with open(changed, "ab") as f:
+            f.write(b"edited")
+        missing.unlink()
+        changed_state = (changed.stat().st_size, changed.stat().st_mtime_ns)
+
+        counts = quiet(fix_photo_time.apply_plan, self.plan_path)
+        self.assertEqual(counts["changed"], 1)
+        self.assertEqual(counts["missing"], 1)
+        self.assertEqual(sum(counts[outcome] for outcome in fix_photo_time.OUTCOME_CODES), len(rows) - 2)
+        self.assertEqual((changed.stat().st_size, changed.stat().st_mtime_ns), changed_state)
+        for relative_path, *_ in rows[2:]:
+            self.assertFalse((self.root / relative_path).exists())
+
+    def test_unreadable_plan_is_rejected(self):
+        self.plan_path.write_text('{"plan": 999}\n', encoding="utf-8")
+        self.assertIsNone(quiet(fix_photo_time.apply_plan, self.plan_path))
+        self.assertIsNone(quiet(fix_photo_time.apply_plan, self.root / "missing.jsonl"))
+        self.assertFalse((self.root / fix_photo_time.UNPROCESSED_DIR_NAME).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 设置命令:
+# launchctl unload ~/Library/LaunchAgents/com.user.routermonitor.plist
+# launchctl unload ~/Library/LaunchAgents/com.user.dnsmonitor.plist
+# chmod +x ~/Library/LaunchAgents/network_agent.py
+# launchctl load ~/Library/LaunchAgents/com.user.networkagent.plist
+# tail -f ~/Library/LaunchAgents/network_agent.log
+#
+# 把 router_monitor 和 dns_monitor 合并为一个常驻进程：
+# 每次网络变化只获取一次网络快照（网关、ARP表），各插件根据同一份快照给出动作，
+# 所有动作合并为一个按顺序执行的计划，最后只刷新一次DNS
+import os
+import sys
+import re
+import json
+import time
+import select
+import subprocess
+import collections
+import logging
+
+# 在仓库中直接运行时从相邻目录导入；部署到 ~/Library/LaunchAgents 后它们在同一目录
+for sibling in ("router-monitor", "dns-configurator"):
+    sibling_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", sibling)
+    if os.path.isdir(sibling_dir):
+        sys.path.append(sibling_dir)
+import router_monitor
+import dns_monitor
+try:
+    # 非阻塞的 JSON lines 日志管道（router-monitor/monitor_logging.py，与本脚本放在同一目录）；不可用时以纯文本写入日志文件
+    import monitor_logging
+except ImportError:
+    monitor_logging = None
+
+# 配置
+LOG_DIR = "~/Library/LaunchAgents"          # 日志目录
+LOG_FILE = os.path.join(os.path.expanduser(LOG_DIR), "network_agent.log")  # 日志文件路径
+STATE_FILE = os.path.join(os.path.expanduser(LOG_DIR), "network_agent_state.json")  # 各插件已执行动作的状态
+DEBOUNCE_TIME = 5                           # 插件的新状态需要持续的时间（秒）才会执行动作
+CHECK_INTERVAL = 5                          # 无法订阅网络变化通知时的轮询间隔（秒）
+
+# 动作执行顺序：先处理应用，再修改DNS配置，最后统一刷新DNS缓存
+PRIORITY_APPS = 10
+PRIORITY_DNS = 20
+
+# 日志设置
+os.makedirs(os.path.expanduser(LOG_DIR), exist_ok=True)
+
+def initialize_logger():
+    """初始化日志系统，router_monitor 和 dns_monitor 的函数也写入同一个日志"""
+    if monitor_logging is not None:
+        logger = monitor_logging.setup_logger("NetworkAgent", LOG_FILE)
+    else:
+        logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format="[%(asctime)s] %(levelname)s %(message)s")
+        logger = logging.getLogger("NetworkAgent")
+    router_monitor.logger = logger
+    dns_monitor.logger = logger
+
+    logger.info("▶▶▶ 网络代理启动")
+    return logger
+
+# 网络快照：一次网络变化只读取一次网关和ARP表，所有插件共用
+NetworkSnapshot = collections.namedtuple("NetworkSnapshot", "taken_at gateway_ip gateway_mac arp_table")
+
+# 动作：priority 决定执行顺序；flush_dns 为 True 且 run() 的返回值不是 False 时，计划结束后刷新一次DNS缓存
+Action = collections.namedtuple("Action", "priority plugin description run flush_dns")
+
+def read_arp_table():
+    """读取ARP表 {IP: MAC}，优先进程内读取，不可用时解析一次 arp -a 的输出"""
+    if router_monitor.native_tables():
+        try:
+            return router_monitor.net_tables.read_arp_table()
+        except OSError as e:
+            logger.info(f"进程内读取ARP表失败: {str(e)}，使用arp命令...")
+    arp_table = {}
+    try:
+        arp_output = subprocess.check_output(["arp", "-a"], text=True, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"获取ARP表失败: {str(e)}")
+        return arp_table
+    for ip, raw_mac in re.findall(r"\(([0-9.]+)\) at (\S+)", arp_output):
+        arp_table[ip] = router_monitor.standardize_mac(raw_mac)
+    return arp_table
+
+def read_default_gateway():
+    """读取默认网关IP，优先进程内读取路由表，不可用时使用 netifaces；没有默认网关时返回 None"""
+    if router_monitor.native_tables():
+        try:
+            return router_monitor.net_tables.default_gateway()[0]
+        except OSError as e:
+            logger.info(f"进程内读取路由表失败: {str(e)}，使用netifaces...")
+    try:
+        import netifaces
+        default = netifaces.gateways().get("default", {}).get(netifaces.AF_INET)
+    except Exception as e:
+        logger.error(f"获取网关信息失败: {str(e)}")
+        return None
+    return default[0] if default else None
+
+def take_snapshot():
+    """
+    获取网络快照：路由表和ARP表各读取一次，网关MAC直接从这份ARP表中取得
+    只有ARP表中还没有网关的已解析表项时，才探测网关并单独查询它的MAC
+    """
+    gateway_ip = read_default_gateway()
+    arp_table = read_arp_table()
+    gateway_mac = arp_table.get(gateway_ip) if gateway_ip else None
+    if gateway_ip and not gateway_mac:
+        logger.info(f"ARP表中没有网关{gateway_ip}的MAC，探测后查询")
+        router_monitor.refresh_arp_cache(gateway_ip)
+        gateway_mac = router_monitor.get_mac_from_arp(gateway_ip)
+        if gateway_mac:
+            arp_table[gateway_ip] = gateway_mac
+    snapshot = NetworkSnapshot(time.time(), gateway_ip, gateway_mac, arp_table)
+    logger.info(f"网络快照: 网关 {gateway_ip} ({gateway_mac})，ARP表 {len(arp_table)} 项")
+    return snapshot
+
+class HomeRouterPlugin:
+    """家庭路由器策略（router_monitor）：HOME 时退出代理和VPN应用，AWAY 时启动代理应用"""
+    name = "home_router"
+
+    def watched_ips(self, snapshot):
+        return [snapshot.gateway_ip] if snapshot.gateway_ip else []
+
+    def evaluate(self, snapshot):
+        """返回 HOME / AWAY；未获取到网关时返回 None（不做决定）"""
+        state = router_monitor.classify_network(snapshot.gateway_ip, snapshot.gateway_mac)
+        return None if state == router_monitor.STATE_UNKNOWN else state
+
+    def actions(self, state):
+        if state == router_monitor.STATE_HOME:
+            apps = [router_monitor.MIHOMO_APP, router_monitor.TAILSCALE_APP]
+            return [Action(PRIORITY_APPS, self.name, f"退出{'、'.join(apps)}",
+                           lambda: router_monitor.quit_apps(apps), True)]
+        return [Action(PRIORITY_APPS, self.name, f"启动{router_monitor.MIHOMO_APP}",
+                       lambda: router_monitor.control_mihomo(True), True)]
+
+class SpecificDnsPlugin:
+    """特定网络DNS策略（dns_monitor）：ARP表中出现特定网络的IP时设置DNS，否则清除"""
+    name = "specific_dns"
+    SPECIFIC = "SPECIFIC"
+    NORMAL = "NORMAL"
+
+    def watched_ips(self, snapshot):
+        return list(dns_monitor.SPECIFIC_NETWORK_IPS)
+
+    def evaluate(self, snapshot):
+        """返回 SPECIFIC / NORMAL；未连接网络时返回 None（不做决定）"""
+        if snapshot.gateway_ip is None:
+            return None
+        for ip in dns_monitor.SPECIFIC_NETWORK_IPS:
+            if ip in snapshot.arp_table:
+                return self.SPECIFIC
+        return self.NORMAL
+
+    def actions(self, state):
+        should_set = state == self.SPECIFIC
+        description = "设置特定网络DNS" if should_set else "清除DNS配置"
+        return [Action(PRIORITY_DNS, self.name, description,
+                       lambda: dns_monitor.configure_specific_dns(should_set, flush=False), True)]
+
+def default_plugins():
+    return [HomeRouterPlugin(), SpecificDnsPlugin()]
+
+class NetworkAgent:
+    """
+    根据网络快照驱动各插件
+    插件提供 name、watched_ips(snapshot)、evaluate(snapshot) 和 actions(state)：
+    evaluate 返回插件期望的状态（None 表示不做决定），状态与上次已执行动作的状态不同时才生成动作；
+    所有插件的状态变化需要共同持续 debounce 秒才执行，执行结果保存在 state_file 中，重启后不会重复执行
+    """
+    def __init__(self, plugins=None, state_file=STATE_FILE, debounce=DEBOUNCE_TIME):
+        self.plugins = plugins or default_plugins()
+        self.state_file = state_file
+        self.debounce = debounce
+        self.applied = {}
+        self.pending = None
+        self.pending_since = None
+        try:
+            with open(state_file, encoding="utf-8") as f:
+                self.applied = json.load(f).get("applied", {})
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        data = {"applied": self.applied, "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.state_file)
+
+    def changes(self, snapshot):
+        """返回 {插件名: 新状态}，只包含与已执行状态不同的插件"""
+        changes = {}
+        for plugin in self.plugins:
+            state = plugin.evaluate(snapshot)
+            if state is not None and state != self.applied.get(plugin.name):
+                changes[plugin.name] = state
+        return changes
+
+    def plan(self, changes):
+        """把所有插件的动作合并为一个按 priority 排序的计划"""
+        actions = []
+        for plugin in self.plugins:
+            if plugin.name in changes:
+                actions.extend(plugin.actions(changes[plugin.name]))
+        actions.sort(key=lambda action: action.priority)
+        return actions
+
+    def execute(self, changes):
+        """按顺序执行计划中的动作，需要时最后刷新一次DNS缓存"""
+        actions = self.plan(changes)
+        logger.info("执行计划:\n" + "\n".join(f"{i}. [{action.plugin}] {action.description}" for i, action in enumerate(actions, 1)))
+        need_flush = False
+        for action in actions:
+            changed = True
+            try:
+                # 返回 False 表示没有做任何修改（如DNS配置已符合期望），不需要刷新缓存
+                changed = action.run() is not False
+            except Exception as e:
+                logger.error(f"[{action.plugin}] {action.description}失败: {str(e)}")
+            need_flush = need_flush or (changed and action.flush_dns)
+        if need_flush:
+            router_monitor.flush_dns()
+        self.applied.update(changes)
+        self.save()
+
+    def observe(self, snapshot, now=None):
+        """
+        记录一次快照，变化持续 debounce 秒后执行
+
+        Returns:
+            本次是否执行了计划
+        """
+        now = time.monotonic() if now is None else now
+        changes = self.changes(snapshot)
+        if not changes:
+            self.pending = None
+            self.pending_since = None
+            return False
+        if changes != self.pending:
+            self.pending = changes
+            self.pending_since = now
+            logger.info(f"等待状态变化持续 {self.debounce} 秒: {changes}")
+        if now - self.pending_since < self.debounce:
+            return False
+        self.pending = None
+        self.pending_since = None
+        self.execute(changes)
+        return True
+
+    def pending_deadline(self):
+        if self.pending is None:
+            return None
+        return self.pending_since + self.debounce
+
+    def is_relevant_change(self, events, snapshot):
+        """
+        默认路由变化，或插件关注的IP在ARP表中出现、MAC变化或被删除时需要重新获取快照
+        （网关表项的删除由刷新ARP缓存引起，不算变化）
+        """
+        watched = set()
+        for plugin in self.plugins:
+            watched.update(plugin.watched_ips(snapshot))
+        for kind, ip, mac in events:
+            if kind in ("route", "route_del"):
+                return True
+            if ip not in watched:
+                continue
+            if kind == "neigh" and mac != snapshot.arp_table.get(ip):
+                return True
+            if kind == "neigh_del" and ip != snapshot.gateway_ip and ip in snapshot.arp_table:
+                return True
+        return False
+
+def network_agent(source=None, agent=None):
+    """
+    常驻模式：订阅网络变化通知（与 router_monitor 的常驻模式相同），每次相关变化获取一次快照并交给所有插件
+
+    Args:
+        source: 事件源，默认按平台使用 rtnetlink 或路由套接字
+        agent: NetworkAgent，默认使用全部插件并从 STATE_FILE 恢复
+    """
+    global logger
+    logger = initialize_logger()
+    agent = agent or NetworkAgent()
+    logger.info(f"插件: {', '.join(plugin.name for plugin in agent.plugins)}，已执行的状态: {agent.applied}")
+    if source is None:
+        try:
+            source = router_monitor.open_event_source()
+        except OSError as e:
+            logger.warning(f"无法订阅网络变化通知: {str(e)}，改为每{CHECK_INTERVAL}秒轮询")
+
+    try:
+        snapshot = take_snapshot()
+        agent.observe(snapshot)
+        while True:
+            deadline = agent.pending_deadline()
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            elif source is None:
+                timeout = CHECK_INTERVAL
+            else:
+                timeout = None
+            if source is None:
+                time.sleep(timeout)
+            else:
+                readable, _, _ = select.select([source], [], [], timeout)
+                if readable:
+                    events = router_monitor.collect_events(source, source.read_events())
+                    if not agent.is_relevant_change(events, snapshot):
+                        continue
+                    logger.info(f"检测到网络变化: {events}")
+            snapshot = take_snapshot()
+            agent.observe(snapshot)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"网络代理异常: {str(e)}")
+    finally:
+        if source is not None:
+            source.close()
+        logger.info("◀◀◀ 网络代理结束")
+
+def run_once():
+    """单次模式（供 launchd WatchPaths 触发）：获取一次快照，立即执行有变化的插件动作"""
+    global logger
+    logger = initialize_logger()
+    try:
+        agent = NetworkAgent(debounce=0)
+        agent.observe(take_snapshot())
+    except Exception as e:
+        logger.error(f"网络代理异常: {str(e)}")
+    finally:
+        logger.info("◀◀◀ 网络代理结束")
+
+def debug_agent():
+    """调试模式：显示快照和将要执行的计划，不执行任何动作"""
+    global logger
+    logger = logging.getLogger("NetworkAgent.debug")
+    router_monitor.logger = logger
+    dns_monitor.logger = logger
+    print("=== 网络代理调试信息 ===")
+    snapshot = take_snapshot()
+    print(f"网关: {snapshot.gateway_ip} ({snapshot.gateway_mac})")
+    print("ARP表:")
+    for ip, mac in snapshot.arp_table.items():
+        print(f"  {ip} → {mac}")
+    agent = NetworkAgent()
+    for plugin in agent.plugins:
+        print(f"{plugin.name}: 当前 {plugin.evaluate(snapshot)}，已执行 {agent.applied.get(plugin.name)}")
+    actions = agent.plan(agent.changes(snapshot))
+    print("计划:" if actions else "计划: 无需处理")
+    for i, action in enumerate(actions, 1):
+        print(f"  {i}. [{action.plugin}] {action.description}")
+    if any(action.flush_dns for action in actions):
+        print(f"  {len(actions) + 1}. 刷新DNS缓存（有实际修改时）")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "debug":
+        debug_agent()
+    elif len(sys.argv) > 1 and sys.argv[1] == "once":
+        run_once()
+    else:
+        network_agent()
+    sys.exit(0)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+network_agent 的单元测试（只使用标准库 unittest）
+使用模拟插件和模拟的路由表/ARP表，不执行任何系统命令，不刷新真实的DNS缓存
+
+用法:
+    python3 -m unittest test_network_agent
+    python3 -m pytest test_network_agent.py
+"""
+
+import os
+import json
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+import network_agent
+from network_agent import Action, NetworkAgent, NetworkSnapshot
+
+GATEWAY = ("192.168.50.1", "aa:bb:cc:dd:ee:ff")
+
+
+def snapshot(gateway_ip=GATEWAY[0], gateway_mac=GATEWAY[1], arp_table=None):
+    return NetworkSnapshot(0, gateway_ip, gateway_mac, dict(arp_table or {gateway_ip: gateway_mac}))
+
+
+class FakePlugin:
+    """
+    evaluate() 返回 state 属性；actions() 的动作把 (插件名, 状态) 追加到共享的 log 中
+    changed 为 run() 的返回值，为 False 时表示没有做任何修改
+    """
+    def __init__(self, name, priority, log, flush_dns=True, changed=None):
+        self.name = name
+        self.priority = priority
+        self.log = log
+        self.flush_dns = flush_dns
+        self.changed = changed
+        self.state = None
+
+    def watched_ips(self, snapshot):
+        return []
+
+    def evaluate(self, snapshot):
+        return self.state
+
+    def actions(self, state):
+        def run():
+            self.log.append((self.name, state))
+            return self.changed
+        return [Action(self.priority, self.name, f"切换到{state}", run, self.flush_dns)]
+
+
+class AgentTestCase(unittest.TestCase):
+    def setUp(self):
+        network_agent.logger = logging.getLogger("test_network_agent")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.state_file = os.path.join(self.tmp.name, "network_agent_state.json")
+        self.flush = mock.patch.object(network_agent.router_monitor, "flush_dns").start()
+        self.addCleanup(mock.patch.stopall)
+        self.log = []
+
+    def agent(self, plugins, debounce=5):
+        return NetworkAgent(plugins, state_file=self.state_file, debounce=debounce)
+
+
+class DebounceTest(AgentTestCase):
+    """状态变化需要持续 debounce 秒才执行；执行过的状态保存后不再重复执行"""
+
+    def test_change_must_hold_for_debounce(self):
+        plugin = FakePlugin("dns", network_agent.PRIORITY_DNS, self.log)
+        agent = self.agent([plugin])
+        plugin.state = "SPECIFIC"
+        self.assertFalse(agent.observe(snapshot(), now=100))
+        self.assertEqual(agent.pending_deadline(), 105)
+        self.assertFalse(agent.observe(snapshot(), now=104.9))
+        self.assertEqual(self.log, [])
+        self.assertTrue(agent.observe(snapshot(), now=105))
+        self.assertEqual(self.log, [("dns", "SPECIFIC")])
+        self.assertIsNone(agent.pending_deadline())
+        # 已执行的状态不再触发动作
+        self.assertFalse(agent.observe(snapshot(), now=200))
+        self.assertEqual(len(self.log), 1)
+
+    def test_flapping_restarts_the_wait(self):
+        plugin = FakePlugin("dns", network_agent.PRIORITY_DNS, self.log)
+        agent = self.agent([plugin])
+        plugin.state = "SPECIFIC"
+        agent.observe(snapshot(), now=0)
+        plugin.state = "NORMAL"
+        self.assertFalse(agent.observe(snapshot(), now=3))
+        self.assertEqual(agent.pending_deadline(), 8)
+        self.assertFalse(agent.observe(snapshot(), now=6))
+        self.assertTrue(agent.observe(snapshot(), now=8))
+        self.assertEqual(self.log, [("dns", "NORMAL")])
+
+    def test_return_to_applied_state_cancels_pending(self):
+        plugin = FakePlugin("dns", network_agent.PRIORITY_DNS, self.log)
+        agent = self.agent([plugin], debounce=0)
+        plugin.state = "NORMAL"
+        self.assertTrue(agent.observe(snapshot(), now=0))
+        plugin.state = "SPECIFIC"
+        agent.debounce = 5
+        self.assertFalse(agent.observe(snapshot(), now=1))
+        plugin.state = "NORMAL"
+        self.assertFalse(agent.observe(snapshot(), now=2))
+        self.assertIsNone(agent.pending_deadline())
+        self.assertFalse(agent.observe(snapshot(), now=10))
+        self.assertEqual(self.log, [("dns", "NORMAL")])
+
+    def test_no_decision_is_not_a_change(self):
+        plugin = FakePlugin("dns", network_agent.PRIORITY_DNS, self.log)
+        agent = self.agent([plugin], debounce=0)
+        self.assertFalse(agent.observe(snapshot(), now=0))
+        self.assertEqual(agent.changes(snapshot()), {})
+
+    def test_applied_state_survives_restart(self):
+        plugin = FakePlugin("dns", network_agent.PRIORITY_DNS, self.log)
+        plugin.state = "SPECIFIC"
+        self.assertTrue(self.agent([plugin], debounce=0).observe(snapshot(), now=0))
+        with open(self.state_file, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["applied"], {"dns": "SPECIFIC"})
+        restarted = self.agent([plugin], debounce=0)
+        self.assertFalse(restarted.observe(snapshot(), now=0))
+        self.assertEqual(len(self.log), 1)
+
+
+class ActionPlanTest(AgentTestCase):
+    """所有插件的动作按 priority 合并为一个计划，最后最多刷新一次DNS缓存"""
+
+    def plugins(self, **kwargs):
+        # 注册顺序与执行顺序相反，检查计划按 priority 排序
+        dns = FakePlugin("dns", network_agent.PRIORITY_DNS, self.log, **kwargs.get("dns", {}))
+        apps = FakePlugin("apps", network_agent.PRIORITY_APPS, self.log, **kwargs.get("apps", {}))
+        dns.state, apps.state = "SPECIFIC", "AWAY"
+        return [dns, apps]
+
+    def test_actions_run_in_priority_order_with_one_flush(self):
+        self.flush.side_effect = lambda: self.log.append(("flush_dns", None))
+        agent = self.agent(self.plugins(), debounce=0)
+        self.assertTrue(agent.observe(snapshot(), now=0))
+        self.assertEqual(self.log, [("apps", "AWAY"), ("dns", "SPECIFIC"), ("flush_dns", None)])
+        self.assertEqual(self.flush.call_count, 1)
+        self.assertEqual(agent.applied, {"dns": "SPECIFIC", "apps": "AWAY"})
+
+    def test_no_flush_when_nothing_changed(self):
+        agent = self.agent(self.plugins(dns={"changed": False}, apps={"flush_dns": False}), debounce=0)
+        self.assertTrue(agent.observe(snapshot(), now=0))
+        self.assertEqual(len(self.log), 2)
+        self.flush.assert_not_called()
+
+    def test_flush_when_only_one_plugin_changed(self):
+        agent = self.agent(self.plugins(dns={"changed": False}), debounce=0)
+        agent.observe(snapshot(), now=0)
+        self.assertEqual(self.flush.call_count, 1)
+
+    def test_failed_action_does_not_stop_the_plan(self):
+        plugins = self.plugins()
+        agent = self.agent(plugins, debounce=0)
+        with mock.patch.object(plugins[1], "actions", return_value=[
+                Action(network_agent.PRIORITY_APPS, "apps", "失败的动作", mock.Mock(side_effect=RuntimeError("boom")), True)]):
+            self.assertTrue(agent.observe(snapshot(), now=0))
+        self.assertEqual(self.log, [("dns", "SPECIFIC")])
+        self.assertEqual(self.flush.call_count, 1)
+
+    def test_default_plugins_order(self):
+        with mock.patch.object(network_agent.dns_monitor, "SPECIFIC_NETWORK_IPS", ["10.0.0.9"]), \
+                mock.patch.object(network_agent.router_monitor, "classify_network",
+                                  return_value=network_agent.router_monitor.STATE_AWAY):
+            agent = NetworkAgent(state_file=self.state_file, debounce=0)
+            actions = agent.plan(agent.changes(snapshot(arp_table={"10.0.0.9": "11:22:33:44:55:66"})))
+        self.assertEqual([action.plugin for action in actions], ["home_router", "specific_dns"])
+        self.assertTrue(all(action.flush_dns for action in actions))
+
+
+class FakeTables:
+    """与 net_tables 接口相同，统计路由表和ARP表的读取次数"""
+    def __init__(self, gateway_ip, arp_table):
+        self.gateway_ip = gateway_ip
+        self.arp_table = arp_table
+        self.route_reads = 0
+        self.arp_reads = 0
+
+    def default_gateway(self):
+        self.route_reads += 1
+        return self.gateway_ip, "en0"
+
+    def read_arp_table(self):
+        self.arp_reads += 1
+        return dict(self.arp_table)
+
+
+class SnapshotTest(unittest.TestCase):
+    """take_snapshot 只读取一次路由表和ARP表，网关MAC从同一份ARP表中取得"""
+
+    def setUp(self):
+        network_agent.logger = logging.getLogger("test_network_agent")
+        self.addCleanup(mock.patch.stopall)
+        self.combined = mock.patch.object(network_agent.router_monitor, "get_router_info_combined").start()
+        self.refresh = mock.patch.object(network_agent.router_monitor, "refresh_arp_cache").start()
+        self.lookup = mock.patch.object(network_agent.router_monitor, "get_mac_from_arp", return_value=GATEWAY[1]).start()
+
+    def use_tables(self, tables):
+        mock.patch.object(network_agent.router_monitor, "native_tables", return_value=tables).start()
+        mock.patch.object(network_agent.router_monitor, "net_tables", tables).start()
+
+    def test_reads_each_table_once(self):
+        tables = FakeTables(GATEWAY[0], {GATEWAY[0]: GATEWAY[1], "10.0.0.9": "11:22:33:44:55:66"})
+        self.use_tables(tables)
+        result = network_agent.take_snapshot()
+        self.assertEqual((result.gateway_ip, result.gateway_mac), GATEWAY)
+        self.assertEqual(result.arp_table, tables.arp_table)
+        self.assertEqual((tables.route_reads, tables.arp_reads), (1, 1))
+        self.combined.assert_not_called()
+        self.refresh.assert_not_called()
+        self.lookup.assert_not_called()
+
+    def test_unresolved_gateway_is_probed(self):
+        tables = FakeTables(GATEWAY[0], {GATEWAY[0]: None})
+        self.use_tables(tables)
+        result = network_agent.take_snapshot()
+        self.assertEqual(result.gateway_mac, GATEWAY[1])
+        self.assertEqual(result.arp_table[GATEWAY[0]], GATEWAY[1])
+        self.refresh.assert_called_once_with(GATEWAY[0])
+        self.lookup.assert_called_once_with(GATEWAY[0])
+        self.assertEqual((tables.route_reads, tables.arp_reads), (1, 1))
+
+    def test_no_default_route(self):
+        tables = FakeTables(None, {"10.0.0.9": "11:22:33:44:55:66"})
+        self.use_tables(tables)
+        result = network_agent.take_snapshot()
+        self.assertEqual((result.gateway_ip, result.gateway_mac), (None, None))
+        self.assertEqual(result.arp_table, tables.arp_table)
+        self.refresh.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+launchd 触发的脚本的启动耗时检查
+对每个脚本运行 python3 -X importtime -c "import <模块>"，取多次运行的中位数：
+- 模块导入的累计耗时超过预算时判为失败
+- 应在用到时才导入的重量级模块（netifaces、asyncio、Pillow 等）在导入阶段就被导入时判为失败
+同时记录 python3 -c "import <模块>" 整个进程的耗时和空解释器的耗时作为参考
+以 JSON 输出结果，有失败项时退出码为 1，可在改动后作为回归检查
+
+用法:
+    python3 bench_startup.py
+    python3 bench_startup.py --runs 10 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# (名称, 脚本所在目录, 模块名, 导入耗时预算（毫秒）, 不应在导入阶段导入的模块)
+# 预算按较慢的机器设定（空解释器启动约 15ms），与各脚本改为延迟导入后的耗时相比留有余量
+TARGETS = [
+    ("warm_helper", HERE, "warm_helper", 20, ["threading", "logging"]),
+    ("router_monitor", HERE, "router_monitor", 75, ["netifaces", "concurrent.futures"]),
+    ("dns_monitor", os.path.join(ROOT, "dns-configurator"), "dns_monitor", 75, ["asyncio", "random"]),
+    ("fix_photo_time", os.path.join(ROOT, "fix-photo-time"), "fix_photo_time", 100,
+     ["PIL", "piexif", "pillow_heif", "tqdm", "cProfile", "pstats", "numpy"]),
+]
+
+def parse_importtime(stderr, module):
+    """解析 -X importtime 的输出，返回 (模块的累计导入耗时（微秒）, 导入的所有模块名集合)"""
+    cumulative = None
+    imported = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative = int(cumulative_us)
+    return cumulative, imported
+
+def measure(directory, module):
+    """运行一次导入，返回 (导入耗时（毫秒）, 进程耗时（毫秒）, 导入的模块名集合)"""
+    env = dict(os.environ)
+    # 部署时共用模块（net_tables、monitor_logging、warm_helper）与脚本放在同一目录，这里通过 PYTHONPATH 模拟
+    env["PYTHONPATH"] = os.pathsep.join([directory, HERE] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=directory, env=env, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"导入 {module} 失败")
+    cumulative, imported = parse_importtime(result.stderr, module)
+    return cumulative / 1000, elapsed, imported
+
+def interpreter_ms(runs):
+    """空解释器（python3 -c pass）的启动耗时中位数（毫秒）"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def check_target(name, directory, module, budget_ms, lazy_modules, runs):
+    """检查一个脚本，返回结果字典；导入失败时 ok 为 False 并记录错误"""
+    entry = {"name": name, "module": module, "budget_ms": budget_ms}
+    try:
+        # 第一次运行生成 .pyc，不计入结果
+        measure(directory, module)
+        samples = [measure(directory, module) for _ in range(runs)]
+    except (RuntimeError, OSError) as e:
+        entry.update(ok=False, error=str(e))
+        return entry
+    eager = sorted({lazy for _, _, imported in samples for lazy in lazy_modules if lazy in imported})
+    import_ms = statistics.median(sample[0] for sample in samples)
+    entry.update(
+        import_ms=round(import_ms, 2),
+        process_ms=round(statistics.median(sample[1] for sample in samples), 2),
+        modules=len(samples[-1][2]),
+        eager_imports=eager,
+        ok=import_ms <= budget_ms and not eager,
+    )
+    return entry
+
+def main():
+    parser = argparse.ArgumentParser(description="launchd 触发的脚本的启动耗时检查")
+    parser.add_argument("--runs", type=int, default=5, help="每个脚本运行的次数（取中位数）")
+    parser.add_argument("--scale", type=float, default=1.0, help="预算倍数，较慢的机器上可放宽")
+    parser.add_argument("--output", help="JSON 结果输出文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    results = {
+        "python": sys.version.split()[0],
+        "interpreter_ms": round(interpreter_ms(args.runs), 2),
+        "targets": [check_target(name, directory, module, budget_ms * args.scale, lazy_modules, args.runs)
+                    for name, directory, module, budget_ms, lazy_modules in TARGETS],
+    }
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failed = [target for target in results["targets"] if not target["ok"]]
+    for target in failed:
+        if "error" in target:
+            print(f"失败: {target['name']} 无法导入: {target['error']}", file=sys.stderr)
+            continue
+        if target["import_ms"] > target["budget_ms"]:
+            print(f"失败: {target['name']} 导入耗时 {target['import_ms']}ms 超过预算 {target['budget_ms']}ms", file=sys.stderr)
+        if target["eager_imports"]:
+            print(f"失败: {target['name']} 在导入阶段导入了 {', '.join(target['eager_imports'])}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
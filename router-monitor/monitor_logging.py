@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 监控脚本共用的非阻塞日志管道
+# 调用线程只把日志记录放入队列，由后台线程格式化为单行 JSON 并写入按天轮转的文件
+# DEBUG 记录（ARP表、netstat 输出等大段内容）不写入文件，只保存在内存环形缓冲区中，出现 ERROR 时连同错误一起写出
+# 与 router_monitor.py、dns_monitor.py、network_agent.py 放在同一目录下即可被使用；不可用时这些脚本使用原来的日志格式
+import json
+import queue
+import atexit
+import datetime
+import collections
+import logging
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+LOG_RETENTION_DAYS = 14                     # 日志按天轮转，保留的天数
+RING_BUFFER_SIZE = 500                      # 内存中保留的最近 DEBUG 记录数
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON；context 为 true 的记录是出错时从环形缓冲区转储的上下文"""
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "ring_dump", False):
+            entry["context"] = True
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    记录原样放入队列，不在调用线程中格式化消息
+    logger.debug("ARP表: %s", output) 这样的参数只有在记录真正写出时才会格式化
+    """
+    def prepare(self, record):
+        return record
+
+class RingBufferHandler(logging.Handler):
+    """
+    在内存中保留最近的低于 target 级别的记录（不格式化）
+    收到 ERROR 及以上的记录时，先把缓冲区中的记录写入 target 作为错误的上下文，再清空缓冲区
+    """
+    def __init__(self, target, capacity=RING_BUFFER_SIZE):
+        super().__init__(logging.DEBUG)
+        self.target = target
+        self.buffer = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        if record.levelno >= logging.ERROR:
+            for buffered in self.buffer:
+                buffered.ring_dump = True
+                # 直接调用 emit，绕过 target 的级别过滤
+                self.target.emit(buffered)
+            self.buffer.clear()
+        elif record.levelno < self.target.level:
+            self.buffer.append(record)
+
+def setup_logger(name, log_file, retention_days=LOG_RETENTION_DAYS):
+    """
+    创建使用后台写入线程的 logger
+    INFO 及以上写入 log_file（JSON lines，每天零点轮转，保留 retention_days 天），DEBUG 只进入环形缓冲区
+    进程退出时自动写完队列中剩余的记录
+
+    Returns:
+        logging.Logger
+    """
+    file_handler = TimedRotatingFileHandler(log_file, when="midnight", backupCount=retention_days, encoding="utf-8")
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(JsonLinesFormatter())
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, RingBufferHandler(file_handler), file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(DeferredQueueHandler(records))
+    logger.propagate = False
+    return logger
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 监控脚本共用的指标：各阶段（获取网关、刷新ARP、匹配、应用控制、DNS刷新等）的次数和耗时直方图
+# 以 Prometheus 文本格式输出：常驻进程可在 127.0.0.1 上提供 HTTP /metrics，
+# launchd 每次启动的单次运行可写入 node_exporter 的 textfile collector 目录（计数在多次运行之间累加）
+# 与 router_monitor.py、dns_monitor.py 放在同一目录下即可被使用；不可用或未配置时这两个脚本不记录指标
+import os
+import json
+import time
+import atexit
+import threading
+
+NAMESPACE = "netmon"
+# 直方图的桶上限（秒），覆盖从进程内读表的毫秒级到等待应用退出的数十秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class _Stage:
+    """MetricsRegistry.stage 返回的计时器，异常时结果记为 error 并继续抛出"""
+    def __init__(self, registry, monitor, stage):
+        self.registry = registry
+        self.labels = {"monitor": monitor, "stage": stage}
+        self.result = "ok"
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        result = "error" if exc_type is not None else self.result
+        self.registry.observe("stage_duration_seconds", elapsed, self.labels, "各阶段耗时（秒）")
+        self.registry.inc("stage_total", dict(self.labels, result=result), help_text="各阶段执行次数（按结果）")
+        return False
+
+class MetricsRegistry:
+    """
+    线程安全的计数器和直方图集合，可保存为 JSON 以便在多次运行之间累加
+    textfile 不为 None 时，flush() 把当前数据写入该 .prom 文件
+    """
+    def __init__(self, namespace=NAMESPACE, buckets=LATENCY_BUCKETS, textfile=None):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self.textfile = textfile
+        self.lock = threading.Lock()
+        self.counters = {}      # 名称 -> {标签: 值}
+        self.histograms = {}    # 名称 -> {标签: [各桶计数..., 总和, 次数]}
+        self.help = {}
+
+    def inc(self, name, labels=None, value=1, help_text=None):
+        """计数器加 value"""
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+            if help_text:
+                self.help.setdefault(name, help_text)
+
+    def observe(self, name, seconds, labels=None, help_text=None):
+        """直方图记录一次耗时"""
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = _label_key(labels)
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+            if help_text:
+                self.help.setdefault(name, help_text)
+
+    def stage(self, monitor, stage):
+        """
+        记录一个阶段的耗时和结果
+            with metrics.stage("router_monitor", "discovery") as timer:
+                ...
+                timer.result = "miss"
+        """
+        return _Stage(self, monitor, stage)
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, values in sorted(series.items()):
+                    for bound, count in zip(self.buckets, values):
+                        lines.append(f"{full_name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{full_name}_bucket{_format_labels(key, [('le', '+Inf')])} {values[-1]}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {values[-2]:.6f}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def load(self, path):
+        """读取 save() 保存的数据；桶上限不同或文件不存在时从零开始"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if tuple(data["buckets"]) != self.buckets:
+                return
+            with self.lock:
+                for name, series in data["counters"].items():
+                    self.counters[name] = {tuple(map(tuple, key)): value for key, value in series}
+                for name, series in data["histograms"].items():
+                    self.histograms[name] = {tuple(map(tuple, key)): values for key, values in series}
+                self.help.update(data.get("help", {}))
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def flush(self):
+        """写入 textfile（未配置时不做任何事）"""
+        if self.textfile is not None:
+            write_textfile(self, self.textfile)
+
+    def save(self, path):
+        with self.lock:
+            data = {
+                "buckets": list(self.buckets),
+                "counters": {name: [[list(key), value] for key, value in series.items()] for name, series in self.counters.items()},
+                "histograms": {name: [[list(key), values] for key, values in series.items()] for name, series in self.histograms.items()},
+                "help": self.help,
+            }
+        _atomic_write(path, json.dumps(data, ensure_ascii=False))
+
+def _atomic_write(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def write_textfile(registry, path):
+    """写入 textfile collector 使用的 .prom 文件（先写临时文件再替换），同时保存累计数据"""
+    try:
+        registry.save(path + ".json")
+        _atomic_write(path, registry.render())
+    except OSError:
+        pass
+
+def serve_http(registry, port, host="127.0.0.1"):
+    """在后台线程中提供 http://host:port/metrics，返回 HTTPServer"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def setup_metrics(port=None, textfile=None):
+    """
+    按配置创建指标集合：port 不为 None 时启动 HTTP 服务，textfile 不为 None 时读取之前的累计数据，
+    并在 flush() 和进程退出时写入文件。都为 None 时返回 None（不记录指标）
+
+    Returns:
+        MetricsRegistry 或 None
+    """
+    if port is None and textfile is None:
+        return None
+    registry = MetricsRegistry(textfile=os.path.expanduser(textfile) if textfile is not None else None)
+    if registry.textfile is not None:
+        registry.load(registry.textfile + ".json")
+        atexit.register(registry.flush)
+    if port is not None:
+        serve_http(registry, port)
+    return registry
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 进程内读取 ARP 表和路由表，不再 fork arp / netstat 并解析文本输出
+# Linux 读取 /proc/net/arp 和 /proc/net/route，macOS/BSD 通过 sysctl(NET_RT_FLAGS / NET_RT_DUMP) 读取内核路由表
+# 与 router_monitor.py、dns_monitor.py 放在同一目录下即可被使用；不可用时这两个脚本会退回到原来的 arp / netstat 文本解析
+import os
+import sys
+import time
+import socket
+import struct
+import ctypes
+
+ARP_RESOLVE_TIMEOUT = 1.0                   # 表中没有目标IP时，等待ARP解析完成的最长时间（秒）
+ARP_POLL_INTERVAL = 0.05                    # 等待ARP解析时读取表的间隔（秒）
+
+class ProcBackend:
+    """Linux: 解析 /proc/net/arp 和 /proc/net/route"""
+    name = "proc"
+    ARP_PATH = "/proc/net/arp"
+    ROUTE_PATH = "/proc/net/route"
+    RTF_UP = 0x1
+    RTF_GATEWAY = 0x2
+
+    @classmethod
+    def available(cls):
+        return os.path.exists(cls.ARP_PATH) and os.path.exists(cls.ROUTE_PATH)
+
+    def arp_table(self):
+        """返回 {IP: MAC}，未完成解析的表项 MAC 为 None"""
+        table = {}
+        with open(self.ARP_PATH) as f:
+            next(f, None)
+            for line in f:
+                parts = line.split()
+                if len(parts) < 6:
+                    continue
+                ip, _, flags, mac = parts[:4]
+                complete = int(flags, 16) & 0x2 and mac != "00:00:00:00:00:00"
+                table[ip] = mac.lower() if complete else None
+        return table
+
+    def default_routes(self):
+        """返回 [(网卡, 网关IP, metric)]，按 metric 从小到大排序"""
+        routes = []
+        with open(self.ROUTE_PATH) as f:
+            next(f, None)
+            for line in f:
+                parts = line.split()
+                if len(parts) < 8:
+                    continue
+                iface, destination, gateway, flags, _, _, metric, mask = parts[:8]
+                flags = int(flags, 16)
+                if int(destination, 16) or int(mask, 16):
+                    continue
+                if not (flags & self.RTF_UP and flags & self.RTF_GATEWAY):
+                    continue
+                # /proc/net/route 中的地址是按本机字节序打印的32位整数
+                gateway_ip = socket.inet_ntoa(struct.pack("=L", int(gateway, 16)))
+                routes.append((iface, gateway_ip, int(metric)))
+        routes.sort(key=lambda route: route[2])
+        return routes
+
+class SysctlBackend:
+    """macOS/BSD: 通过 sysctl 读取内核路由表（ARP 表项是带 RTF_LLINFO 标志的主机路由）"""
+    name = "sysctl"
+    CTL_NET = 4
+    PF_ROUTE = 17
+    NET_RT_DUMP = 1
+    NET_RT_FLAGS = 2
+    RTF_GATEWAY = 0x2
+    RTF_LLINFO = 0x400
+    RTA_DST, RTA_GATEWAY, RTA_NETMASK = 0x1, 0x2, 0x4
+    RT_MSGHDR_SIZE = 92
+    AF_LINK = 18
+
+    def __init__(self):
+        # ctypes.util 会导入 tempfile、random 等模块，只在 macOS/BSD 上需要时才导入
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+    @classmethod
+    def available(cls):
+        return sys.platform == "darwin" or "bsd" in sys.platform
+
+    def _sysctl(self, mib):
+        mib = (ctypes.c_int * len(mib))(*mib)
+        size = ctypes.c_size_t()
+        if self.libc.sysctl(mib, len(mib), None, ctypes.byref(size), None, 0) != 0:
+            raise OSError(ctypes.get_errno(), "sysctl 获取长度失败")
+        # 两次调用之间表可能变大，多留一些空间
+        size.value += size.value // 4 + 1024
+        buf = ctypes.create_string_buffer(size.value)
+        if self.libc.sysctl(mib, len(mib), buf, ctypes.byref(size), None, 0) != 0:
+            raise OSError(ctypes.get_errno(), "sysctl 读取失败")
+        return buf.raw[:size.value]
+
+    def _messages(self, data):
+        """依次产出 (rtm_flags, rtm_index, {RTA_*: sockaddr})"""
+        offset = 0
+        while offset + self.RT_MSGHDR_SIZE <= len(data):
+            length, = struct.unpack_from("=H", data, offset)
+            if length < self.RT_MSGHDR_SIZE:
+                break
+            index, flags, addrs = struct.unpack_from("=H2xii", data, offset + 4)
+            sockaddrs = {}
+            pos = offset + self.RT_MSGHDR_SIZE
+            bit = 1
+            while bit <= 0x80 and pos < offset + length:
+                if addrs & bit:
+                    sa_len = data[pos]
+                    sockaddrs[bit] = data[pos:pos + sa_len]
+                    # sockaddr 按 4 字节对齐，长度为 0 时占 4 字节
+                    pos += ((sa_len - 1) | 3) + 1 if sa_len else 4
+                bit <<= 1
+            yield flags, index, sockaddrs
+            offset += length
+
+    @staticmethod
+    def _ipv4(sockaddr):
+        """sockaddr_in 中的 IPv4 地址；掩码等被截短的 sockaddr 按零补齐"""
+        if len(sockaddr) < 2 or sockaddr[1] != socket.AF_INET:
+            return None
+        return socket.inet_ntoa(sockaddr[4:8].ljust(4, b"\0"))
+
+    def arp_table(self):
+        table = {}
+        data = self._sysctl([self.CTL_NET, self.PF_ROUTE, 0, socket.AF_INET, self.NET_RT_FLAGS, self.RTF_LLINFO])
+        for flags, index, sockaddrs in self._messages(data):
+            ip = self._ipv4(sockaddrs.get(self.RTA_DST, b""))
+            if ip is None:
+                continue
+            # sockaddr_dl: sdl_nlen 在偏移 5，sdl_alen 在偏移 6，sdl_data 从偏移 8 开始
+            link = sockaddrs.get(self.RTA_GATEWAY, b"")
+            mac = None
+            if len(link) >= 8 and link[1] == self.AF_LINK and link[6] == 6:
+                start = 8 + link[5]
+                mac = ":".join(f"{b:02x}" for b in link[start:start + 6])
+            table[ip] = mac
+        return table
+
+    def default_routes(self):
+        routes = []
+        data = self._sysctl([self.CTL_NET, self.PF_ROUTE, 0, socket.AF_INET, self.NET_RT_DUMP, 0])
+        for flags, index, sockaddrs in self._messages(data):
+            if not flags & self.RTF_GATEWAY:
+                continue
+            if self._ipv4(sockaddrs.get(self.RTA_DST, b"")) != "0.0.0.0":
+                continue
+            netmask = sockaddrs.get(self.RTA_NETMASK)
+            if netmask is not None and self._ipv4(netmask) not in (None, "0.0.0.0"):
+                continue
+            gateway_ip = self._ipv4(sockaddrs.get(self.RTA_GATEWAY, b""))
+            if gateway_ip is None:
+                continue
+            try:
+                iface = socket.if_indextoname(index)
+            except OSError:
+                iface = str(index)
+            # 路由表按优先级顺序输出，用序号作为 metric
+            routes.append((iface, gateway_ip, len(routes)))
+        return routes
+
+_backend = None
+
+def get_backend():
+    """返回当前平台可用的读取方式；都不可用时返回 None"""
+    global _backend
+    if _backend is None:
+        for backend in (ProcBackend, SysctlBackend):
+            if backend.available():
+                _backend = backend()
+                break
+    return _backend
+
+def read_arp_table():
+    """
+    读取 ARP 表
+
+    Returns:
+        {IP: 标准化的MAC（xx:xx:xx:xx:xx:xx）}，未完成解析的表项为 None
+
+    Raises:
+        OSError: 当前平台没有可用的读取方式或读取失败
+    """
+    backend = get_backend()
+    if backend is None:
+        raise OSError("当前平台不支持进程内读取ARP表")
+    return backend.arp_table()
+
+def read_default_routes():
+    """读取 IPv4 默认路由，返回 [(网卡, 网关IP, metric)]，优先级高的在前"""
+    backend = get_backend()
+    if backend is None:
+        raise OSError("当前平台不支持进程内读取路由表")
+    return backend.default_routes()
+
+def default_gateway():
+    """返回优先级最高的默认网关 (网关IP, 网卡)，没有默认路由时返回 (None, None)"""
+    routes = read_default_routes()
+    if not routes:
+        return None, None
+    iface, gateway_ip, _ = routes[0]
+    return gateway_ip, iface
+
+def probe(ip):
+    """向目标发送一个 UDP 空包，促使内核发起 ARP 解析（不需要 fork ping）"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"", (ip, 9))
+    except OSError:
+        pass
+
+def lookup_mac(ip, resolve_timeout=ARP_RESOLVE_TIMEOUT):
+    """
+    在 ARP 表中查找 IP 对应的 MAC
+    表中没有已解析的表项时先 probe()，再在 resolve_timeout 秒内轮询等待
+    """
+    mac = read_arp_table().get(ip)
+    if mac or resolve_timeout <= 0:
+        return mac
+    probe(ip)
+    deadline = time.monotonic() + resolve_timeout
+    while time.monotonic() < deadline:
+        time.sleep(ARP_POLL_INTERVAL)
+        mac = read_arp_table().get(ip)
+        if mac:
+            return mac
+    return None
+
+if __name__ == "__main__":
+    backend = get_backend()
+    print(f"读取方式: {backend.name if backend else '不可用'}")
+    if backend:
+        print("ARP表:")
+        for ip, mac in read_arp_table().items():
+            print(f"  {ip} → {mac}")
+        print("默认路由:")
+        for iface, gateway_ip, metric in read_default_routes():
+            print(f"  {iface}: {gateway_ip} (metric {metric})")
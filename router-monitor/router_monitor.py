@@ -9,10 +9,36 @@ import os
 import sys
 import time
 import re
+import json
+import ctypes
+import threading
+import socket
+import select
+import struct
+import functools
 import subprocess
 import logging
-from logging.handlers import RotatingFileHandler
-import netifaces
+# netifaces、concurrent.futures、logging.handlers 在用到时才导入，缩短 launchd 每次启动的时间
+try:
+    # 进程内读取ARP表和路由表（与本脚本放在同一目录）；不可用时使用 arp / netstat 命令
+    import net_tables
+except ImportError:
+    net_tables = None
+try:
+    # 非阻塞的 JSON lines 日志管道（与本脚本放在同一目录）；不可用时以纯文本写入日志文件
+    import monitor_logging
+except ImportError:
+    monitor_logging = None
+try:
+    # 常驻预热进程（与本脚本放在同一目录）；不可用时不支持 warm 模式
+    import warm_helper
+except ImportError:
+    warm_helper = None
+try:
+    # 各阶段的次数和耗时指标（与本脚本放在同一目录）；不可用时不记录指标
+    import monitor_metrics
+except ImportError:
+    monitor_metrics = None
 
 # 配置
 HOME_GATEWAY_IP = "<HOME_GATEWAY_IP>"       # 家庭网关IP地址（替换为实际IP）
@@ -23,31 +49,59 @@ LOG_DIR = "~/Library/LaunchAgents"          # 日志目录
 LOG_FILE = os.path.join(os.path.expanduser(LOG_DIR), "router_monitor.log")  # 日志文件路径
 CHECK_INTERVAL = 5                          # 检查间隔（秒）
 MAX_RETRY_TIME = 750                        # 最大重试时间（12.5分钟）
+METRICS_PORT = None                         # 指标HTTP端口（只监听127.0.0.1，常驻/预热模式下可用），None 表示不启动
+METRICS_TEXTFILE = None                     # 指标文件路径（如 node_exporter textfile collector 目录下的 router_monitor.prom），None 表示不写入
 
 # 日志设置
 os.makedirs(os.path.expanduser(LOG_DIR), exist_ok=True)
 
-class CustomFormatter(logging.Formatter):
-    def format(self, record):
-        return f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n[{self.formatTime(record)}] {record.levelname}\n{record.getMessage()}"
-
 def initialize_logger():
-    """初始化日志系统"""
-    handler = RotatingFileHandler(
-        LOG_FILE,
-        maxBytes=1024*300,  # 300KB 约300条日志
-        backupCount=1,
-        encoding='utf-8'
-    )
-    handler.setFormatter(CustomFormatter())
-    
-    logger = logging.getLogger("RouterMonitor")
-    logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
+    """初始化日志系统，monitor_logging.py 不可用时以纯文本追加写入日志文件（不轮转）"""
+    if monitor_logging is not None:
+        logger = monitor_logging.setup_logger("RouterMonitor", LOG_FILE)
+    else:
+        logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format="[%(asctime)s] %(levelname)s %(message)s")
+        logger = logging.getLogger("RouterMonitor")
     
     logger.info("▶▶▶ 路由器监控启动")
     return logger
 
+# 指标
+metrics = None
+
+def initialize_metrics():
+    """按 METRICS_PORT / METRICS_TEXTFILE 初始化指标，未配置或 monitor_metrics.py 不可用时不记录"""
+    global metrics
+    if monitor_metrics is not None and metrics is None:
+        try:
+            metrics = monitor_metrics.setup_metrics(METRICS_PORT, METRICS_TEXTFILE)
+        except OSError as e:
+            logger.error(f"指标初始化失败: {str(e)}")
+    return metrics
+
+def timed(stage):
+    """装饰器：记录函数作为一个阶段的次数和耗时"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if metrics is None:
+                return func(*args, **kwargs)
+            with metrics.stage("router_monitor", stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count_metric(name, labels=None, help_text=None):
+    if metrics is not None:
+        metrics.inc(name, labels, help_text=help_text)
+
+def observe_reconnect(started_at, state):
+    """记录从检测到网络变化（或开始检查）到动作完成的耗时"""
+    if metrics is not None:
+        metrics.observe("reconnect_seconds", time.time() - started_at, {"monitor": "router_monitor", "state": state},
+                        "从检测到网络变化到动作完成的耗时（秒）")
+        metrics.flush()
+
 # 工具函数
 def standardize_mac(raw_mac):
     """将MAC地址标准化为XX:XX:XX:XX:XX:XX格式"""
@@ -60,8 +114,20 @@ def standardize_mac(raw_mac):
         logger.error(f"MAC地址标准化失败: {str(e)}")
         return None
 
+def native_tables():
+    """返回可用的进程内ARP/路由表读取模块，不可用时返回 None"""
+    if net_tables is not None and net_tables.get_backend() is not None:
+        return net_tables
+    return None
+
+@timed("arp_refresh")
 def refresh_arp_cache(ip):
     """刷新ARP缓存以确保获取最新数据"""
+    if native_tables():
+        # 发送一个UDP空包触发ARP解析，等待解析由 get_mac_from_arp 完成
+        net_tables.probe(ip)
+        logger.info(f"已发送ARP探测: {ip}")
+        return
     try:
         subprocess.run(["arp", "-d", ip], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         subprocess.run(["ping", "-c2", "-W1", ip], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -71,10 +137,21 @@ def refresh_arp_cache(ip):
 
 def get_mac_from_arp(ip):
     """从ARP表获取指定IP的MAC地址"""
+    if native_tables():
+        try:
+            mac = net_tables.lookup_mac(ip)
+            if mac:
+                logger.info(f"从ARP表({net_tables.get_backend().name})找到MAC: {ip} → {mac}")
+            else:
+                logger.warning(f"无法从ARP表({net_tables.get_backend().name})找到{ip}的MAC地址")
+            return mac
+        except OSError as e:
+            logger.info(f"进程内读取ARP表失败: {str(e)}，尝试arp命令...")
+    
     try:
         try:
             arp_output = subprocess.check_output(["arp", "-n", ip], text=True, stderr=subprocess.PIPE)
-            logger.info(f"ARP表内容: {arp_output.strip()}")
+            logger.debug("ARP表内容: %s", arp_output.strip())
             mac_match = re.search(r"((?:[0-9a-fA-F]{1,2}[:\-\.]){5}[0-9a-fA-F]{1,2})", arp_output)
             if mac_match:
                 std_mac = standardize_mac(mac_match.group(1))
@@ -85,7 +162,7 @@ def get_mac_from_arp(ip):
         
         try:
             arp_all_output = subprocess.check_output(["arp", "-a"], text=True, stderr=subprocess.PIPE)
-            logger.info(f"完整ARP表: {arp_all_output}")
+            logger.debug("完整ARP表: %s", arp_all_output)
             gateway_pattern = rf'\? \({re.escape(ip)}\) at ([a-fA-F0-9:]+)'
             gateway_match = re.search(gateway_pattern, arp_all_output)
             if gateway_match:
@@ -105,9 +182,10 @@ def get_mac_from_arp(ip):
 def get_router_info():
     """使用netifaces获取当前路由器IP和MAC地址"""
     try:
+        import netifaces
         logger.info("开始获取网关信息...")
         gateways = netifaces.gateways()
-        logger.info(f"netifaces.gateways()结果: {gateways}")
+        logger.debug("netifaces.gateways()结果: %s", gateways)
         
         default_gateway = None
         if 'default' in gateways and netifaces.AF_INET in gateways['default']:
@@ -131,11 +209,25 @@ def get_router_info():
         return None, None
 
 def get_router_info_netstat():
-    """使用netstat命令获取默认网关信息（备用方法）"""
+    """从路由表获取默认网关信息（备用方法），优先进程内读取，不可用时解析netstat输出"""
+    if native_tables():
+        try:
+            gateway_ip, iface = net_tables.default_gateway()
+            if gateway_ip is None:
+                logger.warning("路由表中没有IPv4默认网关")
+                return None, None
+            logger.info(f"从路由表({net_tables.get_backend().name})获取到网关: {gateway_ip} ({iface})")
+            refresh_arp_cache(gateway_ip)
+            mac_address = get_mac_from_arp(gateway_ip)
+            return gateway_ip, mac_address
+        except OSError as e:
+            logger.info(f"进程内读取路由表失败: {str(e)}，使用netstat...")
+    
     try:
         logger.info("使用netstat获取网关信息...")
+        count_metric("netstat_fallback_total", help_text="执行 netstat 命令获取网关的次数")
         netstat_output = subprocess.check_output(["netstat", "-rn"], text=True, stderr=subprocess.PIPE)
-        logger.info(f"netstat输出内容:\n{netstat_output}")
+        logger.debug("netstat输出内容:\n%s", netstat_output)
         
         for line in netstat_output.split('\n'):
             if line.startswith('default') and 'UG' in line:
@@ -153,23 +245,159 @@ def get_router_info_netstat():
         logger.error(f"netstat获取网关信息失败: {str(e)}")
         return None, None
 
-def get_router_info_combined():
-    """组合netifaces和netstat方法获取路由器信息"""
-    logger.info("尝试使用netifaces获取网关信息...")
-    ip, mac = get_router_info()
-    if ip:
-        logger.info(f"netifaces成功: IP={ip}, MAC={mac}")
-        return ip, mac
+# 网关获取方式并发竞速
+GATEWAY_BACKEND_TIMEOUT = 3                 # 等待网关获取结果的最长时间（秒）
+GATEWAY_HEDGE_DELAY = 0.5                   # 被降级的获取方式延后启动的时间（秒），期间其他方式已返回则不再启动
+DEMOTE_MIN_RUNS = 10                        # 至少运行这么多次后才会根据胜率降级
+DEMOTE_WIN_RATE = 0.1                       # 胜率低于该值的获取方式被降级
+BACKEND_STATS_FILE = os.path.join(os.path.expanduser(LOG_DIR), "router_monitor_backends.json")  # 统计数据保存路径
+_gateway_executor = None
+
+def get_gateway_executor():
+    """网关获取共用的线程池，第一次获取网关时创建"""
+    global _gateway_executor
+    if _gateway_executor is None:
+        import concurrent.futures
+        _gateway_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="gateway")
+    return _gateway_executor
+
+class BackendStats:
+    """
+    记录每种网关获取方式的运行次数、胜出次数、失败次数和平均耗时（指数滑动平均）
+    保存在 BACKEND_STATS_FILE 中，launchd 每次重新启动脚本时也能沿用
+    """
+    def __init__(self, path=BACKEND_STATS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.backends = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.backends = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def record(self, name, latency, ok, won):
+        with self.lock:
+            entry = self.backends.setdefault(name, {"runs": 0, "wins": 0, "failures": 0, "latency": latency})
+            entry["runs"] += 1
+            entry["wins"] += 1 if won else 0
+            entry["failures"] += 0 if ok else 1
+            entry["latency"] = round(entry["latency"] * 0.8 + latency * 0.2, 4)
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.backends, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+
+    def demoted(self, name):
+        """运行次数足够且胜率过低的获取方式被降级"""
+        entry = self.backends.get(name)
+        if entry is None or entry["runs"] < DEMOTE_MIN_RUNS:
+            return False
+        return entry["wins"] / entry["runs"] < DEMOTE_WIN_RATE
+
+    def summary(self):
+        lines = []
+        for name, entry in sorted(self.backends.items()):
+            win_rate = entry["wins"] / entry["runs"] if entry["runs"] else 0
+            lines.append(f"{name}: 运行{entry['runs']}次, 胜率{win_rate:.0%}, 失败{entry['failures']}次, 平均耗时{entry['latency'] * 1000:.0f}ms"
+                         + ("（已降级）" if self.demoted(name) else ""))
+        return lines
+
+_backend_stats = None
+
+def get_backend_stats():
+    global _backend_stats
+    if _backend_stats is None:
+        _backend_stats = BackendStats()
+    return _backend_stats
+
+def gateway_backends():
+    """所有网关获取方式 [(名称, 函数)]，每个函数返回 (IP, MAC)"""
+    return [("netifaces", get_router_info), ("route_table", get_router_info_netstat)]
+
+def _timed_backend(func):
+    start = time.monotonic()
+    try:
+        ip, mac = func()
+    except Exception as e:
+        logger.error(f"网关获取异常: {str(e)}")
+        ip, mac = None, None
+    return ip, mac, time.monotonic() - start
+
+@timed("discovery")
+def get_router_info_combined(backends=None, timeout=GATEWAY_BACKEND_TIMEOUT):
+    """
+    并发运行所有网关获取方式，返回最先得到的完整结果 (IP, MAC)
+    都没有取到MAC时返回最先取到的IP；超时或全部失败时返回 (None, None)
+    被降级的方式延后 GATEWAY_HEDGE_DELAY 秒启动，其他方式失败时立即启动；
+    返回时尚未开始的任务被取消，已在运行的任务结束后只记录统计，结果被丢弃
+    """
+    import concurrent.futures
+    backends = backends or gateway_backends()
+    stats = get_backend_stats()
+    executor = get_gateway_executor()
+    delayed = [backend for backend in backends if stats.demoted(backend[0])]
+    if len(delayed) == len(backends):
+        delayed = []
+    immediate = [backend for backend in backends if backend not in delayed]
+    deadline = time.monotonic() + timeout
+    hedge_at = time.monotonic() + GATEWAY_HEDGE_DELAY
+    names = {}
+    pending = set()
+    winner = None
+    partial = None
     
-    logger.info("netifaces失败，尝试netstat...")
-    ip, mac = get_router_info_netstat()
-    if ip:
-        logger.info(f"netstat成功: IP={ip}, MAC={mac}")
-        return ip, mac
+    def start(to_start):
+        for name, func in to_start:
+            future = executor.submit(_timed_backend, func)
+            names[future] = name
+            pending.add(future)
     
-    logger.error("所有方法均无法获取网关信息")
-    return None, None
+    def finished(future):
+        ip, mac, latency = future.result()
+        stats.record(names[future], latency, ip is not None, names[future] == winner)
+    
+    logger.info(f"并发获取网关信息: {', '.join(name for name, _ in immediate)}"
+                + (f"，延后启动: {', '.join(name for name, _ in delayed)}" if delayed else ""))
+    start(immediate)
+    while winner is None:
+        now = time.monotonic()
+        if delayed and (now >= hedge_at or not pending):
+            start(delayed)
+            delayed = []
+        if not pending or now >= deadline:
+            break
+        wait_until = min(deadline, hedge_at) if delayed else deadline
+        done, _ = concurrent.futures.wait(pending, timeout=max(0, wait_until - now),
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            ip, mac, latency = future.result()
+            if ip and mac:
+                winner = names[future]
+                result = (ip, mac)
+                logger.info(f"{winner}最先返回: IP={ip}, MAC={mac}（{latency * 1000:.0f}ms）")
+                break
+            if ip and partial is None:
+                partial = (names[future], (ip, mac))
+    
+    if winner is None and partial is not None:
+        winner, result = partial
+        logger.info(f"{winner}只取到IP: {result[0]}")
+    for future in list(names):
+        if future.cancel():
+            continue
+        future.add_done_callback(finished)
+    count_metric("gateway_lookup_total", {"winner": winner or "none"}, "获取网关的次数（按最先返回的方式）")
+    if winner is None:
+        logger.error("所有方法均无法获取网关信息")
+        return None, None
+    return result
 
+@timed("match")
 def check_target_router_match(current_ip, current_mac):
     """检查是否匹配目标MAC和IP地址"""
     if not current_ip or not current_mac:
@@ -179,6 +407,7 @@ def check_target_router_match(current_ip, current_mac):
     logger.info(f"目标路由器检查: IP({current_ip}=={HOME_GATEWAY_IP}): {ip_match}, MAC({current_mac}=={HOME_GATEWAY_MAC}): {mac_match}")
     return ip_match and mac_match
 
+@timed("dns_flush")
 def flush_dns():
     """刷新DNS缓存"""
     try:
@@ -189,14 +418,127 @@ def flush_dns():
     except subprocess.CalledProcessError as e:
         logger.error(f"DNS刷新失败: {str(e)}")
 
+# 进程查询与等待（不 fork pgrep，不固定 sleep）
+QUIT_TIMEOUT = 20                           # 退出所有应用的总时限（秒），多个应用共用
+QUIT_WAIT = 3                               # AppleScript 退出后最多等待进程结束的时间（秒）
+COMMAND_Q_WAIT = 5                          # 发送 Command+Q 后最多等待进程结束的时间（秒）
+ui_lock = threading.Lock()                  # 激活应用和发送按键必须串行，否则按键可能发给其他应用
+_libproc = None
+
+def find_pids(process_name):
+    """
+    返回进程名完全匹配的 PID 列表（相当于 pgrep -x）
+    Linux 扫描 /proc/<pid>/comm，macOS 使用 libproc；都不可用时退回 pgrep
+    """
+    global _libproc
+    if os.path.isdir("/proc/self"):
+        # comm 最长 15 个字符，与 pgrep 的匹配方式相同
+        target = process_name[:15]
+        pids = []
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/comm") as f:
+                    if f.read().rstrip("\n") == target:
+                        pids.append(int(entry.name))
+            except OSError:
+                continue
+        return pids
+    if sys.platform == "darwin":
+        if _libproc is None:
+            _libproc = ctypes.CDLL("/usr/lib/libproc.dylib", use_errno=True)
+        count = _libproc.proc_listallpids(None, 0)
+        if count > 0:
+            buf = (ctypes.c_int * (count + 64))()
+            count = _libproc.proc_listallpids(buf, ctypes.sizeof(buf))
+            name = ctypes.create_string_buffer(256)
+            pids = []
+            for pid in buf[:max(count, 0)]:
+                if pid > 0 and _libproc.proc_name(pid, name, ctypes.sizeof(name)) > 0:
+                    if name.value.decode("utf-8", "replace") == process_name:
+                        pids.append(pid)
+            return pids
+    result = subprocess.run(["pgrep", "-x", process_name], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return [int(pid) for pid in result.stdout.split()]
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def wait_for_exit(pids, timeout):
+    """
+    等待进程全部退出，进程一退出就返回（Linux 使用 pidfd + poll，macOS 使用 kqueue 的 NOTE_EXIT）
+    不支持时每 0.1 秒检查一次
+
+    Returns:
+        超时前是否全部退出
+    """
+    deadline = time.monotonic() + max(timeout, 0)
+    pids = [pid for pid in pids if pid_alive(pid)]
+    if not pids:
+        return True
+    if hasattr(os, "pidfd_open"):
+        fds = {}
+        try:
+            for pid in pids:
+                try:
+                    fds[os.pidfd_open(pid)] = pid
+                except ProcessLookupError:
+                    continue
+            poller = select.poll()
+            for fd in fds:
+                poller.register(fd, select.POLLIN)
+            remaining = len(fds)
+            while remaining:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    return False
+                for fd, _ in poller.poll(wait * 1000):
+                    poller.unregister(fd)
+                    remaining -= 1
+            return True
+        finally:
+            for fd in fds:
+                os.close(fd)
+    if hasattr(select, "kqueue"):
+        kq = select.kqueue()
+        try:
+            changes = [select.kevent(pid, select.KQ_FILTER_PROC, select.KQ_EV_ADD | select.KQ_EV_ONESHOT, select.KQ_NOTE_EXIT) for pid in pids]
+            remaining = set(pids)
+            for change in changes:
+                try:
+                    kq.control([change], 0, 0)
+                except ProcessLookupError:
+                    remaining.discard(change.ident)
+            while remaining:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    return False
+                for event in kq.control(None, len(remaining), wait):
+                    remaining.discard(event.ident)
+            return True
+        finally:
+            kq.close()
+    while any(pid_alive(pid) for pid in pids):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+@timed("app_control")
 def control_mihomo(should_run):
     """控制Mihomo应用（启动/退出）"""
     try:
         action = "启动" if should_run else "退出"
         logger.info(f"正在{action}{MIHOMO_APP}...")
         if should_run:
-            result = subprocess.run(["pgrep", "-x", MIHOMO_APP], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if result.returncode != 0:
+            if not find_pids(MIHOMO_APP):
                 subprocess.run(["open", "-a", MIHOMO_APP], check=False)
                 logger.info(f"{MIHOMO_APP}已启动")
             else:
@@ -208,27 +550,53 @@ def control_mihomo(should_run):
         logger.error(f"{MIHOMO_APP}{action}失败: {str(e)}")
         return False
 
-def graceful_quit_app(app_name):
-    """优雅退出指定应用"""
+def graceful_quit_app(app_name, deadline=None):
+    """
+    优雅退出指定应用：先用 AppleScript 退出，未退出时激活应用并发送 Command+Q
+    进程一退出就返回，不再固定等待
+    
+    Args:
+        app_name: 应用名称
+        deadline: 截止时间（time.monotonic），多个应用并发退出时共用；默认为 QUIT_TIMEOUT 秒后
+    """
+    if deadline is None:
+        deadline = time.monotonic() + QUIT_TIMEOUT
+    
+    def remaining(limit):
+        return max(0, min(limit, deadline - time.monotonic()))
+    
     try:
-        result = subprocess.run(["pgrep", "-x", app_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode == 0:
-            logger.info(f"检测到{app_name}正在运行，尝试优雅退出...")
-            applescript_cmd = f'tell application "{app_name}" to quit'
+        pids = find_pids(app_name)
+        if not pids:
+            logger.info(f"{app_name}未运行")
+            return True
+        logger.info(f"检测到{app_name}正在运行，尝试优雅退出...")
+        applescript_cmd = f'tell application "{app_name}" to quit'
+        try:
             subprocess.run(
                 ["osascript", "-e", applescript_cmd],
                 check=False,
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
-                timeout=10
+                timeout=max(remaining(10), 0.1)
             )
-            time.sleep(3)
-            check_result = subprocess.run(["pgrep", "-x", app_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if check_result.returncode != 0:
-                logger.info(f"{app_name}通过AppleScript成功退出")
-                return True
-            logger.info("AppleScript退出失败，尝试发送Command+Q...")
-            activate_cmd = f'tell application "{app_name}" to activate'
+        except subprocess.TimeoutExpired:
+            logger.info(f"AppleScript退出{app_name}超时")
+        if wait_for_exit(pids, remaining(QUIT_WAIT)):
+            logger.info(f"{app_name}通过AppleScript成功退出")
+            return True
+        if remaining(COMMAND_Q_WAIT) <= 0:
+            logger.warning(f"{app_name}未在时限内退出，可能需要手动处理")
+            return False
+        
+        logger.info("AppleScript退出失败，尝试发送Command+Q...")
+        activate_cmd = f'tell application "{app_name}" to activate'
+        cmd_q_script = '''
+        tell application "System Events"
+            key code 12 using {command down}
+        end tell
+        '''
+        with ui_lock:
             subprocess.run(
                 ["osascript", "-e", activate_cmd],
                 check=False,
@@ -236,12 +604,8 @@ def graceful_quit_app(app_name):
                 stderr=subprocess.DEVNULL,
                 timeout=5
             )
+            # 等待应用切换到前台后再发送按键
             time.sleep(1)
-            cmd_q_script = '''
-            tell application "System Events"
-                key code 12 using {command down}
-            end tell
-            '''
             subprocess.run(
                 ["osascript", "-e", cmd_q_script],
                 check=False,
@@ -249,40 +613,33 @@ def graceful_quit_app(app_name):
                 stderr=subprocess.DEVNULL,
                 timeout=10
             )
-            logger.info(f"向{app_name}发送Command+Q")
-            time.sleep(5)
-            check_result = subprocess.run(["pgrep", "-x", app_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if check_result.returncode != 0:
-                logger.info(f"{app_name}通过Command+Q成功退出")
-                return True
-            logger.warning(f"{app_name}未响应Command+Q，可能需要手动处理")
-            return False
-        else:
-            logger.info(f"{app_name}未运行")
+        logger.info(f"向{app_name}发送Command+Q")
+        if wait_for_exit(pids, remaining(COMMAND_Q_WAIT)):
+            logger.info(f"{app_name}通过Command+Q成功退出")
             return True
+        logger.warning(f"{app_name}未响应Command+Q，可能需要手动处理")
+        return False
     except Exception as e:
         logger.error(f"优雅退出{app_name}失败: {str(e)}")
         return False
 
-def check_and_quit_tailscale():
-    """退出Tailscale应用"""
-    try:
-        result = subprocess.run(["pgrep", "-x", TAILSCALE_APP], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode == 0:
-            logger.info(f"检测到{TAILSCALE_APP}正在运行，尝试退出...")
-            return graceful_quit_app(TAILSCALE_APP)
-        else:
-            logger.info(f"{TAILSCALE_APP}未运行")
-            return True
-    except Exception as e:
-        logger.error(f"退出{TAILSCALE_APP}失败: {str(e)}")
-        return False
+@timed("app_control")
+def quit_apps(app_names, timeout=QUIT_TIMEOUT):
+    """
+    并发退出多个应用，共用 timeout 秒的总时限
+    所有应用退出（或超时）后立即返回 {应用名: 是否成功退出}
+    """
+    import concurrent.futures
+    deadline = time.monotonic() + timeout
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(app_names)) as executor:
+        futures = {app_name: executor.submit(graceful_quit_app, app_name, deadline) for app_name in app_names}
+    return {app_name: future.result() for app_name, future in futures.items()}
 
 def handle_target_router_found():
     """处理检测到目标路由器的情况"""
     logger.info("检测到目标路由器，执行退出操作")
-    control_mihomo(False)
-    check_and_quit_tailscale()
+    logger.info(f"正在同时退出{MIHOMO_APP}和{TAILSCALE_APP}...")
+    quit_apps([MIHOMO_APP, TAILSCALE_APP])
     flush_dns()  # 在所有应用操作完成后刷新DNS
     return True
 
@@ -293,12 +650,366 @@ def handle_normal_network():
     flush_dns()  # 在所有应用操作完成后刷新DNS
     return True
 
-def router_monitor():
-    """主路由器监控函数"""
+# 网络变化事件源
+# 事件格式: (类型, IP, MAC)
+#   ("route", 网关IP或None, None)   默认路由新增/变化
+#   ("route_del", 网关IP或None, None) 默认路由删除
+#   ("neigh", IP, MAC)             ARP/邻居表项新增或更新
+#   ("neigh_del", IP, None)        ARP/邻居表项删除
+# 事件源只需提供 fileno()、read_events() 和 close()，测试时可用本地 socketpair 等伪造事件源注入事件
+WATCH_SETTLE_TIME = 0.3                     # 收到事件后等待网络稳定的时间（秒），期间的事件合并处理
+
+class NetlinkEventSource:
+    """Linux: 订阅 rtnetlink 的 IPv4 路由和邻居表变化通知"""
+    RTMGRP_NEIGH = 0x4
+    RTMGRP_IPV4_ROUTE = 0x40
+    RTM_NEWROUTE, RTM_DELROUTE = 24, 25
+    RTM_NEWNEIGH, RTM_DELNEIGH = 28, 29
+    RTA_GATEWAY = 5
+    NDA_DST, NDA_LLADDR = 1, 2
+    RT_TABLE_MAIN = 254
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, self.RTMGRP_NEIGH | self.RTMGRP_IPV4_ROUTE))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def read_events(self):
+        return self.parse(self.sock.recv(65536))
+
+    @classmethod
+    def _attrs(cls, data, offset, end):
+        attrs = {}
+        while offset + 4 <= end:
+            length, attr_type = struct.unpack_from("=HH", data, offset)
+            if length < 4:
+                break
+            attrs[attr_type] = data[offset + 4:offset + length]
+            offset += (length + 3) & ~3
+        return attrs
+
+    @classmethod
+    def parse(cls, data):
+        """解析一次 recv 得到的 netlink 消息"""
+        events = []
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type = struct.unpack_from("=LH", data, offset)
+            if length < 16:
+                break
+            body = offset + 16
+            end = offset + length
+            if msg_type in (cls.RTM_NEWROUTE, cls.RTM_DELROUTE):
+                family, dst_len, _, _, table = struct.unpack_from("=BBBBB", data, body)
+                if family == socket.AF_INET and dst_len == 0 and table == cls.RT_TABLE_MAIN:
+                    attrs = cls._attrs(data, body + 12, end)
+                    gateway = attrs.get(cls.RTA_GATEWAY)
+                    gateway_ip = socket.inet_ntoa(gateway) if gateway and len(gateway) == 4 else None
+                    kind = "route" if msg_type == cls.RTM_NEWROUTE else "route_del"
+                    events.append((kind, gateway_ip, None))
+            elif msg_type in (cls.RTM_NEWNEIGH, cls.RTM_DELNEIGH):
+                family = data[body]
+                if family == socket.AF_INET:
+                    attrs = cls._attrs(data, body + 12, end)
+                    dst = attrs.get(cls.NDA_DST)
+                    lladdr = attrs.get(cls.NDA_LLADDR)
+                    if dst and len(dst) == 4:
+                        ip = socket.inet_ntoa(dst)
+                        if msg_type == cls.RTM_NEWNEIGH and lladdr and len(lladdr) == 6:
+                            events.append(("neigh", ip, ":".join(f"{b:02x}" for b in lladdr)))
+                        elif msg_type == cls.RTM_DELNEIGH:
+                            events.append(("neigh_del", ip, None))
+            offset += (length + 3) & ~3
+        return events
+
+class RoutingSocketEventSource:
+    """macOS/BSD: 通过 PF_ROUTE 路由套接字接收路由表变化（ARP 表项在路由表中带 RTF_LLINFO 标志）"""
+    RTM_ADD, RTM_DELETE, RTM_CHANGE = 1, 2, 3
+    RTF_LLINFO = 0x400
+    RTA_DST, RTA_GATEWAY = 0x1, 0x2
+    RT_MSGHDR_SIZE = 92
+    AF_LINK = 18
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_ROUTE, socket.SOCK_RAW, 0)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def read_events(self):
+        return self.parse(self.sock.recv(65536))
+
+    @classmethod
+    def _sockaddrs(cls, data, offset, end, addrs):
+        """按 rtm_addrs 位图依次取出 sockaddr（长度按 4 字节对齐）"""
+        result = {}
+        bit = 1
+        while bit <= 0x80 and offset < end:
+            if addrs & bit:
+                sa_len = data[offset]
+                result[bit] = data[offset:offset + sa_len]
+                offset += ((sa_len - 1) | 3) + 1 if sa_len else 4
+            bit <<= 1
+        return result
+
+    @classmethod
+    def _ipv4(cls, sockaddr):
+        if len(sockaddr) >= 8 and sockaddr[1] == socket.AF_INET:
+            return socket.inet_ntoa(sockaddr[4:8])
+        if len(sockaddr) < 8 and len(sockaddr) > 1 and sockaddr[1] == socket.AF_INET:
+            # 掩码/零地址可能被截短
+            return socket.inet_ntoa(sockaddr[4:].ljust(4, b"\0"))
+        return None
+
+    @classmethod
+    def parse(cls, data):
+        """解析一次 recv 得到的路由消息"""
+        events = []
+        offset = 0
+        while offset + 4 <= len(data):
+            length, _, msg_type = struct.unpack_from("=HBB", data, offset)
+            if length < 4:
+                break
+            if msg_type in (cls.RTM_ADD, cls.RTM_DELETE, cls.RTM_CHANGE) and length >= cls.RT_MSGHDR_SIZE:
+                flags, addrs = struct.unpack_from("=ii", data, offset + 8)
+                sockaddrs = cls._sockaddrs(data, offset + cls.RT_MSGHDR_SIZE, offset + length, addrs)
+                dst = cls._ipv4(sockaddrs.get(cls.RTA_DST, b""))
+                gateway = sockaddrs.get(cls.RTA_GATEWAY, b"")
+                deleted = msg_type == cls.RTM_DELETE
+                if flags & cls.RTF_LLINFO and dst:
+                    # sockaddr_dl: sdl_nlen 在偏移 5，sdl_alen 在偏移 6，sdl_data 从偏移 8 开始
+                    if deleted:
+                        events.append(("neigh_del", dst, None))
+                    elif len(gateway) >= 8 and gateway[1] == cls.AF_LINK and gateway[6] == 6:
+                        start = 8 + gateway[5]
+                        events.append(("neigh", dst, ":".join(f"{b:02x}" for b in gateway[start:start + 6])))
+                elif dst == "0.0.0.0":
+                    events.append(("route_del" if deleted else "route", cls._ipv4(gateway), None))
+            offset += length
+        return events
+
+def open_event_source():
+    """按平台打开内核网络变化事件源"""
+    if hasattr(socket, "AF_NETLINK"):
+        return NetlinkEventSource()
+    return RoutingSocketEventSource()
+
+def collect_events(source, first_events, settle=WATCH_SETTLE_TIME):
+    """收到第一批事件后继续读取，直到 settle 秒内没有新事件"""
+    events = list(first_events)
+    while True:
+        readable, _, _ = select.select([source], [], [], settle)
+        if not readable:
+            return events
+        events.extend(source.read_events())
+
+def is_relevant_change(events, current_ip, current_mac):
+    """
+    判断事件中是否包含需要重新检查的变化：
+    默认路由的新增/删除/变化，或当前网关的邻居表项出现了不同的MAC
+    刷新ARP缓存本身产生的删除/同MAC重新添加不算变化
+    """
+    for kind, ip, mac in events:
+        if kind in ("route", "route_del"):
+            return True
+        if kind == "neigh" and ip == current_ip and mac != current_mac:
+            return True
+    return False
+
+def handle_router(current_ip, current_mac):
+    """根据当前网关执行对应的处理，返回执行动作的状态 HOME / AWAY"""
+    logger.info(f"当前网关IP: {current_ip}, MAC: {current_mac}")
+    if check_target_router_match(current_ip, current_mac):
+        handle_target_router_found()
+        return STATE_HOME
+    handle_normal_network()
+    return STATE_AWAY
+
+# 常驻模式的网络状态
+STATE_HOME = "HOME"                         # 连接到家庭网关
+STATE_AWAY = "AWAY"                         # 连接到其他网络
+STATE_UNKNOWN = "UNKNOWN"                   # 未获取到网关信息
+STATE_FILE = os.path.join(os.path.expanduser(LOG_DIR), "router_monitor_state.json")  # 状态保存路径
+DEBOUNCE_TIME = 5                           # 新状态需要持续的时间（秒）才会生效
+
+def classify_network(current_ip, current_mac):
+    """根据网关信息判断网络状态"""
+    if current_ip is None:
+        return STATE_UNKNOWN
+    if check_target_router_match(current_ip, current_mac):
+        return STATE_HOME
+    return STATE_AWAY
+
+class NetworkStateMachine:
+    """
+    HOME / AWAY / UNKNOWN 状态机
+    观察到的新状态需要持续 debounce 秒才会生效（期间变回原状态则取消）；
+    只有生效的 HOME/AWAY 与上次已执行动作的状态不同时才需要执行动作，
+    因此 Wi-Fi 短暂断开（HOME → UNKNOWN → HOME）不会重复退出应用和刷新DNS
+    state 和 applied 保存在 state_file 中，重启后不会重复执行动作
+    """
+    def __init__(self, state_file=STATE_FILE, debounce=DEBOUNCE_TIME):
+        self.state_file = state_file
+        self.debounce = debounce
+        self.state = STATE_UNKNOWN
+        self.applied = None
+        self.candidate = None
+        self.candidate_since = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("state") in (STATE_HOME, STATE_AWAY, STATE_UNKNOWN):
+            self.state = saved["state"]
+        if saved.get("applied") in (STATE_HOME, STATE_AWAY):
+            self.applied = saved["applied"]
+
+    def save(self):
+        """写入临时文件后替换，避免中断时留下半个文件"""
+        data = {"state": self.state, "applied": self.applied, "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.state_file)
+
+    def observe(self, observed, now=None):
+        """
+        记录一次观察结果
+        
+        Returns:
+            状态是否在本次生效（发生了转换）
+        """
+        now = time.monotonic() if now is None else now
+        if observed == self.state:
+            self.candidate = None
+            self.candidate_since = None
+            return False
+        if observed != self.candidate:
+            self.candidate = observed
+            self.candidate_since = now
+        if now - self.candidate_since < self.debounce:
+            return False
+        self.state = observed
+        self.candidate = None
+        self.candidate_since = None
+        self.save()
+        return True
+
+    def pending_deadline(self):
+        """等待生效的候选状态的到期时间（time.monotonic），没有候选状态时返回 None"""
+        if self.candidate is None:
+            return None
+        return self.candidate_since + self.debounce
+
+    def needs_action(self):
+        return self.state in (STATE_HOME, STATE_AWAY) and self.state != self.applied
+
+    def mark_applied(self):
+        self.applied = self.state
+        self.save()
+
+def apply_network_state(state):
+    """执行进入 HOME/AWAY 状态时的动作"""
+    if state == STATE_HOME:
+        handle_target_router_found()
+    elif state == STATE_AWAY:
+        handle_normal_network()
+
+def router_daemon(source=None, machine=None):
+    """
+    常驻模式：订阅内核的路由/邻居表变化通知，由 HOME / AWAY / UNKNOWN 状态机决定是否执行动作
+    只有默认路由或网关MAC变化时才重新检查网关，新状态持续 DEBOUNCE_TIME 秒后才生效，
+    且只在实际转换时执行动作；空闲时阻塞在 select 上。事件源不可用时每 CHECK_INTERVAL 秒轮询一次
+    
+    Args:
+        source: 事件源，默认按平台使用 rtnetlink 或路由套接字
+        machine: 状态机，默认从 STATE_FILE 恢复
+    """
     global logger
     logger = initialize_logger()
-    start_time = time.time()
+    initialize_metrics()
+    machine = machine or NetworkStateMachine()
+    logger.info(f"常驻模式，已保存的状态: {machine.state}，已执行动作的状态: {machine.applied}")
+    if source is None:
+        try:
+            source = open_event_source()
+        except OSError as e:
+            logger.warning(f"无法订阅网络变化通知: {str(e)}，改为每{CHECK_INTERVAL}秒轮询")
+    if source is not None:
+        logger.info(f"事件源: {type(source).__name__}")
     
+    detected_at = time.time()
+    
+    def check():
+        current_ip, current_mac = get_router_info_combined()
+        observed = classify_network(current_ip, current_mac)
+        logger.info(f"当前网关IP: {current_ip}, MAC: {current_mac}，判断为 {observed}")
+        if machine.observe(observed):
+            logger.info(f"网络状态变为 {machine.state}")
+            if machine.needs_action():
+                apply_network_state(machine.state)
+                machine.mark_applied()
+                # 包含 DEBOUNCE_TIME 的等待
+                observe_reconnect(detected_at, machine.state)
+            else:
+                logger.info("与上次执行动作时的状态相同，无需处理")
+        elif machine.candidate is not None:
+            logger.info(f"等待 {machine.candidate} 持续 {machine.debounce} 秒后生效")
+        return current_ip, current_mac
+    
+    try:
+        current_ip, current_mac = check()
+        # 首次运行或上次退出前动作未完成时补做
+        if machine.needs_action():
+            apply_network_state(machine.state)
+            machine.mark_applied()
+        while True:
+            deadline = machine.pending_deadline()
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            elif source is None:
+                timeout = CHECK_INTERVAL
+            else:
+                timeout = None
+            if source is None:
+                time.sleep(timeout)
+            else:
+                readable, _, _ = select.select([source], [], [], timeout)
+                if readable:
+                    events = collect_events(source, source.read_events())
+                    if not is_relevant_change(events, current_ip, current_mac):
+                        continue
+                    logger.info(f"检测到网络变化: {events}")
+                    if machine.candidate is None:
+                        detected_at = time.time()
+            current_ip, current_mac = check()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"常驻模式异常: {str(e)}")
+    finally:
+        if source is not None:
+            source.close()
+        logger.info("◀◀◀ 路由器监控结束")
+
+def check_router(event_time=None):
+    """
+    检查一次网关并处理，取不到网关时每 CHECK_INTERVAL 秒重试，最多 MAX_RETRY_TIME 秒
+    event_time 为事件发生的时间（预热模式由 warm_helper 传入），用于记录检测到动作完成的耗时
+    """
+    start_time = time.time()
     try:
         while (time.time() - start_time) < MAX_RETRY_TIME:
             current_ip, current_mac = get_router_info_combined()
@@ -306,25 +1017,50 @@ def router_monitor():
                 logger.warning("未获取到路由器信息，重试...")
                 time.sleep(CHECK_INTERVAL)
                 continue
-            logger.info(f"当前网关IP: {current_ip}, MAC: {current_mac}")
-            if check_target_router_match(current_ip, current_mac):
-                handle_target_router_found()
-                break
-            else:
-                handle_normal_network()
-                break
+            state = handle_router(current_ip, current_mac)
+            observe_reconnect(event_time or start_time, state)
+            break
         else:
             logger.warning("超时：未检测到有效路由器信息")
             flush_dns()  # 超时情况下也刷新DNS
     except Exception as e:
         logger.error(f"监控异常: {str(e)}")
         flush_dns()  # 异常情况下也刷新DNS
+
+def router_monitor():
+    """主路由器监控函数"""
+    global logger
+    logger = initialize_logger()
+    initialize_metrics()
+    try:
+        check_router()
+    finally:
+        logger.info("◀◀◀ 路由器监控结束")
+
+def router_warm():
+    """
+    预热模式：常驻并保持模块已导入、日志和线程池已初始化
+    launchd 启动的 warm_helper.py 通过 Unix 套接字把事件交给本进程，每个事件执行一次 check_router()
+    """
+    global logger
+    logger = initialize_logger()
+    initialize_metrics()
+    get_gateway_executor()
+    try:
+        warm_helper.serve(warm_helper.socket_path(__file__), check_router, logger)
+    except KeyboardInterrupt:
+        pass
     finally:
         logger.info("◀◀◀ 路由器监控结束")
 
 def debug_router():
     """调试模式：显示路由器信息"""
     print("=== 路由器调试信息 ===")
+    if native_tables():
+        print(f"进程内ARP表（{net_tables.get_backend().name}）：")
+        for ip, mac in net_tables.read_arp_table().items():
+            print(f"  {ip} → {mac}")
+        print(f"默认路由: {net_tables.read_default_routes()}")
     try:
         arp_output = subprocess.check_output(["arp", "-a"], text=True, stderr=subprocess.DEVNULL)
         print("ARP表内容：")
@@ -346,10 +1082,21 @@ def debug_router():
     
     match = check_target_router_match(ip3, mac3)
     print(f"是否匹配目标路由器: {match}")
+    
+    print("\n=== 网关获取方式统计 ===")
+    for line in get_backend_stats().summary():
+        print(line)
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "debug":
         debug_router()
+    elif len(sys.argv) > 1 and sys.argv[1] in ("daemon", "watch"):
+        router_daemon()
+    elif len(sys.argv) > 1 and sys.argv[1] == "warm":
+        if warm_helper is None:
+            print("预热模式需要与本脚本放在同一目录的 warm_helper.py")
+            sys.exit(1)
+        router_warm()
     else:
         router_monitor()
     sys.exit(0)
\ No newline at end of file
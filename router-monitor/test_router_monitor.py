@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+router_monitor 常驻模式的单元测试（只使用标准库 unittest）
+用 socketpair 模拟内核网络变化事件源，不需要 rtnetlink / 路由套接字
+
+用法:
+    python3 -m unittest test_router_monitor
+    python3 -m pytest test_router_monitor.py
+"""
+
+import os
+import socket
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+import router_monitor
+from router_monitor import STATE_HOME, STATE_AWAY, STATE_UNKNOWN
+
+HOME = (router_monitor.HOME_GATEWAY_IP, router_monitor.HOME_GATEWAY_MAC)
+OTHER = ("192.168.50.1", "aa:bb:cc:dd:ee:ff")
+
+
+class FakeEventSource:
+    """
+    与 NetlinkEventSource / RoutingSocketEventSource 接口相同的事件源
+    push() 写入一个字节使 select 可读，read_events() 读出该字节并返回对应的一批事件
+    """
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.batches = []
+        self.closed = False
+
+    def push(self, events):
+        """events 为 None 时 read_events() 抛出 KeyboardInterrupt，用于结束常驻循环"""
+        self.batches.append(events)
+        self.writer.send(b"x")
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def read_events(self):
+        self.reader.recv(1)
+        events = self.batches.pop(0)
+        if events is None:
+            raise KeyboardInterrupt
+        return events
+
+    def close(self):
+        self.closed = True
+        self.reader.close()
+        self.writer.close()
+
+
+class StateFileTestCase(unittest.TestCase):
+    def setUp(self):
+        router_monitor.logger = logging.getLogger("test_router_monitor")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmp.name, "state.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class NetworkStateMachineTest(StateFileTestCase):
+    """防抖和已执行动作状态的持久化"""
+
+    def test_new_state_takes_effect_after_debounce(self):
+        machine = router_monitor.NetworkStateMachine(self.state_file, debounce=5)
+        self.assertFalse(machine.observe(STATE_HOME, now=100))
+        self.assertEqual(machine.pending_deadline(), 105)
+        self.assertFalse(machine.observe(STATE_HOME, now=104))
+        self.assertTrue(machine.observe(STATE_HOME, now=105))
+        self.assertEqual(machine.state, STATE_HOME)
+        self.assertIsNone(machine.pending_deadline())
+        self.assertTrue(machine.needs_action())
+
+    def test_flap_back_cancels_candidate(self):
+        machine = router_monitor.NetworkStateMachine(self.state_file, debounce=5)
+        machine.observe(STATE_HOME, now=0)
+        machine.observe(STATE_HOME, now=5)
+        machine.mark_applied()
+        self.assertFalse(machine.observe(STATE_AWAY, now=10))
+        self.assertFalse(machine.observe(STATE_HOME, now=12))
+        self.assertIsNone(machine.candidate)
+        self.assertFalse(machine.observe(STATE_AWAY, now=16))
+        self.assertEqual(machine.state, STATE_HOME)
+
+    def test_brief_disconnect_does_not_repeat_action(self):
+        machine = router_monitor.NetworkStateMachine(self.state_file, debounce=0)
+        machine.observe(STATE_HOME, now=0)
+        machine.mark_applied()
+        self.assertTrue(machine.observe(STATE_UNKNOWN, now=1))
+        self.assertFalse(machine.needs_action())
+        self.assertTrue(machine.observe(STATE_HOME, now=2))
+        self.assertFalse(machine.needs_action())
+
+    def test_state_survives_restart(self):
+        machine = router_monitor.NetworkStateMachine(self.state_file, debounce=0)
+        machine.observe(STATE_AWAY, now=0)
+        machine.mark_applied()
+        restored = router_monitor.NetworkStateMachine(self.state_file, debounce=0)
+        self.assertEqual(restored.state, STATE_AWAY)
+        self.assertEqual(restored.applied, STATE_AWAY)
+        self.assertFalse(restored.needs_action())
+
+
+class EventHandlingTest(unittest.TestCase):
+    """事件合并和变化判断"""
+
+    def setUp(self):
+        self.source = FakeEventSource()
+
+    def tearDown(self):
+        self.source.close()
+
+    def test_collect_events_merges_burst(self):
+        self.source.push([("neigh_del", HOME[0], None)])
+        self.source.push([("route", HOME[0], None)])
+        events = router_monitor.collect_events(self.source, [("route_del", None, None)], settle=0.05)
+        self.assertEqual(events, [("route_del", None, None), ("neigh_del", HOME[0], None), ("route", HOME[0], None)])
+
+    def test_arp_refresh_is_not_a_change(self):
+        events = [("neigh_del", HOME[0], None), ("neigh", HOME[0], HOME[1]), ("neigh", OTHER[0], OTHER[1])]
+        self.assertFalse(router_monitor.is_relevant_change(events, *HOME))
+
+    def test_route_or_new_gateway_mac_is_a_change(self):
+        self.assertTrue(router_monitor.is_relevant_change([("route_del", None, None)], *HOME))
+        self.assertTrue(router_monitor.is_relevant_change([("neigh", HOME[0], OTHER[1])], *HOME))
+
+
+class RouterDaemonTest(StateFileTestCase):
+    """通过模拟事件源驱动 router_daemon 的完整循环"""
+
+    def run_daemon(self, steps):
+        """
+        steps 为 [(事件, 本次检查返回的网关)]：第一项的事件为空，对应启动时的检查
+        每次检查后推送下一批事件，全部用完后推送结束标记
+        """
+        source = FakeEventSource()
+        machine = router_monitor.NetworkStateMachine(self.state_file, debounce=0)
+        steps = list(steps)
+        applied = []
+
+        def get_router_info_combined():
+            _, gateway = steps.pop(0)
+            source.push(steps[0][0] if steps else None)
+            return gateway
+
+        with mock.patch.object(router_monitor, "initialize_logger", return_value=router_monitor.logger), \
+                mock.patch.object(router_monitor, "initialize_metrics"), \
+                mock.patch.object(router_monitor, "get_router_info_combined", get_router_info_combined), \
+                mock.patch.object(router_monitor, "apply_network_state", applied.append):
+            router_monitor.router_daemon(source, machine)
+        self.assertTrue(source.closed)
+        self.assertEqual(steps, [])
+        return machine, applied
+
+    def test_acts_once_per_transition(self):
+        machine, applied = self.run_daemon([
+            ([], HOME),
+            ([("route_del", None, None)], (None, None)),
+            ([("route", HOME[0], None)], HOME),
+            ([("route", OTHER[0], None)], OTHER),
+        ])
+        self.assertEqual(applied, [STATE_HOME, STATE_AWAY])
+        self.assertEqual(machine.applied, STATE_AWAY)
+
+    def test_restored_state_skips_startup_action(self):
+        saved = router_monitor.NetworkStateMachine(self.state_file, debounce=0)
+        saved.observe(STATE_HOME, now=0)
+        saved.mark_applied()
+        machine, applied = self.run_daemon([
+            ([], HOME),
+            ([("neigh", HOME[0], OTHER[1])], OTHER),
+        ])
+        self.assertEqual(applied, [STATE_AWAY])
+
+
+if __name__ == "__main__":
+    unittest.main()
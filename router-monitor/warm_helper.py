@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 常驻预热进程与 launchd 启动桩
+# launchd 每次网络变化都重新启动 Python 并导入全部模块，耗时远超检查本身
+# 预热进程（router_monitor.py warm / dns_monitor.py warm）常驻运行，模块已导入、日志已初始化；
+# launchd 改为启动本脚本：只导入 os、sys、time、socket，把事件通过 Unix 套接字交给预热进程后立即退出，
+# 预热进程没有运行时直接执行原脚本，行为与以前相同
+#
+# 用法（launchd 的 ProgramArguments）:
+#   warm_helper.py ~/Library/LaunchAgents/router_monitor.py
+import os
+import sys
+import time
+import socket
+
+HANDOFF_TIMEOUT = 0.5                       # 等待预热进程确认的最长时间（秒），超时则直接执行原脚本
+
+def socket_path(script_path):
+    """预热进程的套接字路径：与脚本同目录、同名的 .sock 文件"""
+    return os.path.splitext(os.path.abspath(os.path.expanduser(script_path)))[0] + ".sock"
+
+def hand_off(path, timeout=HANDOFF_TIMEOUT):
+    """把一次事件交给预热进程，返回预热进程是否已确认"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(f"run {time.time()}\n".encode())
+            return sock.makefile("rb").readline().strip() == b"ok"
+    except OSError:
+        return False
+
+def _bind(path):
+    """监听 path；已有预热进程在监听时抛出 OSError，残留的套接字文件会被删除"""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        raise OSError(f"已有预热进程在监听 {path}")
+    except (FileNotFoundError, ConnectionRefusedError):
+        if os.path.exists(path):
+            os.unlink(path)
+    finally:
+        probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    return server
+
+def serve(path, handler, logger):
+    """
+    在 path 上监听事件，收到后立即确认，由工作线程调用 handler(最早的事件时间)
+    handler 运行期间到达的事件合并为结束后的一次调用；记录从事件发生到开始处理的耗时
+    """
+    import threading
+    lock = threading.Lock()
+    pending = threading.Event()
+    state = {"first_event": None, "events": 0}
+
+    def worker():
+        while True:
+            pending.wait()
+            with lock:
+                pending.clear()
+                first_event, events = state["first_event"], state["events"]
+                state["first_event"], state["events"] = None, 0
+            delay = (time.time() - first_event) * 1000 if first_event else 0
+            logger.info(f"预热进程开始处理 {events} 个事件，距事件发生 {delay:.1f}ms")
+            try:
+                handler(first_event)
+            except Exception as e:
+                logger.error(f"预热进程处理事件失败: {str(e)}")
+
+    server = _bind(path)
+    threading.Thread(target=worker, name="warm-worker", daemon=True).start()
+    logger.info(f"预热进程已就绪: {path}")
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                conn.settimeout(1)
+                try:
+                    line = conn.makefile("rb").readline().split()
+                    if not line or line[0] != b"run":
+                        conn.sendall(b"error\n")
+                        continue
+                    try:
+                        event_time = float(line[1])
+                    except (IndexError, ValueError):
+                        event_time = time.time()
+                    with lock:
+                        if state["first_event"] is None or event_time < state["first_event"]:
+                            state["first_event"] = event_time
+                        state["events"] += 1
+                        pending.set()
+                    conn.sendall(b"ok\n")
+                except OSError:
+                    continue
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: warm_helper.py <脚本路径> [参数...]")
+        sys.exit(1)
+    script = os.path.expanduser(sys.argv[1])
+    # 只有默认的单次检查交给预热进程，debug 等其他模式直接执行原脚本
+    if len(sys.argv) == 2 and hand_off(socket_path(script)):
+        sys.exit(0)
+    os.execv(sys.executable, [sys.executable, script] + sys.argv[2:])